@@ -0,0 +1,362 @@
+from __future__ import annotations
+
+from collections import Counter, deque
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import re
+import threading
+import time
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+
+ANNOTATED_ADDED = re.compile(r"^\+(\d+): ", re.MULTILINE)
+ANNOTATED_FILE = re.compile(r"^File: (.+)$", re.MULTILINE)
+HUNK_HEADER = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)")
+
+
+class _RateWindow:
+    # At most `limit` requests per rolling second; 0 = unlimited.
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self._times: Deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        if self.limit <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            while self._times and now - self._times[0] >= 1.0:
+                self._times.popleft()
+            if len(self._times) >= self.limit:
+                return False
+            self._times.append(now)
+            return True
+
+
+class FakeServer:
+    # In-process HTTP server on an ephemeral port, served from a background
+    # thread. Subclasses implement route(method, path, query, body).
+
+    def __init__(self, latency: float = 0.0, rate_limit: int = 0) -> None:
+        self.latency = latency
+        self.window = _RateWindow(rate_limit)
+        self.calls: Counter = Counter()
+        self.throttled = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                server._handle(self, "GET")
+
+            def do_POST(self) -> None:
+                server._handle(self, "POST")
+
+            def do_PUT(self) -> None:
+                server._handle(self, "PUT")
+
+            def do_HEAD(self) -> None:
+                server._handle(self, "HEAD")
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "FakeServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def route(
+        self, method: str, path: str, query: Dict[str, str], body: Any
+    ) -> Tuple[int, Dict[str, str], Any]:
+        raise NotImplementedError
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.calls[name] += 1
+
+    def _handle(self, handler: BaseHTTPRequestHandler, method: str) -> None:
+        length = int(handler.headers.get("Content-Length") or 0)
+        raw = handler.rfile.read(length) if length else b""
+        if self.latency:
+            time.sleep(self.latency)
+        if not self.window.allow():
+            with self._lock:
+                self.throttled += 1
+            self._write(handler, 429, {"Retry-After": "1"}, {"message": "429 Too Many Requests"})
+            return
+        parsed = urlparse(handler.path)
+        query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        body = json.loads(raw) if raw else None
+        status, headers, payload = self.route(method, parsed.path, query, body)
+        if method == "HEAD":
+            handler.send_response(status)
+            handler.send_header("Content-Length", "0")
+            for name, value in headers.items():
+                handler.send_header(name, value)
+            handler.end_headers()
+        elif isinstance(payload, bytes):
+            self._write_stream(handler, status, headers, [payload], "application/octet-stream")
+        elif isinstance(payload, list) and payload and isinstance(payload[0], bytes):
+            self._write_stream(handler, status, headers, payload)
+        else:
+            self._write(handler, status, headers, payload)
+
+    @staticmethod
+    def _write(
+        handler: BaseHTTPRequestHandler, status: int, headers: Dict[str, str], payload: Any
+    ) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    @staticmethod
+    def _write_stream(
+        handler: BaseHTTPRequestHandler,
+        status: int,
+        headers: Dict[str, str],
+        events: List[bytes],
+        content_type: str = "text/event-stream",
+    ) -> None:
+        data = b"".join(events)
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+
+class FakeGitLab(FakeServer):
+    # Serves one merge request: its /diffs pages, commits, notes and
+    # discussions. Posted notes and discussions are kept and listed back;
+    # notes can be edited and discussions resolved. Repository files at
+    # head come from `files`, or are rebuilt from the diff (lines outside
+    # the hunks left empty).
+
+    ROUTES = (
+        ("diffs", re.compile(r"/api/v4/projects/[^/]+/merge_requests/[^/]+/diffs$")),
+        ("changes", re.compile(r"/api/v4/projects/[^/]+/merge_requests/[^/]+/changes$")),
+        ("commits", re.compile(r"/api/v4/projects/[^/]+/merge_requests/[^/]+/commits$")),
+        ("notes", re.compile(r"/api/v4/projects/[^/]+/merge_requests/[^/]+/notes$")),
+        ("note", re.compile(r"/api/v4/projects/[^/]+/merge_requests/[^/]+/notes/(\d+)$")),
+        ("discussions", re.compile(r"/api/v4/projects/[^/]+/merge_requests/[^/]+/discussions$")),
+        ("discussion", re.compile(r"/api/v4/projects/[^/]+/merge_requests/[^/]+/discussions/(.+)$")),
+        ("merge_request", re.compile(r"/api/v4/projects/[^/]+/merge_requests/[^/]+$")),
+        ("compare", re.compile(r"/api/v4/projects/[^/]+/repository/compare$")),
+        ("file", re.compile(r"/api/v4/projects/[^/]+/repository/files/([^/]+)$")),
+        ("blob", re.compile(r"/api/v4/projects/[^/]+/repository/blobs/([0-9a-f]+)/raw$")),
+    )
+
+    def __init__(
+        self,
+        mr: Dict[str, Any],
+        diffs: Sequence[Dict[str, Any]],
+        latency: float = 0.0,
+        rate_limit: int = 0,
+    ) -> None:
+        super().__init__(latency, rate_limit)
+        self.mr = mr
+        self.diffs = list(diffs)
+        self.notes: List[Dict[str, Any]] = []
+        self.discussions: List[Dict[str, Any]] = []
+        self.files: Dict[str, str] = {}
+        self.blobs: Dict[str, bytes] = {}
+
+    def route(
+        self, method: str, path: str, query: Dict[str, str], body: Any
+    ) -> Tuple[int, Dict[str, str], Any]:
+        for name, pattern in self.ROUTES:
+            match = pattern.match(path)
+            if match:
+                break
+        else:
+            return 404, {}, {"message": "404 Not Found"}
+        self.count(f"{method} {name}")
+        if name == "merge_request":
+            return 200, {}, self.mr
+        if name == "commits":
+            commit = {"id": self.mr["diff_refs"]["head_sha"], "title": "Synthetic"}
+            return self._page([commit], query)
+        if name == "diffs":
+            return self._page(self.diffs, query)
+        if name == "changes":
+            return 200, {}, {"changes": self.diffs}
+        if name == "compare":
+            return 200, {}, {"diffs": self.diffs}
+        if name == "file":
+            return self._file(unquote(match.group(1)))
+        if name == "blob":
+            content = self.blobs.get(match.group(1))
+            if content is None:
+                return 404, {}, {"message": "404 Blob Not Found"}
+            return 200, {}, content
+        if name in ("note", "discussion"):
+            return self._edit(name, match.group(1), query, body)
+        items = self.notes if name == "notes" else self.discussions
+        if method == "GET":
+            if query.get("sort") == "desc":
+                items = items[::-1]
+            return self._page(items, query)
+        with self._lock:
+            item_id = len(items) + 1
+            if name == "notes":
+                item = {"id": item_id, "body": body.get("body"), "system": False}
+            else:
+                note = {"id": item_id, "body": body.get("body"), "position": body.get("position")}
+                item = {"id": f"d{item_id}", "notes": [note]}
+            items.append(item)
+        return 201, {}, item
+
+    def _edit(
+        self, name: str, item_id: str, query: Dict[str, str], body: Any
+    ) -> Tuple[int, Dict[str, str], Any]:
+        with self._lock:
+            if name == "note":
+                for note in self.notes:
+                    if str(note["id"]) == item_id:
+                        note["body"] = body.get("body")
+                        return 200, {}, note
+            else:
+                for discussion in self.discussions:
+                    if discussion["id"] == item_id:
+                        for note in discussion["notes"]:
+                            note["resolved"] = query.get("resolved") == "true"
+                        return 200, {}, discussion
+        return 404, {}, {"message": "404 Not Found"}
+
+    def _file(self, path: str) -> Tuple[int, Dict[str, str], Any]:
+        text = self.files.get(path)
+        if text is None:
+            for change in self.diffs:
+                if change.get("new_path") == path and not change.get("deleted_file"):
+                    text = _post_image(change.get("diff") or "")
+                    break
+            else:
+                return 404, {}, {"message": "404 File Not Found"}
+        content = text.encode("utf-8")
+        blob_id = hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+        with self._lock:
+            self.blobs[blob_id] = content
+        return 200, {"X-Gitlab-Blob-Id": blob_id, "X-Gitlab-Size": str(len(content))}, None
+
+    @staticmethod
+    def _page(items: Sequence[Any], query: Dict[str, str]) -> Tuple[int, Dict[str, str], Any]:
+        per_page = int(query.get("per_page", 20))
+        page = int(query.get("page", 1))
+        start = (page - 1) * per_page
+        headers = {
+            "X-Next-Page": str(page + 1) if start + per_page < len(items) else "",
+            "X-Total": str(len(items)),
+        }
+        return 200, headers, list(items[start : start + per_page])
+
+
+def _post_image(diff: str) -> str:
+    lines: Dict[int, str] = {}
+    new_line = 0
+    for raw in diff.splitlines():
+        header = HUNK_HEADER.match(raw)
+        if header:
+            new_line = int(header.group(1))
+        elif raw[:1] in ("+", " "):
+            lines[new_line] = raw[1:]
+            new_line += 1
+    last = max(lines, default=0)
+    return "".join(lines.get(number, "") + "\n" for number in range(1, last + 1))
+
+
+class FakeLLM(FakeServer):
+    # OpenAI-compatible /v1/chat/completions. Answers with one finding per
+    # `finding_every` added lines of the annotated diff, plain or streamed.
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        rate_limit: int = 0,
+        finding_every: int = 15,
+        tokens_per_second: float = 0.0,
+    ) -> None:
+        super().__init__(latency, rate_limit)
+        self.finding_every = finding_every
+        self.tokens_per_second = tokens_per_second
+        self.prompt_chars = 0
+
+    def route(
+        self, method: str, path: str, query: Dict[str, str], body: Any
+    ) -> Tuple[int, Dict[str, str], Any]:
+        if method != "POST" or not path.endswith("/chat/completions"):
+            return 404, {}, {"error": {"message": "not found"}}
+        self.count("chat")
+        self.count(f"chat:{body.get('model')}")
+        prompt = "\n".join(message.get("content", "") for message in body.get("messages", []))
+        with self._lock:
+            self.prompt_chars += len(prompt)
+        reply = self._findings(prompt)
+        if '"risk"' in prompt:
+            # Screening tier: the risk grows with the number of added lines.
+            reply["risk"] = min(1.0, self._added_lines(prompt) / 100)
+        content = json.dumps(reply)
+        if self.tokens_per_second:
+            time.sleep(len(content) / 4 / self.tokens_per_second)
+        if body.get("stream"):
+            step = 40
+            events = []
+            for start in range(0, len(content), step):
+                delta = {"choices": [{"delta": {"content": content[start : start + step]}}]}
+                events.append(b"data: " + json.dumps(delta).encode("utf-8") + b"\n\n")
+            events.append(b"data: [DONE]\n\n")
+            return 200, {}, events
+        return 200, {}, {"choices": [{"message": {"content": content}}]}
+
+    @staticmethod
+    def _added_lines(prompt: str) -> int:
+        return sum(1 for line in prompt.splitlines() if ANNOTATED_ADDED.match(line))
+
+    def _findings(self, prompt: str) -> Dict[str, Any]:
+        findings: List[Dict[str, Any]] = []
+        path: Optional[str] = None
+        count = 0
+        for line in prompt.splitlines():
+            file_match = ANNOTATED_FILE.match(line)
+            if file_match:
+                path = file_match.group(1)
+                continue
+            added = ANNOTATED_ADDED.match(line)
+            if not added or path is None:
+                continue
+            count += 1
+            if count % self.finding_every == 0:
+                findings.append(
+                    {
+                        "path": path,
+                        "line": int(added.group(1)),
+                        "severity": "low",
+                        "message": "Consider extracting this expression into a named helper.",
+                        "rule_id": "LLM_READABILITY",
+                    }
+                )
+        return {"findings": findings}
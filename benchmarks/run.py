@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import argparse
+import contextlib
+import json
+import os
+from pathlib import Path
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT / "src") not in sys.path:
+    sys.path.insert(0, str(ROOT / "src"))
+
+from benchmarks.fake_servers import FakeGitLab, FakeLLM  # noqa: E402
+from benchmarks.synthetic import MRSpec, describe, generate_mr  # noqa: E402
+
+ALL_LANGUAGES = ("python", "javascript", "go", "markdown")
+SCENARIOS: Dict[str, MRSpec] = {
+    "small": MRSpec(files=10, hunks_per_file=2, hunk_lines=20),
+    "medium": MRSpec(files=100, hunks_per_file=4, hunk_lines=30, languages=ALL_LANGUAGES),
+    "large": MRSpec(files=600, hunks_per_file=5, hunk_lines=40, languages=ALL_LANGUAGES),
+    "minified": MRSpec(files=20, minified_files=5),
+    "huge-file": MRSpec(files=2, huge_files=1, huge_file_lines=50000),
+}
+MODES = ("rules", "llm")
+# Fields that vary from run to run; everything else must be identical
+# between two runs of the same commit.
+TIMING_FIELDS = ("wall_seconds", "phases")
+
+
+def run_scenario(name: str, mode: str, args: argparse.Namespace) -> Dict[str, Any]:
+    from agent_mr_reviewer.cli import build_setup, parse_args, review
+    from agent_mr_reviewer.diff_parser import parse_changes
+    from agent_mr_reviewer.llm_review import chunk_texts, iter_annotated_diff
+    from agent_mr_reviewer.review_rules import analyze_diff
+
+    spec = SCENARIOS[name]
+    mr, diffs = generate_mr(spec)
+    result: Dict[str, Any] = {"scenario": name, "mode": mode, "input": describe(diffs)}
+    phases: Dict[str, float] = {}
+    # Measured once around the whole run: the phases overlap (the full
+    # review parses, runs the rules and chunks again), so they do not add up.
+    run_started = time.perf_counter()
+
+    started = time.perf_counter()
+    files = list(parse_changes(diffs))
+    phases["parse"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    result["rule_findings"] = len(analyze_diff(files))
+    phases["rules"] = time.perf_counter() - started
+
+    if mode == "llm":
+        from agent_mr_reviewer.tokenizer import get_encoding
+
+        try:
+            started = time.perf_counter()
+            encoding = get_encoding()
+            phases["tokenizer_load"] = time.perf_counter() - started
+        except RuntimeError as exc:
+            return {**result, "skipped": str(exc).split(" (", 1)[0]}
+        started = time.perf_counter()
+        result["chunks"] = len(chunk_texts(iter_annotated_diff(files), 12000, encoding))
+        phases["chunking"] = time.perf_counter() - started
+    del files
+
+    os.environ["BENCH_GITLAB_TOKEN"] = "bench"
+    os.environ["BENCH_LLM_KEY"] = "bench"
+    gitlab = FakeGitLab(mr, diffs, latency=args.gitlab_latency, rate_limit=args.gitlab_rate_limit)
+    llm = FakeLLM(latency=args.llm_latency, rate_limit=args.llm_rate_limit)
+    with gitlab, llm:
+        cli_args = [
+            "--gitlab-url", gitlab.url,
+            "--project-id", "1",
+            "--mr-iid", "1",
+            "--token-env", "BENCH_GITLAB_TOKEN",
+            "--llm-base-url", llm.url,
+            "--llm-model", "bench",
+            "--llm-api-key-env", "BENCH_LLM_KEY",
+            "--no-llm-cache",
+        ]
+        if mode == "rules":
+            cli_args.append("--llm-disable")
+        cli_args.extend(args.review_arg or [])
+        setup = build_setup(parse_args(cli_args))
+        started = time.perf_counter()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            review(setup, "1", "1")
+        phases["review"] = time.perf_counter() - started
+    wall_seconds = time.perf_counter() - run_started
+
+    result["gitlab_calls"] = dict(sorted(gitlab.calls.items()))
+    result["gitlab_throttled"] = gitlab.throttled
+    result["discussions_posted"] = len(gitlab.discussions)
+    result["llm_calls"] = llm.calls.get("chat", 0)
+    result["llm_throttled"] = llm.throttled
+    result["llm_prompt_tokens"] = setup.prompt_stats.prompt_tokens
+    result["llm_prompt_chars"] = llm.prompt_chars
+    result["wall_seconds"] = wall_seconds
+    result["phases"] = phases
+    # ru_maxrss is in KiB on Linux, bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result["peak_rss_mb"] = round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    return result
+
+
+def run_isolated(name: str, mode: str, argv: List[str]) -> Dict[str, Any]:
+    # One process per run, so peak RSS belongs to this scenario alone.
+    completed = subprocess.run(
+        [sys.executable, "-m", "benchmarks.run", "--worker", name, mode, *argv],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if completed.returncode != 0:
+        return {"scenario": name, "mode": mode, "error": completed.stderr.strip().splitlines()[-1:]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def merge_runs(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # Median timings over the repeats; counters come from the first run.
+    merged = dict(runs[0])
+    if "phases" not in merged:
+        return merged
+    merged["wall_seconds"] = round(statistics.median(run["wall_seconds"] for run in runs), 4)
+    merged["phases"] = {
+        phase: round(statistics.median(run["phases"][phase] for run in runs), 4)
+        for phase in runs[0]["phases"]
+    }
+    merged["peak_rss_mb"] = max(run["peak_rss_mb"] for run in runs)
+    return merged
+
+
+def compare(previous: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    lines: List[str] = []
+    for key, result in current["results"].items():
+        before = previous.get("results", {}).get(key)
+        if not before or "wall_seconds" not in before or "wall_seconds" not in result:
+            continue
+        ratio = result["wall_seconds"] / before["wall_seconds"] if before["wall_seconds"] else 0
+        lines.append(
+            f"{key:20} {before['wall_seconds']:9.3f}s -> {result['wall_seconds']:9.3f}s "
+            f"(x{ratio:.2f})  rss {before['peak_rss_mb']} -> {result['peak_rss_mb']} MB"
+        )
+        for field in sorted(set(before) | set(result)):
+            if field in TIMING_FIELDS or field == "peak_rss_mb":
+                continue
+            if before.get(field) != result.get(field):
+                lines.append(f"  {field}: {before.get(field)} -> {result.get(field)}")
+    return lines
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="agent-mr-reviewer benchmarks")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS))
+    parser.add_argument("--mode", action="append", choices=MODES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--gitlab-latency", type=float, default=0.005)
+    parser.add_argument("--gitlab-rate-limit", type=int, default=0)
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--llm-rate-limit", type=int, default=0)
+    parser.add_argument("--review-arg", action="append", help="extra CLI option for run_review")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--compare", help="previous JSON report to compare with")
+    parser.add_argument("--worker", nargs=2, metavar=("SCENARIO", "MODE"), help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = list(sys.argv[1:] if argv is None else argv)
+    args = parse_args(argv)
+    if args.worker:
+        print(json.dumps(run_scenario(args.worker[0], args.worker[1], args)))
+        return 0
+
+    passthrough = [
+        "--gitlab-latency", str(args.gitlab_latency),
+        "--gitlab-rate-limit", str(args.gitlab_rate_limit),
+        "--llm-latency", str(args.llm_latency),
+        "--llm-rate-limit", str(args.llm_rate_limit),
+    ]
+    for extra in args.review_arg or []:
+        passthrough.append(f"--review-arg={extra}")
+
+    results: Dict[str, Any] = {}
+    for name in args.scenario or list(SCENARIOS):
+        for mode in args.mode or list(MODES):
+            runs = [run_isolated(name, mode, passthrough) for _ in range(max(1, args.repeat))]
+            results[f"{name}/{mode}"] = merge_runs(runs)
+            summary = results[f"{name}/{mode}"]
+            status = summary.get("skipped") or summary.get("error")
+            if not status:
+                status = f"{summary['wall_seconds']:.3f}s"
+            print(f"{name}/{mode}: {status}", file=sys.stderr)
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(terse=True),
+            "commit": _git_commit(),
+        },
+        "settings": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("worker", "output", "compare")
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+    if args.compare:
+        previous = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        for line in compare(previous, report):
+            print(line, file=sys.stderr)
+    return 0
+
+
+def _git_commit() -> str:
+    completed = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True
+    )
+    return completed.stdout.strip()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+import random
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+# Line generators per language. Every few lines carry something the rule
+# engine reacts to (naming, print, TODO, long lines) so rule paths are
+# exercised as well.
+
+
+def _python_line(rng: random.Random, index: int) -> str:
+    choice = rng.random()
+    if choice < 0.05:
+        return f"def {rng.choice(['compute', 'Compute', 'load_data'])}_{index}(value):"
+    if choice < 0.08:
+        return f"    print(value_{index})"
+    if choice < 0.10:
+        return f"    # TODO handle value_{index}"
+    if choice < 0.12:
+        return f"class {rng.choice(['Loader', 'bad_name'])}{index}:"
+    call = f"transform_{rng.randrange(50)}(value_{index - 1}, {rng.randrange(1000)})"
+    return f"    value_{index} = {call}"
+
+
+def _javascript_line(rng: random.Random, index: int) -> str:
+    if rng.random() < 0.05:
+        return f"// TODO refactor block {index}"
+    return f"  const item{index} = await fetchItem(item{index - 1}, {rng.randrange(1000)});"
+
+
+def _go_line(rng: random.Random, index: int) -> str:
+    if rng.random() < 0.05:
+        return f"\tlog.Printf(\"step %d\", {index})"
+    return f"\tresult{index}, err := process(ctx, result{index - 1}, {rng.randrange(1000)})"
+
+
+def _markdown_line(rng: random.Random, index: int) -> str:
+    words = ["review", "merge", "request", "pipeline", "token", "latency", "cache", "diff"]
+    return " ".join(rng.choice(words) for _ in range(rng.randrange(6, 16)))
+
+
+LANGUAGES: Dict[str, Tuple[str, Callable[[random.Random, int], str]]] = {
+    "python": (".py", _python_line),
+    "javascript": (".js", _javascript_line),
+    "go": (".go", _go_line),
+    "markdown": (".md", _markdown_line),
+}
+
+
+@dataclass(frozen=True)
+class MRSpec:
+    files: int = 20
+    hunks_per_file: int = 3
+    hunk_lines: int = 20
+    languages: Tuple[str, ...] = ("python", "javascript")
+    # Pathological cases.
+    minified_files: int = 0
+    minified_line_chars: int = 20000
+    huge_files: int = 0
+    huge_file_lines: int = 20000
+    seed: int = 1
+
+
+def generate_mr(spec: MRSpec) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    # Returns the MR object and its /diffs entries; the same spec always
+    # produces the same bytes.
+    rng = random.Random(spec.seed)
+    diffs: List[Dict[str, Any]] = []
+    for index in range(spec.files):
+        language = spec.languages[index % len(spec.languages)]
+        extension, line = LANGUAGES[language]
+        path = f"src/{language}/module_{index}{extension}"
+        diffs.append(_change(path, _hunks(rng, line, spec.hunks_per_file, spec.hunk_lines)))
+    for index in range(spec.minified_files):
+        content = ";".join(f"var a{n}=b{n}(c{n})" for n in range(spec.minified_line_chars // 16))
+        diff = f"@@ -1,1 +1,1 @@\n-{content[::-1]}\n+{content}\n"
+        diffs.append(_change(f"static/bundle_{index}.min.js", diff))
+    for index in range(spec.huge_files):
+        language = spec.languages[index % len(spec.languages)]
+        extension, line = LANGUAGES[language]
+        body = "\n".join(f"+{line(rng, n)}" for n in range(1, spec.huge_file_lines + 1))
+        diffs.append(
+            _change(
+                f"src/generated_{index}/huge{extension}",
+                f"@@ -0,0 +1,{spec.huge_file_lines} @@\n{body}\n",
+                new_file=True,
+            )
+        )
+    mr = {
+        "iid": 1,
+        "title": "Synthetic benchmark merge request",
+        "description": "Generated change set.\n\n" + "Details of the change. " * 40,
+        "diff_refs": {
+            "base_sha": "a" * 40,
+            "start_sha": "a" * 40,
+            "head_sha": f"{spec.seed:040x}",
+        },
+    }
+    return mr, diffs
+
+
+def _hunks(
+    rng: random.Random, line: Callable[[random.Random, int], str], count: int, size: int
+) -> str:
+    parts: List[str] = []
+    old_position = new_position = 1
+    for _ in range(count):
+        gap = rng.randrange(10, 60)
+        old_start, new_start = old_position + gap, new_position + gap
+        lines: List[str] = []
+        old_length = new_length = 0
+        for offset in range(size):
+            text = line(rng, old_start + offset)
+            kind = rng.random()
+            if offset < 3 or offset >= size - 3 or kind < 0.3:
+                lines.append(f" {text}")
+                old_length += 1
+                new_length += 1
+            elif kind < 0.5:
+                lines.append(f"-{text}")
+                old_length += 1
+            else:
+                lines.append(f"+{text}")
+                new_length += 1
+        parts.append(f"@@ -{old_start},{old_length} +{new_start},{new_length} @@")
+        parts.extend(lines)
+        old_position, new_position = old_start + old_length, new_start + new_length
+    return "\n".join(parts) + "\n"
+
+
+def _change(path: str, diff: str, new_file: bool = False) -> Dict[str, Any]:
+    return {
+        "old_path": path,
+        "new_path": path,
+        "new_file": new_file,
+        "renamed_file": False,
+        "deleted_file": False,
+        "diff": diff,
+    }
+
+
+def describe(diffs: Sequence[Dict[str, Any]]) -> Dict[str, int]:
+    return {
+        "files": len(diffs),
+        "diff_bytes": sum(len(change["diff"]) for change in diffs),
+        "diff_lines": sum(change["diff"].count("\n") for change in diffs),
+    }
@@ -1,5 +1,15 @@
+import sys
+
 from agent_mr_reviewer.cli import main
 
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["serve"]:
+        from agent_mr_reviewer.service import main as serve
+
+        raise SystemExit(serve(sys.argv[2:]))
+    if sys.argv[1:2] == ["batch"]:
+        from agent_mr_reviewer.batch import main as batch
+
+        raise SystemExit(batch(sys.argv[2:]))
     raise SystemExit(main())
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import os
+import sys
+import time
+import traceback
+from typing import Any, Dict, List, Optional
+
+from agent_mr_reviewer.cli import (
+    ReviewSetup,
+    add_review_args,
+    build_setup,
+    print_stats,
+    review,
+    write_metrics,
+)
+from agent_mr_reviewer.incremental import find_last_reviewed_sha
+from agent_mr_reviewer.tokenizer import get_encoding
+
+
+@dataclass
+class BatchResult:
+    mr_iid: str
+    head_sha: str
+    status: str  # "reviewed", "unchanged" or "failed"
+    seconds: float = 0.0
+
+
+def review_open_mrs(
+    setup: ReviewSetup,
+    project_id: str,
+    workers: int = 2,
+    labels: Optional[List[str]] = None,
+    updated_after: Optional[str] = None,
+    force: bool = False,
+    include_drafts: bool = False,
+) -> List[BatchResult]:
+    # Every review shares the setup: one GitLab and one LLM session (warm
+    # connection pools), one tokenizer and one LLM cache for the whole batch.
+    client = setup.client
+    merge_requests = [
+        mr
+        for mr in client.iter_merge_requests(project_id, labels=labels, updated_after=updated_after)
+        if include_drafts or not (mr.get("draft") or mr.get("work_in_progress"))
+    ]
+    print(f"{len(merge_requests)} open merge request(s) in project {project_id}")
+
+    def review_one(mr: Dict[str, Any]) -> BatchResult:
+        mr_iid = str(mr["iid"])
+        head_sha = mr.get("sha") or ""
+        started = time.monotonic()
+        try:
+            # Only the newest notes are read: the head marker of the last
+            # review is usually on the first page.
+            if not force and head_sha:
+                last_sha = find_last_reviewed_sha(client.iter_notes(project_id, mr_iid))
+                if last_sha == head_sha:
+                    return BatchResult(mr_iid, head_sha, "unchanged")
+            print(f"Reviewing !{mr_iid} at {head_sha[:8] or 'HEAD'}")
+            review(setup, project_id, mr_iid)
+            status = "reviewed"
+        except Exception:
+            # One failed MR must not stop the batch.
+            traceback.print_exc(file=sys.stderr)
+            status = "failed"
+        return BatchResult(mr_iid, head_sha, status, time.monotonic() - started)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return list(executor.map(review_one, merge_requests))
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Review every open MR of a GitLab project")
+    parser.add_argument("--gitlab-url", default=os.getenv("GITLAB_URL"))
+    parser.add_argument("--project-id", default=os.getenv("PROJECT_ID"))
+    parser.add_argument("--token-env", default="GITLAB_TOKEN")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--label", action="append", default=[])
+    parser.add_argument("--updated-after", help="ISO 8601 date, e.g. 2024-05-01T00:00:00Z")
+    parser.add_argument("--include-drafts", action="store_true")
+    parser.add_argument("--force", action="store_true", help="also review unchanged heads")
+    parser.add_argument("--metrics-json", default=os.getenv("METRICS_JSON"))
+    parser.add_argument("--metrics-prom", default=os.getenv("METRICS_PROM"))
+    add_review_args(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if not args.project_id:
+        print("Missing required args or env vars: project-id", file=sys.stderr)
+        return 2
+    if args.llm_max_in_flight <= 0:
+        # Without an explicit cap, parallel reviews together stay within what
+        # a single review would send.
+        args.llm_max_in_flight = args.llm_concurrency
+    try:
+        setup = build_setup(args, parallel_reviews=args.workers)
+    except ValueError as exc:
+        print(exc, file=sys.stderr)
+        return 2
+    if setup.llm_client:
+        # Load the tokenizer once, before the reviews need it.
+        get_encoding()
+
+    try:
+        results = review_open_mrs(
+            setup,
+            args.project_id,
+            workers=args.workers,
+            labels=args.label,
+            updated_after=args.updated_after,
+            force=args.force,
+            include_drafts=args.include_drafts,
+        )
+    finally:
+        write_metrics(setup, args.metrics_json, args.metrics_prom)
+    setup.prune_caches()
+
+    counts = {status: 0 for status in ("reviewed", "unchanged", "failed")}
+    for result in results:
+        counts[result.status] += 1
+        if result.status != "unchanged":
+            print(f"!{result.mr_iid}: {result.status} in {result.seconds:.1f}s")
+    print(
+        f"Batch: {counts['reviewed']} reviewed, {counts['unchanged']} unchanged, "
+        f"{counts['failed']} failed"
+    )
+    print_stats(setup)
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
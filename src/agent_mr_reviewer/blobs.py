@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+import re
+import sys
+import threading
+from typing import Dict, Iterable, Optional
+import requests
+
+from agent_mr_reviewer.disk_cache import DiskCache
+from agent_mr_reviewer.gitlab_client import GitLabAPIError, GitLabClient
+
+# SHA-1 or SHA-256 object ids; anything else is never used as a file name.
+BLOB_ID_PATTERN = re.compile(r"^(?:[0-9a-f]{40}|[0-9a-f]{64})$")
+
+
+class BlobCache(DiskCache):
+    # File contents keyed by git blob id. A blob id is the hash of the
+    # content, so entries never go stale: age and size only bound the
+    # directory.
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 256 * 1024 * 1024,
+        max_age_seconds: float = 30 * 24 * 3600,
+    ) -> None:
+        super().__init__(directory, max_bytes, max_age_seconds)
+
+    def get(self, blob_id: str) -> Optional[bytes]:
+        content = self.read(blob_id)
+        if content is not None:
+            self.touch(blob_id)
+        return content
+
+    def put(self, blob_id: str, content: bytes) -> None:
+        self.write(blob_id, content)
+
+
+class PostImageFetcher:
+    # Full content of changed files at one commit, for the rules that need
+    # more than the diff. Files are fetched together on a thread pool: a
+    # HEAD on the repository files API gives each blob id, and only blobs
+    # missing from the cache are downloaded. A file unchanged since an
+    # earlier run, or shared by several MRs, is downloaded once.
+
+    def __init__(
+        self,
+        client: GitLabClient,
+        project_id: str,
+        cache: Optional[BlobCache] = None,
+        workers: int = 4,
+    ) -> None:
+        self.client = client
+        self.project_id = project_id
+        self.cache = cache
+        self.workers = workers
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def fetch(self, ref: str, paths: Iterable[str]) -> Dict[str, str]:
+        # Files that cannot be fetched are left out; their rules fall back
+        # to the diff lines.
+        unique = list(dict.fromkeys(paths))
+        if not unique:
+            return {}
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+            contents = list(executor.map(lambda path: self._fetch_one(ref, path), unique))
+        return {path: content for path, content in zip(unique, contents) if content is not None}
+
+    def _fetch_one(self, ref: str, path: str) -> Optional[str]:
+        metrics = self.client.metrics
+        try:
+            blob_id = self.client.get_file_blob_id(self.project_id, path, ref)
+            if not BLOB_ID_PATTERN.match(blob_id):
+                raise GitLabAPIError(0, f"no blob id for {path}")
+            content = self.cache.get(blob_id) if self.cache else None
+            if content is None:
+                content = self.client.get_blob(self.project_id, blob_id)
+                metrics.incr("blob_downloads")
+                metrics.incr("blob_download_bytes", len(content))
+                if self.cache:
+                    self.cache.put(blob_id, content)
+            else:
+                metrics.incr("blob_cache_hits")
+        except (GitLabAPIError, requests.RequestException) as exc:
+            # Includes network errors left after the client's retries.
+            print(f"Warning: cannot fetch {path} at {ref[:8]}: {exc}", file=sys.stderr)
+            with self._lock:
+                self.failed += 1
+            return None
+        return content.decode("utf-8", errors="replace")
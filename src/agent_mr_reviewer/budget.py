@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from fnmatch import fnmatch
+import os
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from agent_mr_reviewer.diff_parser import ADDED, REMOVED, FileDiff, Hunk
+from agent_mr_reviewer.review_rules import Finding, analyze_diff
+
+DEFAULT_EXCLUDE_GLOBS: Tuple[str, ...] = (
+    "*.lock",
+    "*-lock.json",
+    "*-lock.yaml",
+    "go.sum",
+    "*.min.js",
+    "*.min.css",
+    "*.map",
+    "*.snap",
+    "*_pb2.py",
+    "*.pb.go",
+    "*.generated.*",
+    "vendor/*",
+    "*/vendor/*",
+    "node_modules/*",
+    "third_party/*",
+    "dist/*",
+    "build/*",
+)
+GENERATED_MARKERS = ("@generated", "DO NOT EDIT", "auto-generated", "autogenerated")
+# Average added line length above which a file is treated as minified.
+MINIFIED_LINE_LENGTH = 300
+# Rough chars-per-token ratio used to cost hunks before they are tokenized.
+CHARS_PER_TOKEN = 4
+
+SOURCE_EXTENSIONS = {
+    ".py", ".js", ".ts", ".tsx", ".jsx", ".java", ".kt", ".go", ".rs", ".rb",
+    ".php", ".cs", ".c", ".h", ".cpp", ".hpp", ".scala", ".swift", ".sql", ".sh",
+}
+CONFIG_EXTENSIONS = {".yml", ".yaml", ".json", ".toml", ".ini", ".xml", ".tf", ".cfg"}
+DOC_EXTENSIONS = {".md", ".rst", ".txt", ".adoc"}
+SOURCE_WEIGHT = 1.0
+CONFIG_WEIGHT = 0.5
+DOC_WEIGHT = 0.2
+DEFAULT_TYPE_WEIGHT = 0.6
+TEST_PATH_WEIGHT = 0.7
+SEVERITY_WEIGHTS = {"high": 8.0, "medium": 4.0, "low": 1.0}
+
+
+@dataclass
+class BudgetPlan:
+    files: List[FileDiff]
+    skipped: List[Tuple[str, str]] = field(default_factory=list)
+    partial: List[str] = field(default_factory=list)
+    # Diff tokens plus the prompt overhead of the chunks they need.
+    used_tokens: int = 0
+
+
+def plan_budget(
+    files: Iterable[FileDiff],
+    max_tokens: int,
+    exclude_globs: Sequence[str] = DEFAULT_EXCLUDE_GLOBS,
+    overhead_tokens: int = 0,
+    chunk_tokens: int = 0,
+) -> BudgetPlan:
+    # Runs before chunking: drops noise files, then keeps the hunks with the
+    # best risk-per-token ratio until the whole-MR token budget is spent.
+    # overhead_tokens is the prompt sent again with every chunk (instructions,
+    # MR title and description); chunk_tokens, when set, gives how many
+    # chunks, and so how many overheads, the selected hunks need.
+    candidates: List[FileDiff] = []
+    skipped: List[Tuple[str, str]] = []
+    for diff in files:
+        if diff.is_binary:
+            continue
+        reason = exclusion_reason(diff, exclude_globs)
+        if reason:
+            skipped.append((diff.path, reason))
+        else:
+            candidates.append(diff)
+
+    hits: Dict[str, List[Finding]] = {}
+    for finding in analyze_diff(candidates):
+        hits.setdefault(finding.path, []).append(finding)
+
+    scored: List[Tuple[float, int, int, int]] = []
+    for file_index, diff in enumerate(candidates):
+        weight = file_weight(diff.path)
+        for hunk_index, hunk in enumerate(diff.hunks):
+            cost = hunk_cost(diff, hunk)
+            score = hunk_score(diff, hunk, weight, hits.get(diff.path, ()))
+            scored.append((score / cost, file_index, hunk_index, cost))
+
+    selected: Dict[int, List[int]] = {}
+    used = 0
+    ranked = sorted(scored, key=lambda item: (-item[0], item[1], item[2]))
+    for _, file_index, hunk_index, cost in ranked:
+        if planned_tokens(used + cost, overhead_tokens, chunk_tokens) > max_tokens:
+            continue
+        used += cost
+        selected.setdefault(file_index, []).append(hunk_index)
+
+    plan = BudgetPlan(
+        files=[],
+        skipped=skipped,
+        used_tokens=planned_tokens(used, overhead_tokens, chunk_tokens),
+    )
+    for file_index, diff in enumerate(candidates):
+        chosen = sorted(selected.get(file_index, ()))
+        if not chosen:
+            plan.skipped.append((diff.path, "token budget"))
+            continue
+        if len(chosen) < len(diff.hunks):
+            plan.partial.append(diff.path)
+            diff = diff.with_hunks([diff.hunks[index] for index in chosen])
+        plan.files.append(diff)
+    return plan
+
+
+def exclusion_reason(diff: FileDiff, exclude_globs: Sequence[str]) -> str:
+    path = diff.path
+    name = os.path.basename(path)
+    for pattern in exclude_globs:
+        if fnmatch(path, pattern) or fnmatch(name, pattern):
+            return f"excluded ({pattern})"
+    return generated_reason(diff)
+
+
+def generated_reason(diff: FileDiff) -> str:
+    added = [index for index in range(len(diff)) if diff.kinds[index] == ADDED]
+    if added:
+        total = sum(diff.ends[index] - diff.starts[index] for index in added)
+        if total / len(added) > MINIFIED_LINE_LENGTH:
+            return "minified"
+        for index in added[:5]:
+            if any(diff.contains(index, marker) for marker in GENERATED_MARKERS):
+                return "generated"
+    return ""
+
+
+def file_weight(path: str) -> float:
+    extension = os.path.splitext(path)[1].lower()
+    if extension in SOURCE_EXTENSIONS:
+        weight = SOURCE_WEIGHT
+    elif extension in CONFIG_EXTENSIONS:
+        weight = CONFIG_WEIGHT
+    elif extension in DOC_EXTENSIONS:
+        weight = DOC_WEIGHT
+    else:
+        weight = DEFAULT_TYPE_WEIGHT
+    lowered = path.lower()
+    if "test" in lowered or "spec" in lowered:
+        weight *= TEST_PATH_WEIGHT
+    return weight
+
+
+def planned_tokens(diff_tokens: int, overhead_tokens: int, chunk_tokens: int) -> int:
+    if diff_tokens <= 0:
+        return 0
+    capacity = chunk_tokens - overhead_tokens
+    chunks = -(-diff_tokens // capacity) if chunk_tokens and capacity > 0 else 1
+    return diff_tokens + chunks * overhead_tokens
+
+
+def hunk_cost(diff: FileDiff, hunk: Hunk) -> int:
+    # Annotated lines carry a "+123: " style prefix on top of their content.
+    chars = sum(diff.ends[index] - diff.starts[index] + 8 for index in range(hunk.start, hunk.end))
+    return max(1, chars // CHARS_PER_TOKEN)
+
+
+def hunk_score(diff: FileDiff, hunk: Hunk, weight: float, findings: Iterable[Finding]) -> float:
+    added = removed = 0
+    for index in range(hunk.start, hunk.end):
+        kind = diff.kinds[index]
+        if kind == ADDED:
+            added += 1
+        elif kind == REMOVED:
+            removed += 1
+    first, last = hunk.target_start, hunk.target_start + hunk.target_length
+    rule_score = sum(
+        SEVERITY_WEIGHTS.get(finding.severity, 1.0)
+        for finding in findings
+        if first <= finding.line < last
+    )
+    return weight * (added + 0.5 * removed) + rule_score
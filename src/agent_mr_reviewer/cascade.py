@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from fnmatch import fnmatch
+import json
+import os
+import re
+import threading
+from typing import Dict, List, Tuple
+
+from agent_mr_reviewer.llm_client import OpenAICompatibleClient
+
+FILE_HEADER = re.compile(r"^File: (.+)$", re.MULTILINE)
+RISK_PATTERN = re.compile(r'"risk"\s*:\s*"?([0-9]*\.?[0-9]+)')
+SCREEN_TIER = "screen"
+REVIEW_TIER = "review"
+
+
+@dataclass(frozen=True)
+class Cascade:
+    # client: the cheap model that screens every chunk. Chunks it scores at
+    # or above threshold, and chunks touching sensitive_globs (which skip
+    # the screen), are also sent to the main model.
+    client: OpenAICompatibleClient
+    threshold: float = 0.5
+    sensitive_globs: Tuple[str, ...] = ()
+
+    def sensitive_paths(self, chunk_text: str) -> List[str]:
+        return [
+            path
+            for path in FILE_HEADER.findall(chunk_text)
+            if any(_matches(path, pattern) for pattern in self.sensitive_globs)
+        ]
+
+
+@dataclass
+class TierUsage:
+    model: str
+    calls: int = 0
+    cached: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    seconds: float = 0.0
+
+
+@dataclass
+class TierStats:
+    # Per-review usage of each model tier; seconds add up the latency of the
+    # calls, not wall time, since chunks run concurrently.
+    tiers: Dict[str, TierUsage] = field(default_factory=dict)
+    screened: int = 0
+    escalated: int = 0
+    sensitive: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def add(
+        self,
+        tier: str,
+        model: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        seconds: float,
+        cached: bool = False,
+    ) -> None:
+        with self._lock:
+            usage = self.tiers.get(tier)
+            if usage is None:
+                usage = self.tiers[tier] = TierUsage(model)
+            usage.calls += 1
+            usage.cached += int(cached)
+            usage.prompt_tokens += prompt_tokens
+            usage.completion_tokens += completion_tokens
+            usage.seconds += seconds
+
+    def count(self, screened: int = 0, escalated: int = 0, sensitive: int = 0) -> None:
+        with self._lock:
+            self.screened += screened
+            self.escalated += escalated
+            self.sensitive += sensitive
+
+    def summary_section(self) -> str:
+        lines = [
+            "",
+            "",
+            f"Model cascade: {self.screened} chunk(s) screened, {self.escalated} escalated "
+            f"by risk, {self.sensitive} sent directly (sensitive paths).",
+        ]
+        for tier in (SCREEN_TIER, REVIEW_TIER):
+            usage = self.tiers.get(tier)
+            if usage is None:
+                continue
+            cached = f", {usage.cached} cached" if usage.cached else ""
+            lines.append(
+                f"- {tier} ({usage.model}): {usage.calls} call(s){cached}, "
+                f"{usage.prompt_tokens} prompt / {usage.completion_tokens} completion tokens, "
+                f"{usage.seconds:.1f}s"
+            )
+        return "\n".join(lines)
+
+
+def screen_risk(content: str) -> float:
+    # Risk score of a screening reply, clamped to [0, 1]. A reply without a
+    # readable score is escalated rather than trusted.
+    risk = None
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError:
+        data = None
+    if isinstance(data, dict) and isinstance(data.get("risk"), (int, float)):
+        risk = float(data["risk"])
+    else:
+        match = RISK_PATTERN.search(content)
+        if match:
+            risk = float(match.group(1))
+    if risk is None:
+        return 1.0
+    return min(1.0, max(0.0, risk))
+
+
+def _matches(path: str, pattern: str) -> bool:
+    return fnmatch(path, pattern) or fnmatch(os.path.basename(path), pattern)
@@ -1,79 +1,306 @@
 import argparse
+from dataclasses import dataclass
 import os
 import sys
+from typing import Any, Dict, List, Optional
 
+from agent_mr_reviewer import tokenizer
+from agent_mr_reviewer.blobs import BlobCache
+from agent_mr_reviewer.budget import DEFAULT_EXCLUDE_GLOBS
+from agent_mr_reviewer.cascade import REVIEW_TIER, SCREEN_TIER, Cascade
 from agent_mr_reviewer.gitlab_client import GitLabClient
+from agent_mr_reviewer.llm_cache import LLMCache
 from agent_mr_reviewer.llm_client import OpenAICompatibleClient
+from agent_mr_reviewer.llm_review import Compression, ParseStats, PromptStats
+from agent_mr_reviewer.metrics import RunMetrics
+from agent_mr_reviewer.rate_limit import RateLimiter
 from agent_mr_reviewer.reviewer import run_review
 
 
-def parse_args() -> argparse.Namespace:
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="GitLab MR reviewer agent")
     parser.add_argument("--gitlab-url", default=os.getenv("GITLAB_URL"))
     parser.add_argument("--project-id", default=os.getenv("PROJECT_ID"))
     parser.add_argument("--mr-iid", default=os.getenv("MR_IID"))
     parser.add_argument("--token-env", default="CI_JOB_TOKEN")
+    parser.add_argument("--metrics-json", default=os.getenv("METRICS_JSON"))
+    parser.add_argument("--metrics-prom", default=os.getenv("METRICS_PROM"))
+    add_review_args(parser)
+    return parser.parse_args(argv)
+
+
+def add_review_args(parser: argparse.ArgumentParser) -> None:
+    # Options shared by the one-shot CLI and the webhook service.
     parser.add_argument("--max-comments", type=int, default=50)
     parser.add_argument("--summary-only", action="store_true")
     parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--incremental", action="store_true")
+    parser.add_argument("--no-collapse-findings", action="store_true")
+    parser.add_argument("--snap-distance", type=int, default=3)
+    parser.add_argument("--rule-workers", type=int, default=1)
+    parser.add_argument("--rules-full-file", action="store_true")
+    parser.add_argument("--blob-cache-dir", default=os.getenv("BLOB_CACHE_DIR", ".blob-cache"))
+    parser.add_argument("--no-blob-cache", action="store_true")
+    parser.add_argument("--blob-cache-max-mb", type=int, default=256)
+    parser.add_argument("--gitlab-workers", type=int, default=4)
+    parser.add_argument("--gitlab-timeout", type=float, default=30)
+    parser.add_argument("--gitlab-max-retries", type=int, default=4)
     parser.add_argument("--llm-disable", action="store_true")
     parser.add_argument("--llm-base-url", default=os.getenv("OPENAI_BASE_URL", "https://api.openai.com"))
     parser.add_argument("--llm-model", default=os.getenv("OPENAI_MODEL"))
     parser.add_argument("--llm-api-key-env", default="OPENAI_API_KEY")
+    parser.add_argument("--llm-screen-model", default=os.getenv("OPENAI_SCREEN_MODEL"))
+    parser.add_argument("--llm-screen-base-url", default=os.getenv("OPENAI_SCREEN_BASE_URL"))
+    parser.add_argument("--llm-escalate-threshold", type=float, default=0.5)
+    parser.add_argument("--llm-sensitive-glob", action="append", default=[])
     parser.add_argument("--llm-max-context", type=int, default=50000)
+    parser.add_argument("--llm-exclude-glob", action="append", default=[])
+    parser.add_argument("--llm-no-default-excludes", action="store_true")
     parser.add_argument("--llm-chunk-tokens", type=int, default=12000)
-    return parser.parse_args()
+    parser.add_argument("--llm-no-triage", action="store_true")
+    parser.add_argument("--llm-compress", action="store_true")
+    parser.add_argument("--llm-description-chars", type=int, default=2000)
+    parser.add_argument("--llm-context-lines", type=int, default=3)
+    parser.add_argument("--llm-concurrency", type=int, default=4)
+    parser.add_argument("--llm-max-in-flight", type=int, default=0)
+    parser.add_argument("--llm-rpm", type=int, default=0)
+    parser.add_argument("--llm-tpm", type=int, default=0)
+    parser.add_argument("--llm-max-retries", type=int, default=5)
+    parser.add_argument("--llm-stream", action="store_true")
+    parser.add_argument("--llm-json-mode", choices=("off", "object", "schema"), default="schema")
+    parser.add_argument("--llm-no-repair", action="store_true")
+    parser.add_argument("--llm-tokenizer-file", default=os.getenv("LLM_TOKENIZER_FILE"))
+    parser.add_argument("--llm-tokenizer-cache-dir", default=os.getenv("TIKTOKEN_CACHE_DIR"))
+    parser.add_argument("--llm-cache-dir", default=os.getenv("LLM_CACHE_DIR", ".llm-cache"))
+    parser.add_argument("--no-llm-cache", action="store_true")
+    parser.add_argument("--llm-cache-max-mb", type=int, default=256)
+    parser.add_argument("--llm-cache-max-age-days", type=float, default=7)
 
 
-def main() -> int:
-    args = parse_args()
-    missing = [
-        name
-        for name, value in (
-            ("gitlab-url", args.gitlab_url),
-            ("project-id", args.project_id),
-            ("mr-iid", args.mr_iid),
-        )
-        if not value
-    ]
-    if missing:
-        print(f"Missing required args or env vars: {', '.join(missing)}", file=sys.stderr)
-        return 2
+@dataclass
+class ReviewSetup:
+    # Clients and run_review options built once from the command line; the
+    # service reuses one setup (warm sessions, shared cache) for every job.
+    client: GitLabClient
+    llm_client: Optional[OpenAICompatibleClient]
+    llm_cache: Optional[LLMCache]
+    parse_stats: ParseStats
+    prompt_stats: PromptStats
+    metrics: RunMetrics
+    options: Dict[str, Any]
+    blob_cache: Optional[BlobCache] = None
+
+    def prune_caches(self) -> None:
+        if self.llm_cache:
+            self.llm_cache.prune()
+        if self.blob_cache:
+            self.blob_cache.prune()
+
 
+def build_setup(args: argparse.Namespace, parallel_reviews: int = 1) -> ReviewSetup:
+    # Raises ValueError with a user-facing message when configuration is missing.
+    if not args.gitlab_url:
+        raise ValueError("Missing required args or env vars: gitlab-url")
     token = os.getenv(args.token_env)
     if not token:
-        print(f"Missing token env var: {args.token_env}", file=sys.stderr)
-        return 2
+        raise ValueError(f"Missing token env var: {args.token_env}")
 
     token_type = "job" if args.token_env == "CI_JOB_TOKEN" else "private"
-    client = GitLabClient(args.gitlab_url, token, token_type=token_type)
+    metrics = RunMetrics()
+    client = GitLabClient(
+        args.gitlab_url,
+        token,
+        token_type=token_type,
+        timeout=args.gitlab_timeout,
+        max_retries=args.gitlab_max_retries,
+        pool_size=args.gitlab_workers * parallel_reviews,
+        metrics=metrics,
+    )
 
     llm_client = None
+    llm_cache = None
+    cascade = None
+    compression = None
+    if args.llm_compress:
+        compression = Compression(
+            description_chars=args.llm_description_chars,
+            context_lines=args.llm_context_lines,
+        )
     if not args.llm_disable:
         api_key = os.getenv(args.llm_api_key_env)
         if not api_key:
-            print(f"Missing LLM API key env var: {args.llm_api_key_env}", file=sys.stderr)
-            return 2
+            raise ValueError(f"Missing LLM API key env var: {args.llm_api_key_env}")
         if not args.llm_model:
-            print("Missing LLM model (set OPENAI_MODEL or --llm-model)", file=sys.stderr)
-            return 2
+            raise ValueError("Missing LLM model (set OPENAI_MODEL or --llm-model)")
+        tokenizer.configure(args.llm_tokenizer_file, args.llm_tokenizer_cache_dir)
         llm_client = OpenAICompatibleClient(
             base_url=args.llm_base_url,
             api_key=api_key,
             model=args.llm_model,
+            max_retries=args.llm_max_retries,
+            rate_limiter=RateLimiter(args.llm_rpm, args.llm_tpm),
+            pool_size=args.llm_concurrency * parallel_reviews,
+            json_mode=args.llm_json_mode,
+            metrics=metrics,
+            max_in_flight=args.llm_max_in_flight,
         )
+        if args.llm_screen_model:
+            if not 0.0 <= args.llm_escalate_threshold <= 1.0:
+                raise ValueError("--llm-escalate-threshold must be between 0 and 1")
+            # Same key and limits as the main model; the tiers keep separate
+            # rate limiters since providers meter each model on its own.
+            screen_client = OpenAICompatibleClient(
+                base_url=args.llm_screen_base_url or args.llm_base_url,
+                api_key=api_key,
+                model=args.llm_screen_model,
+                max_retries=args.llm_max_retries,
+                rate_limiter=RateLimiter(args.llm_rpm, args.llm_tpm),
+                pool_size=args.llm_concurrency * parallel_reviews,
+                json_mode=args.llm_json_mode,
+                metrics=metrics,
+                max_in_flight=args.llm_max_in_flight,
+            )
+            cascade = Cascade(
+                screen_client,
+                threshold=args.llm_escalate_threshold,
+                sensitive_globs=tuple(args.llm_sensitive_glob),
+            )
+        if not args.no_llm_cache:
+            llm_cache = LLMCache(
+                args.llm_cache_dir,
+                max_bytes=args.llm_cache_max_mb * 1024 * 1024,
+                max_age_seconds=args.llm_cache_max_age_days * 24 * 3600,
+            )
 
-    run_review(
-        client=client,
-        project_id=args.project_id,
-        mr_iid=args.mr_iid,
+    exclude_globs = list(args.llm_exclude_glob)
+    if not args.llm_no_default_excludes:
+        exclude_globs = list(DEFAULT_EXCLUDE_GLOBS) + exclude_globs
+
+    blob_cache = None
+    if args.rules_full_file and not args.no_blob_cache:
+        blob_cache = BlobCache(args.blob_cache_dir, max_bytes=args.blob_cache_max_mb * 1024 * 1024)
+
+    parse_stats = ParseStats()
+    prompt_stats = PromptStats()
+    options = dict(
         max_comments=args.max_comments,
         summary_only=args.summary_only,
         dry_run=args.dry_run,
         llm_client=llm_client,
         llm_max_context=args.llm_max_context,
         llm_chunk_tokens=args.llm_chunk_tokens,
+        llm_concurrency=args.llm_concurrency,
+        llm_cache=llm_cache,
+        incremental=args.incremental,
+        gitlab_workers=args.gitlab_workers,
+        llm_stream=args.llm_stream,
+        llm_parse_stats=parse_stats,
+        llm_repair=not args.llm_no_repair,
+        llm_exclude_globs=exclude_globs,
+        llm_compression=compression,
+        llm_prompt_stats=prompt_stats,
+        llm_triage=not args.llm_no_triage,
+        llm_cascade=cascade,
+        collapse_duplicates=not args.no_collapse_findings,
+        snap_distance=args.snap_distance,
+        metrics=metrics,
+        rule_workers=args.rule_workers,
+        rules_full_file=args.rules_full_file,
+        blob_cache=blob_cache,
+    )
+    return ReviewSetup(
+        client, llm_client, llm_cache, parse_stats, prompt_stats, metrics, options, blob_cache
     )
+
+
+def review(setup: ReviewSetup, project_id: str, mr_iid: str) -> None:
+    run_review(client=setup.client, project_id=project_id, mr_iid=mr_iid, **setup.options)
+
+
+def print_stats(setup: ReviewSetup) -> None:
+    parse_stats, prompt_stats = setup.parse_stats, setup.prompt_stats
+    if setup.llm_client:
+        print(
+            f"LLM findings: {parse_stats.parsed} parsed, {parse_stats.salvaged} salvaged, "
+            f"{parse_stats.dropped} dropped ({parse_stats.repairs} repair calls)",
+            file=sys.stderr,
+        )
+        print(
+            f"LLM prompts: {prompt_stats.chunks} chunks, {prompt_stats.prompt_tokens} tokens "
+            f"({prompt_stats.saved_tokens} saved by compression)",
+            file=sys.stderr,
+        )
+    if setup.llm_cache:
+        stats = setup.llm_cache.stats()
+        print(
+            f"LLM cache: {stats['hits']} hits, {stats['misses']} misses, {stats['writes']} writes",
+            file=sys.stderr,
+        )
+    report = setup.metrics.to_dict()
+    if report["llm_latency_seconds"]:
+        latency = ", ".join(f"{k} {v:.2f}s" for k, v in report["llm_latency_seconds"].items())
+        print(f"LLM latency: {latency}", file=sys.stderr)
+    counters = report["counters"]
+    tiers = [
+        f"{tier} {counters[f'llm_{tier}_calls']} calls, "
+        f"{counters[f'llm_{tier}_prompt_tokens']}+{counters[f'llm_{tier}_completion_tokens']} "
+        f"tokens, {counters[f'llm_{tier}_latency_ms'] / 1000:.1f}s"
+        for tier in (SCREEN_TIER, REVIEW_TIER)
+        if f"llm_{tier}_calls" in counters
+    ]
+    if tiers:
+        print(f"LLM tiers: {'; '.join(tiers)}", file=sys.stderr)
+    if "blob_downloads" in counters or "blob_cache_hits" in counters:
+        print(
+            f"File contents: {counters.get('blob_downloads', 0)} downloaded "
+            f"({counters.get('blob_download_bytes', 0)} bytes), "
+            f"{counters.get('blob_cache_hits', 0)} from the blob cache",
+            file=sys.stderr,
+        )
+    slowest = sorted(report["spans"].items(), key=lambda item: -item[1]["self_seconds"])
+    phases = ", ".join(f"{name} {span['self_seconds']:.2f}s" for name, span in slowest[:6])
+    print(f"Slowest spans (self time): {phases}", file=sys.stderr)
+
+
+def write_metrics(setup: ReviewSetup, json_path: Optional[str], prom_path: Optional[str]) -> None:
+    # Written even when the review failed: slow or failing runs are the ones
+    # worth looking at.
+    try:
+        if json_path:
+            setup.metrics.write_json(json_path)
+        if prom_path:
+            setup.metrics.write_prometheus(prom_path)
+    except OSError as exc:
+        print(f"Warning: cannot write metrics: {exc}", file=sys.stderr)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    missing = [
+        name
+        for name, value in (
+            ("gitlab-url", args.gitlab_url),
+            ("project-id", args.project_id),
+            ("mr-iid", args.mr_iid),
+        )
+        if not value
+    ]
+    if missing:
+        print(f"Missing required args or env vars: {', '.join(missing)}", file=sys.stderr)
+        return 2
+
+    try:
+        setup = build_setup(args)
+    except ValueError as exc:
+        print(exc, file=sys.stderr)
+        return 2
+
+    try:
+        review(setup, args.project_id, args.mr_iid)
+    finally:
+        write_metrics(setup, args.metrics_json, args.metrics_prom)
+    setup.prune_caches()
+    print_stats(setup)
     return 0
 
 
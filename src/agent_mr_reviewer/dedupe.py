@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+from dataclasses import replace
+import hashlib
+import re
+import threading
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from agent_mr_reviewer.review_rules import Finding
+
+# 32 MinHash values split into 8 LSH bands of 4: two messages with a Jaccard
+# similarity of 0.5 share at least one band ~40% of the time, 0.8 ~99%.
+NUM_HASHES = 32
+BANDS = 8
+ROWS = NUM_HASHES // BANDS
+SIMILARITY_THRESHOLD = 0.5
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 32) - 1
+# Fixed coefficients so signatures (and groups) are stable between runs.
+_COEFFICIENTS = [
+    (
+        (index * 0x9E3779B1 + 0x7F4A7C15) % _PRIME | 1,
+        (index * 0x85EBCA77 + 0x165667B1) % _PRIME,
+    )
+    for index in range(1, NUM_HASHES + 1)
+]
+SEVERITY_RANK = {"low": 0, "medium": 1, "high": 2}
+
+# Identifiers and snippets quoted in a message are what differs between two
+# occurrences of the same complaint.
+_CODE_SPAN = re.compile(r"`[^`]*`")
+_MARKUP = re.compile(r"[`*_>#\[\]()\"']")
+_NUMBER = re.compile(r"\d+")
+# Unicode words: messages in other scripts must not all normalise to nothing.
+_WORD = re.compile(r"\w+")
+
+
+def normalize_message(message: str) -> List[str]:
+    lowered = message.lower()
+    words = _words(_CODE_SPAN.sub(" code ", lowered))
+    if all(word == "code" for word in words):
+        # Nothing but code spans: the code is the message.
+        words = _words(lowered)
+    return words
+
+
+def _words(text: str) -> List[str]:
+    return _WORD.findall(_NUMBER.sub("0", _MARKUP.sub(" ", text)))
+
+
+def fingerprint(finding: Finding) -> str:
+    # Line-independent identity of a finding: the same complaint keeps its
+    # fingerprint when later pushes move the code or reword identifiers.
+    words = " ".join(normalize_message(finding.message))
+    material = f"{finding.path}\0{finding.rule_id}\0{words}"
+    return hashlib.sha1(material.encode("utf-8")).hexdigest()[:16]
+
+
+def shingles(words: List[str]) -> List[str]:
+    if len(words) < 2:
+        return words or [""]
+    return [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+
+def minhash(message: str) -> Tuple[int, ...]:
+    words = normalize_message(message)
+    hashes = [zlib.crc32(shingle.encode("utf-8")) for shingle in set(shingles(words))]
+    return tuple(
+        min((a * value + b) % _PRIME & _MASK for value in hashes) for a, b in _COEFFICIENTS
+    )
+
+
+def similarity(left: Tuple[int, ...], right: Tuple[int, ...]) -> float:
+    return sum(1 for a, b in zip(left, right) if a == b) / NUM_HASHES
+
+
+class NearDuplicateIndex:
+    # LSH index over finding messages, scoped per (path, rule_id): add()
+    # returns the group an incoming finding belongs to, creating a new one
+    # when no earlier finding of the same scope is similar enough. Lookups
+    # only compare against findings sharing an LSH band, not every pair.
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD) -> None:
+        self.threshold = threshold
+        self.groups: List[List[Finding]] = []
+        self._signatures: List[Tuple[int, ...]] = []
+        self._buckets: Dict[Tuple[str, str, int, Tuple[int, ...]], List[int]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, finding: Finding) -> Tuple[int, bool]:
+        # Returns (group index, True when the finding started a new group).
+        signature = minhash(finding.message)
+        keys = [
+            (finding.path, finding.rule_id, band, signature[band * ROWS : (band + 1) * ROWS])
+            for band in range(BANDS)
+        ]
+        with self._lock:
+            group = self._match(keys, signature)
+            if group is not None:
+                self.groups[group].append(finding)
+                return group, False
+            group = len(self.groups)
+            self.groups.append([finding])
+            self._signatures.append(signature)
+            for key in keys:
+                self._buckets.setdefault(key, []).append(group)
+            return group, True
+
+    def _match(
+        self, keys: List[Tuple[str, str, int, Tuple[int, ...]]], signature: Tuple[int, ...]
+    ) -> Optional[int]:
+        candidates = {group for key in keys for group in self._buckets.get(key, ())}
+        best: Optional[int] = None
+        best_score = self.threshold
+        for group in sorted(candidates):
+            score = similarity(signature, self._signatures[group])
+            if score > best_score or (best is None and score == best_score):
+                best, best_score = group, score
+        return best
+
+
+def collapse_findings(
+    findings: Iterable[Finding], threshold: float = SIMILARITY_THRESHOLD
+) -> List[Finding]:
+    # Reduce step: one finding per group of near-duplicates, anchored on the
+    # first one, with the highest severity of the group and the other lines
+    # listed in `lines`. Group order follows the first occurrence.
+    index = NearDuplicateIndex(threshold)
+    for finding in findings:
+        index.add(finding)
+    collapsed: List[Finding] = []
+    for group in index.groups:
+        first = group[0]
+        if len(group) == 1:
+            collapsed.append(first)
+            continue
+        lines = sorted({finding.line for finding in group} - {first.line})
+        severity = max(
+            (finding.severity for finding in group),
+            key=lambda value: SEVERITY_RANK.get(value, 1),
+        )
+        collapsed.append(replace(first, severity=severity, lines=lines))
+    return collapsed
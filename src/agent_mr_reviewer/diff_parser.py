@@ -1,7 +1,251 @@
 from __future__ import annotations
 
-from unidiff import PatchSet
+from array import array
+from bisect import bisect_right
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
 
+HUNK_HEADER = re.compile(r"@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
 
-def parse_diff(diff_text: str) -> PatchSet:
-    return PatchSet(diff_text)
+CONTEXT = 0
+ADDED = 1
+REMOVED = 2
+
+_KINDS = {" ": CONTEXT, "+": ADDED, "-": REMOVED}
+
+
+class Hunk:
+    __slots__ = ("source_start", "source_length", "target_start", "target_length", "start", "end")
+
+    def __init__(
+        self, source_start: int, source_length: int, target_start: int, target_length: int, start: int
+    ) -> None:
+        self.source_start = source_start
+        self.source_length = source_length
+        self.target_start = target_start
+        self.target_length = target_length
+        # Range of line indexes of this hunk in the FileDiff tables.
+        self.start = start
+        self.end = start
+
+
+class FileDiff:
+    # One parsed file of a diff. Lines are not materialised: each one is a row
+    # in parallel arrays (kind, old/new line number, content offsets) over the
+    # original diff text, and content is sliced out only when needed.
+    __slots__ = (
+        "old_path",
+        "new_path",
+        "text",
+        "kinds",
+        "old_lines",
+        "new_lines",
+        "starts",
+        "ends",
+        "hunks",
+        "is_binary",
+        "new_file",
+        "deleted_file",
+        "renamed_file",
+        "_hunk_ends",
+    )
+
+    def __init__(self, text: str, old_path: Optional[str], new_path: Optional[str]) -> None:
+        self.text = text
+        self.old_path = old_path
+        self.new_path = new_path
+        self.kinds = array("b")
+        self.old_lines = array("l")
+        self.new_lines = array("l")
+        self.starts = array("l")
+        self.ends = array("l")
+        self.hunks: List[Hunk] = []
+        self.is_binary = False
+        self.new_file = False
+        self.deleted_file = False
+        self.renamed_file = False
+        self._hunk_ends: Optional[array] = None
+
+    @property
+    def path(self) -> str:
+        if self.deleted_file or not self.new_path:
+            return self.old_path or ""
+        return self.new_path
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def content(self, index: int) -> str:
+        return self.text[self.starts[index] : self.ends[index]]
+
+    def contains(self, index: int, needle: str) -> bool:
+        return self.text.find(needle, self.starts[index], self.ends[index]) != -1
+
+    def hunk_end(self, index: int) -> int:
+        if self._hunk_ends is None:
+            self._hunk_ends = array("l", (hunk.end for hunk in self.hunks))
+        position = bisect_right(self._hunk_ends, index)
+        return self._hunk_ends[position] if position < len(self._hunk_ends) else len(self)
+
+    def with_hunks(self, hunks: List[Hunk]) -> "FileDiff":
+        # Restricted view sharing the line tables (no copy of the arrays).
+        view = FileDiff(self.text, self.old_path, self.new_path)
+        view.kinds, view.old_lines, view.new_lines = self.kinds, self.old_lines, self.new_lines
+        view.starts, view.ends = self.starts, self.ends
+        view.hunks = list(hunks)
+        view.is_binary = self.is_binary
+        view.new_file = self.new_file
+        view.deleted_file = self.deleted_file
+        view.renamed_file = self.renamed_file
+        return view
+
+    def added_line_numbers(self) -> Set[int]:
+        return {
+            self.new_lines[index]
+            for index in range(len(self.kinds))
+            if self.kinds[index] == ADDED
+        }
+
+    def _append(self, kind: int, old_line: int, new_line: int, start: int, end: int) -> None:
+        self.kinds.append(kind)
+        self.old_lines.append(old_line)
+        self.new_lines.append(new_line)
+        self.starts.append(start)
+        self.ends.append(end)
+
+
+def parse_diff(
+    diff_text: str, old_path: Optional[str] = None, new_path: Optional[str] = None
+) -> List[FileDiff]:
+    # Accepts both full git diffs ("diff --git", "---"/"+++" headers, several
+    # files) and the bare hunks GitLab returns per file, whose paths are given
+    # by the caller.
+    files: List[FileDiff] = []
+    current: Optional[FileDiff] = None
+    hunk: Optional[Hunk] = None
+    source_left = target_left = 0
+    old_line = new_line = 0
+    text = diff_text
+    length = len(text)
+    position = 0
+
+    while position < length:
+        line_end = text.find("\n", position)
+        if line_end < 0:
+            line_end = length
+        next_position = line_end + 1
+
+        if hunk is not None and (source_left > 0 or target_left > 0):
+            marker = text[position] if line_end > position else " "
+            kind = _KINDS.get(marker)
+            if kind is None:
+                # "\ No newline at end of file" and stray lines.
+                position = next_position
+                continue
+            content_start = min(position + 1, line_end)
+            if kind == ADDED:
+                current._append(ADDED, 0, new_line, content_start, line_end)
+                new_line += 1
+                target_left -= 1
+            elif kind == REMOVED:
+                current._append(REMOVED, old_line, 0, content_start, line_end)
+                old_line += 1
+                source_left -= 1
+            else:
+                current._append(CONTEXT, old_line, new_line, content_start, line_end)
+                old_line += 1
+                new_line += 1
+                source_left -= 1
+                target_left -= 1
+            hunk.end = len(current.kinds)
+            position = next_position
+            continue
+
+        if text.startswith("@@", position):
+            header = HUNK_HEADER.match(text, position, line_end)
+            if header:
+                if current is None:
+                    current = FileDiff(diff_text, old_path, new_path)
+                    files.append(current)
+                old_line = int(header.group(1))
+                source_left = int(header.group(2) or 1)
+                new_line = int(header.group(3))
+                target_left = int(header.group(4) or 1)
+                if source_left == 0:
+                    old_line += 1
+                if target_left == 0:
+                    new_line += 1
+                hunk = Hunk(
+                    int(header.group(1)),
+                    source_left,
+                    int(header.group(3)),
+                    target_left,
+                    len(current.kinds),
+                )
+                current.hunks.append(hunk)
+        elif text.startswith("diff --git ", position):
+            current = FileDiff(diff_text, old_path, new_path)
+            files.append(current)
+            hunk = None
+        elif text.startswith("--- ", position):
+            if current is None or current.hunks:
+                current = FileDiff(diff_text, old_path, new_path)
+                files.append(current)
+                hunk = None
+            current.old_path = _header_path(text[position + 4 : line_end], "a/")
+        elif text.startswith("+++ ", position) and current is not None:
+            current.new_path = _header_path(text[position + 4 : line_end], "b/")
+        elif current is not None:
+            header_line = text[position:line_end]
+            if header_line.startswith("Binary files") or header_line.startswith("GIT binary patch"):
+                current.is_binary = True
+            elif header_line.startswith("new file mode"):
+                current.new_file = True
+            elif header_line.startswith("deleted file mode"):
+                current.deleted_file = True
+            elif header_line.startswith("rename from"):
+                current.renamed_file = True
+        elif text.startswith("Binary files", position):
+            current = FileDiff(diff_text, old_path, new_path)
+            current.is_binary = True
+            files.append(current)
+        position = next_position
+
+    for parsed in files:
+        if parsed.old_path is None and parsed.new_path is not None:
+            parsed.new_file = True
+        if parsed.new_path is None and parsed.old_path is not None:
+            parsed.deleted_file = True
+    return files
+
+
+def parse_change(change: Dict[str, Any]) -> Optional[FileDiff]:
+    diff = change.get("diff")
+    if not diff:
+        return None
+    files = parse_diff(diff, change.get("old_path"), change.get("new_path"))
+    if not files:
+        return None
+    parsed = files[0]
+    parsed.new_file = parsed.new_file or bool(change.get("new_file"))
+    parsed.deleted_file = parsed.deleted_file or bool(change.get("deleted_file"))
+    parsed.renamed_file = parsed.renamed_file or bool(change.get("renamed_file"))
+    return parsed
+
+
+def parse_changes(changes: Iterable[Dict[str, Any]]) -> Iterator[FileDiff]:
+    for change in changes:
+        parsed = parse_change(change)
+        if parsed is not None:
+            yield parsed
+
+
+def _header_path(value: str, prefix: str) -> Optional[str]:
+    value = value.split("\t", 1)[0].strip()
+    if value == "/dev/null":
+        return None
+    if value.startswith('"') and value.endswith('"'):
+        value = value[1:-1]
+    if value.startswith(prefix):
+        value = value[len(prefix) :]
+    return value
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import os
+import tempfile
+import time
+from typing import List, Optional, Tuple
+
+STALE_TEMP_SECONDS = 3600
+
+
+class DiskCache:
+    # One file per key under directory/<key[:2]>/, shared by concurrent jobs:
+    # writes are atomic, reads refresh the mtime so eviction is
+    # least-recently-used, and prune() bounds the directory by age and size.
+
+    suffix = ""
+
+    def __init__(self, directory: str, max_bytes: int, max_age_seconds: float) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+
+    def read(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), "rb") as handle:
+                return handle.read()
+        except OSError:
+            return None
+
+    def touch(self, key: str) -> None:
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+
+    def write(self, key: str, data: bytes) -> bool:
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        # Write to a private temp file then rename: concurrent jobs sharing the
+        # workspace only ever observe complete entries.
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=self.suffix)
+        except OSError:
+            return False
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                handle.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def prune(self) -> int:
+        return prune_directory(self.directory, self.max_bytes, self.max_age_seconds)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}{self.suffix}")
+
+
+def prune_directory(directory: str, max_bytes: int, max_age_seconds: float) -> int:
+    # Removes expired entries, then the least recently used ones until the
+    # directory fits in max_bytes.
+    now = time.time()
+    entries: List[Tuple[float, int, str]] = []
+    removed = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            age = now - stat.st_mtime
+            if name.startswith(".tmp-"):
+                if age > STALE_TEMP_SECONDS and _remove(path):
+                    removed += 1
+                continue
+            if age > max_age_seconds:
+                if _remove(path):
+                    removed += 1
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        if _remove(path):
+            removed += 1
+        total -= size
+    return removed
+
+
+def _remove(path: str) -> bool:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        # Another job evicted it first.
+        return False
+    except OSError:
+        return False
+    return True
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+import itertools
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from agent_mr_reviewer.gitlab_client import GitLabClient
+from agent_mr_reviewer.incremental import find_last_reviewed_sha
+from agent_mr_reviewer.reconcile import find_summary_note
+
+
+@dataclass
+class MRSnapshot:
+    # Everything run_review needs from GitLab before the analysis starts.
+    # diffs is the /diffs stream with its first page already downloaded;
+    # the optional parts are None when they were not requested.
+    mr: Dict[str, Any]
+    diffs: Iterator[Dict[str, Any]]
+    discussions: Optional[List[Dict[str, Any]]] = None
+    commit_count: Optional[int] = None
+    summary_note: Optional[Dict[str, Any]] = None
+
+    @property
+    def last_reviewed_sha(self) -> Optional[str]:
+        return find_last_reviewed_sha([self.summary_note] if self.summary_note else [])
+
+
+def fetch_snapshot(
+    client: GitLabClient,
+    project_id: str,
+    mr_iid: str,
+    commits: bool = False,
+    discussions: bool = False,
+    notes: bool = False,
+) -> MRSnapshot:
+    # The requests are independent, so they go out together: one round trip
+    # of latency instead of one per request. The REST endpoints are used
+    # rather than GraphQL, which has no equivalent of the /diffs pages.
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        mr_future = executor.submit(client.get_merge_request, project_id, mr_iid)
+        diffs_future = executor.submit(_first_item, client.iter_diffs(project_id, mr_iid))
+        discussions_future: Optional[Future] = None
+        commits_future: Optional[Future] = None
+        notes_future: Optional[Future] = None
+        if discussions:
+            discussions_future = executor.submit(client.list_discussions, project_id, mr_iid)
+        if commits:
+            commits_future = executor.submit(client.count_commits, project_id, mr_iid)
+        if notes:
+            # Notes are read newest first, only as far as the summary note.
+            notes_future = executor.submit(
+                lambda: find_summary_note(client.iter_notes(project_id, mr_iid))
+            )
+        snapshot = MRSnapshot(mr=mr_future.result(), diffs=_chain(*diffs_future.result()))
+        if discussions_future:
+            snapshot.discussions = discussions_future.result()
+        if commits_future:
+            snapshot.commit_count = commits_future.result()
+        if notes_future:
+            snapshot.summary_note = notes_future.result()
+    return snapshot
+
+
+def _first_item(
+    items: Iterator[Dict[str, Any]],
+) -> Tuple[Optional[Dict[str, Any]], Iterator[Dict[str, Any]]]:
+    return next(items, None), items
+
+
+def _chain(
+    first: Optional[Dict[str, Any]], rest: Iterator[Dict[str, Any]]
+) -> Iterator[Dict[str, Any]]:
+    if first is None:
+        return iter(())
+    return itertools.chain([first], rest)
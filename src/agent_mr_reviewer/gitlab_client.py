@@ -1,13 +1,48 @@
 from __future__ import annotations
 
-from typing import Any, Dict
+import sys
+import time
+from typing import Any, Dict, Iterator, List, Optional
+from urllib.parse import quote
 import requests
+from requests.adapters import HTTPAdapter
+
+from agent_mr_reviewer.metrics import RunMetrics
+from agent_mr_reviewer.rate_limit import RateLimiter, backoff_delay, retry_after_seconds
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE"}
+
+
+class GitLabAPIError(RuntimeError):
+    def __init__(self, status_code: int, text: str) -> None:
+        super().__init__(f"GitLab API error {status_code}: {text}")
+        self.status_code = status_code
 
 
 class GitLabClient:
-    def __init__(self, base_url: str, token: str, token_type: str = "job") -> None:
+    def __init__(
+        self,
+        base_url: str,
+        token: str,
+        token_type: str = "job",
+        timeout: float = 30,
+        max_retries: int = 4,
+        pool_size: int = 10,
+        rate_limiter: Optional[RateLimiter] = None,
+        metrics: Optional[RunMetrics] = None,
+    ) -> None:
         self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        # Shared by every thread using this client: a RateLimit-Remaining of 0
+        # or a 429 pauses all of them until the window resets.
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.metrics = metrics or RunMetrics()
         self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         if token_type == "job":
             self.session.headers.update({"JOB-TOKEN": token})
         else:
@@ -15,13 +50,76 @@ class GitLabClient:
         self.session.headers.update({"Content-Type": "application/json"})
 
     def _request(self, method: str, path: str, **kwargs: Any) -> Dict[str, Any]:
+        return self._send(method, path, **kwargs).json()
+
+    def _send(self, method: str, path: str, **kwargs: Any) -> requests.Response:
+        with self.metrics.span(f"gitlab.{method.upper()}"):
+            return self._send_with_retries(method, path, **kwargs)
+
+    def _send_with_retries(self, method: str, path: str, **kwargs: Any) -> requests.Response:
+        # Non-idempotent requests (POST) are only retried when GitLab certainly
+        # did not process them (429); callers handle ambiguous failures.
         url = f"{self.base_url}/api/v4{path}"
-        response = self.session.request(method, url, **kwargs)
-        if not response.ok:
-            raise RuntimeError(
-                f"GitLab API error {response.status_code}: {response.text}"
+        kwargs.setdefault("timeout", self.timeout)
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if not idempotent or attempt >= self.max_retries:
+                    raise
+                self.metrics.incr("gitlab_retries")
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
+                continue
+            self._track_rate_limit(response)
+            if response.ok:
+                return response
+            retryable = response.status_code == 429 or (
+                idempotent and response.status_code in RETRYABLE_STATUS
             )
-        return response.json()
+            if not retryable or attempt >= self.max_retries:
+                raise GitLabAPIError(response.status_code, response.text)
+            delay = retry_after_seconds(response.headers)
+            if delay is None:
+                delay = backoff_delay(attempt)
+            if response.status_code == 429:
+                self.metrics.incr("gitlab_throttled")
+                self.rate_limiter.pause(delay)
+            self.metrics.incr("gitlab_retries")
+            time.sleep(delay)
+            attempt += 1
+
+    def _track_rate_limit(self, response: requests.Response) -> None:
+        remaining = response.headers.get("RateLimit-Remaining")
+        reset = response.headers.get("RateLimit-Reset")
+        if remaining is None or reset is None:
+            return
+        try:
+            if int(remaining) > 0:
+                return
+            wait = float(reset) - time.time()
+        except ValueError:
+            return
+        if wait > 0:
+            self.rate_limiter.pause(wait)
+
+    def _paginate(self, path: str, params: Dict[str, Any] | None = None) -> List[Dict[str, Any]]:
+        return list(self._iter_pages(path, params))
+
+    def _iter_pages(
+        self, path: str, params: Dict[str, Any] | None = None
+    ) -> Iterator[Dict[str, Any]]:
+        query = dict(params or {})
+        query.setdefault("per_page", 100)
+        page = "1"
+        while page:
+            query["page"] = page
+            response = self._send("GET", path, params=query)
+            yield from response.json()
+            page = response.headers.get("X-Next-Page", "")
 
     def get_merge_request(self, project_id: str, mr_iid: str) -> Dict[str, Any]:
         return self._request("GET", f"/projects/{project_id}/merge_requests/{mr_iid}")
@@ -31,11 +129,96 @@ class GitLabClient:
             "GET", f"/projects/{project_id}/merge_requests/{mr_iid}/changes"
         )
 
+    def iter_diffs(
+        self, project_id: str, mr_iid: str, per_page: int = 20
+    ) -> Iterator[Dict[str, Any]]:
+        # /diffs (GitLab 15.7+) is paginated and never truncated, unlike
+        # /changes which sets "overflow" and drops files on large MRs. Files
+        # are yielded page by page so callers can start working right away.
+        pages = self._iter_pages(
+            f"/projects/{project_id}/merge_requests/{mr_iid}/diffs", {"per_page": per_page}
+        )
+        try:
+            first = next(pages)
+        except StopIteration:
+            return
+        except GitLabAPIError as exc:
+            if exc.status_code != 404:
+                raise
+            changes = self.get_changes(project_id, mr_iid)
+            if changes.get("overflow"):
+                print(
+                    "Warning: GitLab truncated the MR changes (overflow); "
+                    "some files will not be reviewed.",
+                    file=sys.stderr,
+                )
+            yield from changes.get("changes", [])
+            return
+        yield first
+        yield from pages
+
     def get_commits(self, project_id: str, mr_iid: str) -> Dict[str, Any]:
         return self._request(
             "GET", f"/projects/{project_id}/merge_requests/{mr_iid}/commits"
         )
 
+    def count_commits(self, project_id: str, mr_iid: str) -> int:
+        # X-Total spares downloading every commit; GitLab leaves it out on
+        # very large collections.
+        path = f"/projects/{project_id}/merge_requests/{mr_iid}/commits"
+        response = self._send("GET", path, params={"per_page": 1})
+        total = response.headers.get("X-Total", "")
+        if total.isdigit():
+            return int(total)
+        return len(self._paginate(path))
+
+    def list_notes(self, project_id: str, mr_iid: str) -> List[Dict[str, Any]]:
+        return list(self.iter_notes(project_id, mr_iid))
+
+    def iter_notes(self, project_id: str, mr_iid: str) -> Iterator[Dict[str, Any]]:
+        # Newest first; pages are only fetched as far as the caller reads.
+        return self._iter_pages(
+            f"/projects/{project_id}/merge_requests/{mr_iid}/notes",
+            {"sort": "desc", "order_by": "created_at"},
+        )
+
+    def iter_merge_requests(
+        self,
+        project_id: str,
+        state: str = "opened",
+        labels: Optional[List[str]] = None,
+        updated_after: Optional[str] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        params: Dict[str, Any] = {"state": state, "order_by": "updated_at", "sort": "desc"}
+        if labels:
+            params["labels"] = ",".join(labels)
+        if updated_after:
+            params["updated_after"] = updated_after
+        return self._iter_pages(f"/projects/{project_id}/merge_requests", params)
+
+    def list_discussions(self, project_id: str, mr_iid: str) -> List[Dict[str, Any]]:
+        return self._paginate(f"/projects/{project_id}/merge_requests/{mr_iid}/discussions")
+
+    def compare(self, project_id: str, from_sha: str, to_sha: str) -> Dict[str, Any]:
+        return self._request(
+            "GET",
+            f"/projects/{project_id}/repository/compare",
+            params={"from": from_sha, "to": to_sha, "straight": "true"},
+        )
+
+    def get_file_blob_id(self, project_id: str, file_path: str, ref: str) -> str:
+        # HEAD on the repository files API: the blob id of a file at ref,
+        # without downloading its content.
+        response = self._send(
+            "HEAD",
+            f"/projects/{project_id}/repository/files/{quote(file_path, safe='')}",
+            params={"ref": ref},
+        )
+        return response.headers.get("X-Gitlab-Blob-Id", "")
+
+    def get_blob(self, project_id: str, blob_id: str) -> bytes:
+        return self._send("GET", f"/projects/{project_id}/repository/blobs/{blob_id}/raw").content
+
     def post_discussion(
         self,
         project_id: str,
@@ -53,3 +236,22 @@ class GitLabClient:
         return self._request(
             "POST", f"/projects/{project_id}/merge_requests/{mr_iid}/notes", json=payload
         )
+
+    def update_note(
+        self, project_id: str, mr_iid: str, note_id: int, body: str
+    ) -> Dict[str, Any]:
+        payload = {"body": body}
+        return self._request(
+            "PUT",
+            f"/projects/{project_id}/merge_requests/{mr_iid}/notes/{note_id}",
+            json=payload,
+        )
+
+    def resolve_discussion(
+        self, project_id: str, mr_iid: str, discussion_id: str, resolved: bool = True
+    ) -> Dict[str, Any]:
+        return self._request(
+            "PUT",
+            f"/projects/{project_id}/merge_requests/{mr_iid}/discussions/{discussion_id}",
+            params={"resolved": "true" if resolved else "false"},
+        )
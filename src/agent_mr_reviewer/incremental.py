@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from agent_mr_reviewer.diff_parser import FileDiff
+from agent_mr_reviewer.gitlab_client import GitLabClient
+from agent_mr_reviewer.review_rules import Finding
+
+HEAD_MARKER_PATTERN = re.compile(r"<!-- agent-mr-reviewer:head_sha=([0-9a-f]{7,40}) -->")
+
+
+def head_marker(head_sha: str) -> str:
+    return f"<!-- agent-mr-reviewer:head_sha={head_sha} -->"
+
+
+def find_last_reviewed_sha(notes: Iterable[Dict[str, Any]]) -> Optional[str]:
+    # Notes are requested newest first, so the first marker is the latest review.
+    for note in notes:
+        if note.get("system"):
+            continue
+        match = HEAD_MARKER_PATTERN.search(note.get("body") or "")
+        if match:
+            return match.group(1)
+    return None
+
+
+def delta_changes(
+    client: GitLabClient, project_id: str, last_sha: str, head_sha: str
+) -> Optional[List[Dict[str, Any]]]:
+    # A force-push can make last_sha unreachable: None tells the caller to
+    # fall back to a full review.
+    try:
+        comparison = client.compare(project_id, last_sha, head_sha)
+    except RuntimeError:
+        return None
+    return [diff for diff in comparison.get("diffs") or [] if diff.get("diff")]
+
+
+def added_lines_by_path(files: Iterable[FileDiff]) -> Dict[str, Set[int]]:
+    return {diff.path: diff.added_line_numbers() for diff in files}
+
+
+def restrict_to_mr_lines(
+    findings: Iterable[Finding], commentable: Dict[str, Set[int]]
+) -> List[Finding]:
+    # The delta diff is taken against the current head, so its new-side line
+    # numbers are already head coordinates. We only have to drop lines that
+    # are not part of the MR diff (e.g. upstream changes picked up by a rebase),
+    # since GitLab refuses inline comments outside of it.
+    return [
+        finding
+        for finding in findings
+        if finding.line in commentable.get(finding.path, ())
+    ]
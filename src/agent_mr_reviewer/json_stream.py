@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import json
+import re
+from typing import Any, List
+
+TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+class JSONArrayStreamParser:
+    # Incremental parser for a JSON array arriving in pieces (streamed LLM
+    # output). feed() returns the elements completed by the new text, so each
+    # one can be used before the array is closed. Text before the first "["
+    # (markdown fences, {"findings": ...) is skipped; elements with trailing
+    # commas are repaired (counted in `repaired`), other invalid elements are
+    # counted in `invalid` and dropped.
+
+    def __init__(self) -> None:
+        self._buffer = ""
+        self._position = 0
+        self._started = False
+        self._finished = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._element_start = -1
+        self.invalid = 0
+        self.repaired = 0
+
+    @property
+    def started(self) -> bool:
+        return self._started
+
+    @property
+    def finished(self) -> bool:
+        return self._finished
+
+    def feed(self, text: str) -> List[Any]:
+        if self._finished:
+            # Kept for remainder().
+            self._buffer += text
+            return []
+        if not text:
+            return []
+        self._buffer += text
+        items: List[Any] = []
+        buffer = self._buffer
+        position = self._position
+
+        while position < len(buffer):
+            char = buffer[position]
+            if not self._started:
+                if char == "[":
+                    self._started = True
+                position += 1
+                continue
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                position += 1
+                continue
+
+            if char == '"':
+                self._in_string = True
+                if self._element_start < 0:
+                    self._element_start = position
+            elif char in "[{":
+                if self._depth == 0 and self._element_start >= 0:
+                    # Missing comma between two elements.
+                    self._emit(buffer, position, items)
+                if self._element_start < 0:
+                    self._element_start = position
+                self._depth += 1
+            elif char in "]}":
+                if self._depth > 0:
+                    self._depth -= 1
+                elif char == "]":
+                    # Closing bracket of the top-level array.
+                    self._emit(buffer, position, items)
+                    self._finished = True
+                    position += 1
+                    break
+            elif char == "," and self._depth == 0:
+                self._emit(buffer, position, items)
+            elif not char.isspace() and self._element_start < 0:
+                self._element_start = position
+            position += 1
+
+        # Drop the consumed prefix so long streams do not grow the buffer.
+        keep_from = self._element_start if self._element_start >= 0 else position
+        self._buffer = buffer[keep_from:]
+        self._position = position - keep_from
+        if self._element_start >= 0:
+            self._element_start = 0
+        return items
+
+    def remainder(self) -> str:
+        # Text fed after the closing bracket of the array.
+        return self._buffer[self._position :] if self._finished else ""
+
+    def pending(self) -> str:
+        # Unparsed text of the element in progress (e.g. a truncated reply).
+        return self._buffer[self._element_start :] if self._element_start >= 0 else ""
+
+    def _emit(self, buffer: str, end: int, items: List[Any]) -> None:
+        if self._element_start < 0:
+            # Empty slot: "[]" or a trailing comma.
+            return
+        raw = buffer[self._element_start : end]
+        self._element_start = -1
+        try:
+            items.append(json.loads(raw))
+            return
+        except json.JSONDecodeError:
+            pass
+        try:
+            items.append(json.loads(TRAILING_COMMA.sub(r"\1", raw)))
+            self.repaired += 1
+        except json.JSONDecodeError:
+            self.invalid += 1
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from typing import Dict, List, Optional
+
+from agent_mr_reviewer.disk_cache import DiskCache
+
+
+class LLMCache(DiskCache):
+    suffix = ".json"
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 256 * 1024 * 1024,
+        max_age_seconds: float = 7 * 24 * 3600,
+    ) -> None:
+        super().__init__(directory, max_bytes, max_age_seconds)
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(
+        model: str,
+        base_url: str,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        json_mode: str = "off",
+    ) -> str:
+        # json_mode changes the request (response_format), and so the reply.
+        material = json.dumps(
+            {
+                "model": model,
+                "base_url": base_url,
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "json_mode": json_mode,
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            entry = json.loads(self.read(key) or b"")
+            completion = entry["completion"]
+            expired = time.time() - float(entry.get("created", 0)) > self.max_age_seconds
+        except (ValueError, KeyError, TypeError):
+            completion, expired = None, True
+        if completion is None or expired:
+            self._count(hit=False)
+            return None
+        self.touch(key)
+        self._count(hit=True)
+        return completion
+
+    def put(self, key: str, completion: str) -> None:
+        entry = json.dumps({"created": time.time(), "completion": completion})
+        if self.write(key, entry.encode("utf-8")):
+            with self._lock:
+                self.writes += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "writes": self.writes}
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
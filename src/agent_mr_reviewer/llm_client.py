@@ -1,30 +1,180 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List
+from contextlib import nullcontext
+import json
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
 import requests
+from requests.adapters import HTTPAdapter
+
+from agent_mr_reviewer.metrics import RunMetrics
+from agent_mr_reviewer.rate_limit import RateLimiter, backoff_delay, retry_after_seconds
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
 
 
 class OpenAICompatibleClient:
-    def __init__(self, base_url: str, api_key: str, model: str, timeout: int = 60) -> None:
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        model: str,
+        timeout: int = 60,
+        max_retries: int = 5,
+        rate_limiter: Optional[RateLimiter] = None,
+        pool_size: int = 10,
+        json_mode: str = "off",
+        metrics: Optional[RunMetrics] = None,
+        max_in_flight: int = 0,
+    ) -> None:
         self.base_url = base_url.rstrip("/")
         self.model = model
         self.timeout = timeout
+        self.max_retries = max_retries
+        self.rate_limiter = rate_limiter
+        # "off", "object" (response_format json_object) or "schema"
+        # (json_schema). Stepped down schema -> object -> off each time the
+        # endpoint rejects a request carrying response_format.
+        self.json_mode = json_mode
+        self.metrics = metrics or RunMetrics()
+        # Cap on requests in flight across every review sharing this client
+        # (batch and service modes run several reviews at once); 0 = no cap.
+        self._slots = threading.BoundedSemaphore(max_in_flight) if max_in_flight > 0 else None
         self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         self.session.headers.update({"Authorization": f"Bearer {api_key}"})
         self.session.headers.update({"Content-Type": "application/json"})
 
-    def chat(self, messages: List[Dict[str, str]], temperature: float = 0.2, max_tokens: int = 1500) -> str:
+    def chat(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.2,
+        max_tokens: int = 1500,
+        prompt_tokens: Optional[int] = None,
+        json_schema: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        payload = self._payload(messages, temperature, max_tokens, json_schema)
+        with self._slot(), self.metrics.span("llm.chat"):
+            response = self._post(payload, prompt_tokens, stream=False)
+            data = response.json()
+        return data["choices"][0]["message"]["content"]
+
+    def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.2,
+        max_tokens: int = 1500,
+        prompt_tokens: Optional[int] = None,
+        json_schema: Optional[Dict[str, Any]] = None,
+    ) -> Iterator[str]:
+        # Server-sent events: yields content deltas as the model generates them.
+        payload = self._payload(messages, temperature, max_tokens, json_schema)
+        payload["stream"] = True
+        # The span lasts until the last event is read, like chat() which
+        # includes reading the body.
+        with self._slot(), self.metrics.span("llm.chat_stream"):
+            yield from self._iter_events(self._post(payload, prompt_tokens, stream=True))
+
+    def _slot(self):
+        return self._slots if self._slots is not None else nullcontext()
+
+    @staticmethod
+    def _iter_events(response: requests.Response) -> Iterator[str]:
+        with response:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:") :].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    event = json.loads(data)
+                except json.JSONDecodeError:
+                    continue
+                for choice in event.get("choices") or []:
+                    content = (choice.get("delta") or {}).get("content")
+                    if content:
+                        yield content
+
+    def _payload(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        json_schema: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
         payload: Dict[str, Any] = {
             "model": self.model,
             "messages": messages,
             "temperature": temperature,
             "max_tokens": max_tokens,
         }
+        if json_schema is not None and self.json_mode == "schema":
+            payload["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": "response", "schema": json_schema, "strict": True},
+            }
+        elif json_schema is not None and self.json_mode == "object":
+            payload["response_format"] = {"type": "json_object"}
+        return payload
+
+    def _downgrade_json_mode(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        # Step down from what this request sent, not from self.json_mode:
+        # a concurrent request may already have downgraded it.
+        sent = payload["response_format"]["type"]
+        payload = {key: value for key, value in payload.items() if key != "response_format"}
+        if sent == "json_schema":
+            if self.json_mode == "schema":
+                self.json_mode = "object"
+            payload["response_format"] = {"type": "json_object"}
+        else:
+            self.json_mode = "off"
+        self.metrics.incr("llm_json_mode_downgrades")
+        return payload
+
+    def _post(
+        self, payload: Dict[str, Any], prompt_tokens: Optional[int], stream: bool
+    ) -> requests.Response:
+        if prompt_tokens is None:
+            prompt_tokens = sum(len(message["content"]) for message in payload["messages"]) // 4
         url = f"{self.base_url}/v1/chat/completions"
-        response = self.session.post(url, json=payload, timeout=self.timeout)
-        if not response.ok:
-            raise RuntimeError(
-                f"LLM API error {response.status_code}: {response.text}"
-            )
-        data = response.json()
-        return data["choices"][0]["message"]["content"]
+
+        attempt = 0
+        while True:
+            if self.rate_limiter:
+                self.rate_limiter.acquire(prompt_tokens + payload["max_tokens"])
+            try:
+                response = self.session.post(
+                    url, json=payload, timeout=self.timeout, stream=stream
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                self.metrics.incr("llm_retries")
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
+                continue
+            if response.ok:
+                return response
+            if "response_format" in payload and response.status_code in (400, 422):
+                # Endpoints rarely name response_format when they reject it:
+                # step down schema -> object -> off on any 400/422 and retry.
+                payload = self._downgrade_json_mode(payload)
+                continue
+            if response.status_code not in RETRYABLE_STATUS or attempt >= self.max_retries:
+                raise RuntimeError(
+                    f"LLM API error {response.status_code}: {response.text}"
+                )
+            delay = retry_after_seconds(response.headers)
+            if delay is None:
+                delay = backoff_delay(attempt)
+            if response.status_code == 429:
+                self.metrics.incr("llm_throttled")
+                if self.rate_limiter:
+                    self.rate_limiter.pause(delay)
+            self.metrics.incr("llm_retries")
+            time.sleep(delay)
+            attempt += 1
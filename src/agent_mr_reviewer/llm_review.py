@@ -1,181 +1,816 @@
 from __future__ import annotations
 
-from typing import Any, Dict, Iterable, List
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 import json
+import re
+import sys
+import threading
+import time
 
-import tiktoken
-from unidiff import PatchSet
-
+from agent_mr_reviewer.cascade import REVIEW_TIER, SCREEN_TIER, Cascade, TierStats, screen_risk
+from agent_mr_reviewer.diff_parser import ADDED, CONTEXT, REMOVED, FileDiff
+from agent_mr_reviewer.llm_cache import LLMCache
+from agent_mr_reviewer.json_stream import JSONArrayStreamParser
 from agent_mr_reviewer.llm_client import OpenAICompatibleClient
+from agent_mr_reviewer.metrics import RunMetrics
 from agent_mr_reviewer.review_rules import Finding
+from agent_mr_reviewer.tokenizer import get_encoding
+
+CHUNK_SEPARATOR = "\n\n"
+HUNK_START = re.compile(r"^Hunk: ", re.MULTILINE)
+# Re-tokenizing a slice of a text can differ from the token span it was cut
+# from by a token at each end.
+SPLIT_SLACK_TOKENS = 2
+# When files are streamed, sections are packed as soon as this many chunks
+# worth of tokens are pending, so LLM calls start before the last page of
+# diffs is downloaded.
+PACK_WINDOW_CHUNKS = 4
+# Per-message framing added by the chat format, plus the reply priming.
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_OVERHEAD_TOKENS = 3
+# Unparseable tails shorter than this are not worth a repair call.
+MIN_REPAIR_TAIL_CHARS = 20
+# Share of the room left by the fixed prompt that the MR description, sent
+# with every chunk, may take; the rest is kept for the diff.
+DESCRIPTION_CHUNK_SHARE = 0.5
+# Tokens kept for the " [...]" added to a cut description.
+DESCRIPTION_CUT_TOKENS = 8
+# Instructions go in the system message, which is byte-identical for every
+# chunk of every MR, followed by the MR context shared by all chunks of one MR;
+# the chunk itself comes last so provider-side prompt caching can reuse the
+# longest possible prefix.
+REVIEW_INSTRUCTIONS = (
+    "You are a senior code reviewer for GitLab merge requests. "
+    "Review the annotated diff chunk given by the user. Focus on code quality, "
+    "naming, documentation, architecture, clean code, and design patterns. "
+    "Use the line numbers provided. Lines are prefixed with +N (added, new line N), "
+    "-N (removed, old line N) or a space and N (context, new line N); \"...\" marks "
+    "omitted context lines.\n"
+    "Return ONLY valid JSON. No markdown. Return a JSON array of objects with keys: "
+    "path (string), line (int), severity (low|medium|high), message (markdown string), "
+    "rule_id (string).\n"
+    "If there are no issues, return an empty array: [].\n"
+    'If a JSON object is required, return {"findings": [...]} instead.'
+)
+OMITTED_MARKER = "..."
+FINDINGS_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "findings": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "path": {"type": "string"},
+                    "line": {"type": "integer"},
+                    "severity": {"type": "string", "enum": ["low", "medium", "high"]},
+                    "message": {"type": "string"},
+                    "rule_id": {"type": "string"},
+                },
+                "required": ["path", "line", "severity", "message", "rule_id"],
+                "additionalProperties": False,
+            },
+        }
+    },
+    "required": ["findings"],
+    "additionalProperties": False,
+}
+# Cascade mode: the cheap model also scores the chunk, so the main model only
+# sees the chunks worth its cost.
+SCREEN_INSTRUCTIONS = (
+    "You are a fast first-pass code reviewer for GitLab merge requests. "
+    "Review the annotated diff chunk given by the user and report only clear issues. "
+    "Use the line numbers provided. Lines are prefixed with +N (added, new line N), "
+    "-N (removed, old line N) or a space and N (context, new line N); \"...\" marks "
+    "omitted context lines.\n"
+    "Also rate how likely the chunk hides a bug, a security problem or a design issue a "
+    "senior reviewer would raise: risk is a number from 0 (trivial) to 1 (needs a close "
+    "look). When unsure, rate higher.\n"
+    'Return ONLY valid JSON. No markdown. Return {"risk": number, "findings": [...]} where '
+    "findings is an array of objects with keys: path (string), line (int), "
+    "severity (low|medium|high), message (markdown string), rule_id (string)."
+)
+SCREEN_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "risk": {"type": "number"},
+        "findings": FINDINGS_SCHEMA["properties"]["findings"],
+    },
+    "required": ["risk", "findings"],
+    "additionalProperties": False,
+}
+
+
+@dataclass
+class Chunk:
+    text: str
+    tokens: int
+
+
+@dataclass(frozen=True)
+class Compression:
+    # description_chars: cap on the MR description (0 = no cap);
+    # context_lines: unchanged lines kept around each change (-1 = all);
+    # collapse_deletions: replace hunks without added lines by a one-line note.
+    description_chars: int = 2000
+    context_lines: int = 3
+    collapse_deletions: bool = True
+
+
+@dataclass
+class PromptStats:
+    chunks: int = 0
+    prompt_tokens: int = 0
+    saved_tokens: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def add(self, chunks: int = 0, prompt_tokens: int = 0, saved_tokens: int = 0) -> None:
+        with self._lock:
+            self.chunks += chunks
+            self.prompt_tokens += prompt_tokens
+            self.saved_tokens += saved_tokens
+
+
+@dataclass
+class Extraction:
+    findings: List[Finding]
+    parsed: int = 0
+    salvaged: int = 0
+    dropped: int = 0
+    tail: str = ""
+    # The whole reply was read: no dropped item and no unparseable tail.
+    # Only such replies are cached; a rerun retries the others.
+    complete: bool = False
+
+
+@dataclass
+class ParseStats:
+    # parsed: findings from well-formed replies; salvaged: findings recovered
+    # from malformed or truncated replies (including repair calls); dropped:
+    # array items that could not be turned into a finding.
+    parsed: int = 0
+    salvaged: int = 0
+    dropped: int = 0
+    repairs: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def add(self, extraction: Extraction, repairs: int = 0) -> None:
+        with self._lock:
+            self.parsed += extraction.parsed
+            self.salvaged += extraction.salvaged
+            self.dropped += extraction.dropped
+            self.repairs += repairs
 
 
 def map_reduce_review(
     client: OpenAICompatibleClient,
     mr: Dict[str, Any],
-    changes: Iterable[Dict[str, Any]],
-    max_context_tokens: int = 50000,
+    files: Iterable[FileDiff],
     chunk_tokens: int = 12000,
+    concurrency: int = 1,
+    cache: LLMCache | None = None,
+    stream: bool = False,
+    on_finding: Optional[Callable[[Finding], None]] = None,
+    parse_stats: Optional[ParseStats] = None,
+    repair: bool = True,
+    compression: Optional[Compression] = None,
+    prompt_stats: Optional[PromptStats] = None,
+    metrics: Optional[RunMetrics] = None,
+    cascade: Optional[Cascade] = None,
+    tier_stats: Optional[TierStats] = None,
 ) -> List[Finding]:
-    encoding = tiktoken.get_encoding("cl100k_base")
-    annotated = build_annotated_diff(changes)
-    chunks = chunk_texts(annotated, chunk_tokens, encoding)
+    # on_finding is called from worker threads as soon as each finding is
+    # complete (while its chunk may still be generating when stream is set).
+    metrics = metrics or client.metrics
+    with metrics.span("llm.tokenizer_load"):
+        encoding = get_encoding()
+    full_mr = mr
+    instructions = (REVIEW_INSTRUCTIONS, SCREEN_INSTRUCTIONS) if cascade else (REVIEW_INSTRUCTIONS,)
+    mr, description_chars = fit_description(
+        mr,
+        encoding,
+        chunk_tokens,
+        compression.description_chars if compression else 0,
+        instructions,
+    )
+    overhead = prompt_overhead_tokens(mr, encoding, description_chars)
+    screen_overhead = 0
+    if cascade:
+        screen_overhead = prompt_overhead_tokens(
+            mr, encoding, description_chars, SCREEN_INSTRUCTIONS
+        )
+    # Tokens saved by the description cap are paid again by every chunk.
+    description_saved = prompt_overhead_tokens(full_mr, encoding) - overhead if compression else 0
+
+    def on_omitted(text: str) -> None:
+        if prompt_stats:
+            prompt_stats.add(saved_tokens=_count_tokens(text, encoding))
+
+    annotated = iter_annotated_diff(files, compression, on_omitted)
+    chunks = metrics.timed_iter(
+        "llm.chunking",
+        iter_chunks(
+            annotated,
+            chunk_tokens,
+            encoding,
+            overhead_tokens=max(overhead, screen_overhead),
+            window_chunks=PACK_WINDOW_CHUNKS,
+        ),
+    )
 
+    def ask(
+        tier_client: OpenAICompatibleClient,
+        tier: str,
+        messages: List[Dict[str, str]],
+        prompt_tokens: int,
+        schema: Dict[str, Any],
+        streamed: bool = False,
+    ) -> Tuple[str, Extraction]:
+        # One model call with its cache lookup and accounting; the tier is
+        # only broken out in the metrics when the cascade is on.
+        metric_tier = tier if cascade else ""
+        cache_key = None
+        json_mode = tier_client.json_mode
+        if cache:
+            cache_key = cache.key(
+                tier_client.model, tier_client.base_url, messages, 0.1, 1500, json_mode
+            )
+            cached = cache.get(cache_key)
+            if cached is not None:
+                completion_tokens = _count_tokens(cached, encoding)
+                metrics.record_chunk(prompt_tokens, completion_tokens, 0.0, True, metric_tier)
+                if tier_stats:
+                    tier_stats.add(
+                        tier, tier_client.model, prompt_tokens, completion_tokens, 0.0, True
+                    )
+                extraction = extract_findings(cached)
+                _notify(extraction.findings, on_finding)
+                return cached, extraction
+        started = time.perf_counter()
+        if streamed:
+            content, extraction = _stream_findings(
+                tier_client, messages, prompt_tokens, on_finding
+            )
+        else:
+            content = tier_client.chat(
+                messages,
+                temperature=0.1,
+                max_tokens=1500,
+                prompt_tokens=prompt_tokens,
+                json_schema=schema,
+            )
+            extraction = extract_findings(content)
+            _notify(extraction.findings, on_finding)
+        latency = time.perf_counter() - started
+        completion_tokens = _count_tokens(content, encoding)
+        metrics.record_chunk(prompt_tokens, completion_tokens, latency, False, metric_tier)
+        if tier_stats:
+            tier_stats.add(tier, tier_client.model, prompt_tokens, completion_tokens, latency)
+        if cache and extraction.complete:
+            if tier_client.json_mode != json_mode:
+                # The server rejected response_format: the reply is plain text.
+                cache_key = cache.key(
+                    tier_client.model,
+                    tier_client.base_url,
+                    messages,
+                    0.1,
+                    1500,
+                    tier_client.json_mode,
+                )
+            cache.put(cache_key, content)
+        return content, extraction
+
+    def review_chunk(chunk: Chunk) -> List[Finding]:
+        findings: List[Finding] = []
+        if cascade:
+            if cascade.sensitive_paths(chunk.text):
+                if tier_stats:
+                    tier_stats.count(sensitive=1)
+            else:
+                # The screen reply is not streamed: the risk score decides
+                # whether the chunk goes further.
+                prompt_tokens = screen_overhead + chunk.tokens
+                if prompt_stats:
+                    prompt_stats.add(1, prompt_tokens, description_saved)
+                messages = _build_map_messages(
+                    mr, chunk.text, description_chars, SCREEN_INSTRUCTIONS
+                )
+                content, extraction = ask(
+                    cascade.client, SCREEN_TIER, messages, prompt_tokens, SCREEN_SCHEMA
+                )
+                findings = _finish_extraction(
+                    cascade.client, extraction, repair, parse_stats, on_finding
+                )
+                escalate = screen_risk(content) >= cascade.threshold
+                if tier_stats:
+                    tier_stats.count(screened=1, escalated=int(escalate))
+                if not escalate:
+                    return findings
+        messages = _build_map_messages(mr, chunk.text, description_chars)
+        prompt_tokens = overhead + chunk.tokens
+        if prompt_stats:
+            prompt_stats.add(1, prompt_tokens, description_saved)
+        _, extraction = ask(client, REVIEW_TIER, messages, prompt_tokens, FINDINGS_SCHEMA, stream)
+        # Both tiers' findings go through the same dedupe and collapse.
+        findings.extend(_finish_extraction(client, extraction, repair, parse_stats, on_finding))
+        return findings
+
+    # Chunks are submitted while the diff is still being streamed; results are
+    # read back in submission order, so the findings order only depends on the
+    # chunk order, not on which request finishes first.
     findings: List[Finding] = []
-    for chunk in chunks:
-        messages = _build_map_messages(mr, chunk)
-        content = client.chat(messages, temperature=0.1, max_tokens=1500)
-        findings.extend(parse_findings(content))
+    if concurrency <= 1:
+        for chunk in chunks:
+            findings.extend(review_chunk(chunk))
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(review_chunk, chunk) for chunk in chunks]
+            for future in futures:
+                findings.extend(future.result())
 
     return dedupe_findings(findings)
 
 
-def build_annotated_diff(changes: Iterable[Dict[str, Any]]) -> List[str]:
-    texts: List[str] = []
-    for change in changes:
-        diff = change.get("diff")
-        if not diff:
+def _stream_findings(
+    client: OpenAICompatibleClient,
+    messages: List[Dict[str, str]],
+    prompt_tokens: int,
+    on_finding: Optional[Callable[[Finding], None]],
+) -> Tuple[str, Extraction]:
+    parser = JSONArrayStreamParser()
+    parts: List[str] = []
+    extraction = Extraction(findings=[])
+    for delta in client.chat_stream(
+        messages,
+        temperature=0.1,
+        max_tokens=1500,
+        prompt_tokens=prompt_tokens,
+        json_schema=FINDINGS_SCHEMA,
+    ):
+        parts.append(delta)
+        for item in parser.feed(delta):
+            finding = finding_from_item(item)
+            if finding is None:
+                extraction.dropped += 1
+                continue
+            extraction.findings.append(finding)
+            if on_finding:
+                on_finding(finding)
+    content = "".join(parts)
+    if not parser.started or (
+        not extraction.findings and _bracketed_prose(parser, extraction.dropped)
+    ):
+        # No array at all, or the first one was prose: fall back to the batch
+        # extraction.
+        extraction = extract_findings(content)
+        _notify(extraction.findings, on_finding)
+        return content, extraction
+    extraction.salvaged = min(parser.repaired, len(extraction.findings))
+    extraction.parsed = len(extraction.findings) - extraction.salvaged
+    extraction.dropped += parser.invalid
+    if not parser.finished:
+        extraction.tail = parser.pending()
+    extraction.complete = parser.finished and not extraction.dropped
+    return content, extraction
+
+
+def _finish_extraction(
+    client: OpenAICompatibleClient,
+    extraction: Extraction,
+    repair: bool,
+    parse_stats: Optional[ParseStats],
+    on_finding: Optional[Callable[[Finding], None]],
+) -> List[Finding]:
+    # One targeted repair call for an unparseable tail (truncated reply,
+    # garbage after the last complete item), instead of re-running the chunk.
+    repairs = 0
+    tail = extraction.tail.strip()
+    if tail and repair and "{" in tail and len(tail) >= MIN_REPAIR_TAIL_CHARS:
+        repairs = 1
+        repaired = extract_findings(
+            client.chat(
+                _build_repair_messages(tail),
+                temperature=0.0,
+                max_tokens=800,
+                json_schema=FINDINGS_SCHEMA,
+            )
+        )
+        recovered = repaired.findings
+        _notify(recovered, on_finding)
+        extraction.findings.extend(recovered)
+        extraction.salvaged += len(recovered)
+        extraction.dropped += repaired.dropped + (0 if recovered else 1)
+    elif tail:
+        extraction.dropped += 1
+    if parse_stats:
+        parse_stats.add(extraction, repairs)
+    return extraction.findings
+
+
+def _notify(
+    findings: List[Finding], on_finding: Optional[Callable[[Finding], None]]
+) -> List[Finding]:
+    if on_finding:
+        for finding in findings:
+            on_finding(finding)
+    return findings
+
+
+def build_annotated_diff(
+    files: Iterable[FileDiff], compression: Optional[Compression] = None
+) -> List[str]:
+    return list(iter_annotated_diff(files, compression))
+
+
+def iter_annotated_diff(
+    files: Iterable[FileDiff],
+    compression: Optional[Compression] = None,
+    on_omitted: Optional[Callable[[str], None]] = None,
+) -> Iterator[str]:
+    # on_omitted receives the annotated lines compression left out, so the
+    # caller can measure what was saved.
+    context_lines = compression.context_lines if compression else -1
+    collapse = bool(compression and compression.collapse_deletions)
+    for diff in files:
+        if diff.is_binary:
             continue
-        patch = PatchSet(diff)
-        for patched_file in patch:
-            if patched_file.is_binary_file:
+        kinds = diff.kinds
+        lines: List[str] = [f"File: {diff.path}"]
+        omitted: List[str] = []
+        for hunk in diff.hunks:
+            lines.append(f"Hunk: {hunk.target_start},{hunk.target_length}")
+            span = range(hunk.start, hunk.end)
+            if collapse and hunk.end > hunk.start and all(kinds[index] != ADDED for index in span):
+                removed = [index for index in span if kinds[index] == REMOVED]
+                first = diff.old_lines[removed[0]] if removed else hunk.source_start
+                lines.append(f"-{first}: ({len(removed)} line(s) removed)")
+                omitted.extend(_annotate(diff, index) for index in span)
                 continue
-            file_path = patched_file.path or change.get("new_path") or change.get("old_path")
-            lines: List[str] = [f"File: {file_path}"]
-            for hunk in patched_file:
-                lines.append(f"Hunk: {hunk.target_start},{hunk.target_length}")
-                for line in hunk:
-                    if line.is_added:
-                        if line.target_line_no is None:
-                            continue
-                        lines.append(f"+{line.target_line_no}: {line.value.rstrip()}")
-                    elif line.is_removed:
-                        if line.source_line_no is None:
-                            continue
-                        lines.append(f"-{line.source_line_no}: {line.value.rstrip()}")
-                    else:
-                        if line.target_line_no is None:
-                            continue
-                        lines.append(f" {line.target_line_no}: {line.value.rstrip()}")
-            texts.append("\n".join(lines))
-    return texts
-
-
-def chunk_texts(texts: Iterable[str], max_tokens: int, encoding) -> List[str]:
-    chunks: List[str] = []
-    current: List[str] = []
-    current_tokens = 0
+            keep = _kept_lines(kinds, hunk.start, hunk.end, context_lines)
+            skipping = False
+            for index in span:
+                if keep is None or keep[index - hunk.start]:
+                    lines.append(_annotate(diff, index))
+                    skipping = False
+                    continue
+                if not skipping:
+                    lines.append(OMITTED_MARKER)
+                    skipping = True
+                omitted.append(_annotate(diff, index))
+        if omitted and on_omitted:
+            on_omitted("\n".join(omitted))
+        yield "\n".join(lines)
+
 
+def _annotate(diff: FileDiff, index: int) -> str:
+    content = diff.text[diff.starts[index] : diff.ends[index]].rstrip()
+    kind = diff.kinds[index]
+    if kind == ADDED:
+        return f"+{diff.new_lines[index]}: {content}"
+    if kind == REMOVED:
+        return f"-{diff.old_lines[index]}: {content}"
+    return f" {diff.new_lines[index]}: {content}"
+
+
+def _kept_lines(kinds, start: int, end: int, context_lines: int) -> Optional[bytearray]:
+    # Marks the lines of one hunk within context_lines of a change; None
+    # when every line is kept.
+    if context_lines < 0:
+        return None
+    keep = bytearray(end - start)
+    for index in range(start, end):
+        if kinds[index] != CONTEXT:
+            low = max(start, index - context_lines)
+            high = min(end, index + context_lines + 1)
+            keep[low - start : high - start] = b"\x01" * (high - low)
+    return keep
+
+
+def chunk_texts(
+    texts: Iterable[str], max_tokens: int, encoding, overhead_tokens: int = 0
+) -> List[Chunk]:
+    return list(iter_chunks(texts, max_tokens, encoding, overhead_tokens))
+
+
+def iter_chunks(
+    texts: Iterable[str],
+    max_tokens: int,
+    encoding,
+    overhead_tokens: int = 0,
+    window_chunks: int = 0,
+) -> Iterator[Chunk]:
+    budget = max_tokens - overhead_tokens
+    if budget <= 0:
+        raise ValueError(
+            f"Chunk budget of {max_tokens} tokens does not cover the "
+            f"{overhead_tokens}-token prompt overhead"
+        )
+    separator_tokens = _count_tokens(CHUNK_SEPARATOR, encoding)
+
+    sections: List[Chunk] = []
+    pending_tokens = 0
     for text in texts:
-        text_tokens = _count_tokens(text, encoding)
-        if text_tokens > max_tokens:
-            chunks.extend(_split_large_text(text, max_tokens, encoding))
-            continue
+        # Each annotated diff is tokenized exactly once; oversized ones are then
+        # split on the token offsets of that single encoding.
+        tokens = encoding.encode(text)
+        if len(tokens) <= budget:
+            sections.append(Chunk(text, len(tokens)))
+        else:
+            sections.extend(_split_large_text(text, tokens, budget, encoding))
+        pending_tokens += len(tokens)
+
+        if window_chunks and pending_tokens >= window_chunks * budget:
+            packed = _pack_sections(sections, budget, separator_tokens)
+            # Hold back the emptiest chunk: it is packed again with the next
+            # window rather than sent half empty.
+            spare = min(range(len(packed)), key=lambda index: packed[index].tokens)
+            for index, chunk in enumerate(packed):
+                if index != spare:
+                    yield chunk
+            sections = [packed[spare]]
+            pending_tokens = packed[spare].tokens
+
+    if sections:
+        yield from _pack_sections(sections, budget, separator_tokens)
+
+
+def _pack_sections(sections: List[Chunk], budget: int, separator_tokens: int) -> List[Chunk]:
+    # First-fit decreasing bin packing: uses at most 11/9 of the optimal chunk
+    # count, instead of leaving a small trailing chunk like greedy filling does.
+    order = sorted(range(len(sections)), key=lambda index: -sections[index].tokens)
+    bins: List[List[int]] = []
+    loads: List[int] = []
+    for index in order:
+        size = sections[index].tokens
+        for position, load in enumerate(loads):
+            if load + separator_tokens + size <= budget:
+                bins[position].append(index)
+                loads[position] = load + separator_tokens + size
+                break
+        else:
+            bins.append([index])
+            loads.append(size)
 
-        if current_tokens + text_tokens > max_tokens and current:
-            chunks.append("\n\n".join(current))
-            current = []
-            current_tokens = 0
+    # Keep the diff order inside each chunk and between chunks.
+    packed = sorted((sorted(members), load) for members, load in zip(bins, loads))
+    return [
+        Chunk(CHUNK_SEPARATOR.join(sections[index].text for index in members), load)
+        for members, load in packed
+    ]
 
-        current.append(text)
-        current_tokens += text_tokens
 
-    if current:
-        chunks.append("\n\n".join(current))
+def _split_large_text(text: str, tokens: List[int], max_tokens: int, encoding) -> List[Chunk]:
+    _, offsets = encoding.decode_with_offsets(tokens)
 
-    return chunks
+    def token_index(char_offset: int) -> int:
+        return bisect_left(offsets, char_offset)
 
+    # Every piece repeats the "File: ..." header so the model keeps the path.
+    header_end = text.find("\n") + 1
+    header = text[:header_end]
+    header_tokens = token_index(header_end)
+    room = max_tokens - header_tokens - SPLIT_SLACK_TOKENS
+    if header_end == 0 or room <= 0:
+        header, header_end, header_tokens = "", 0, 0
+        room = max_tokens - SPLIT_SLACK_TOKENS
 
-def _split_large_text(text: str, max_tokens: int, encoding) -> List[str]:
-    chunks: List[str] = []
-    buffer: List[str] = []
-    buffer_tokens = 0
-    for line in text.splitlines():
-        line_text = f"{line}\n"
-        line_tokens = _count_tokens(line_text, encoding)
-        if buffer_tokens + line_tokens > max_tokens and buffer:
-            chunks.append("\n".join(buffer))
-            buffer = []
-            buffer_tokens = 0
-        buffer.append(line)
-        buffer_tokens += line_tokens
-    if buffer:
-        chunks.append("\n".join(buffer))
-    return chunks
+    hunk_bounds = [match.start() for match in HUNK_START.finditer(text, header_end)]
+    if not hunk_bounds or hunk_bounds[0] != header_end:
+        hunk_bounds.insert(0, header_end)
+    hunk_bounds.append(len(text))
+
+    # Units are hunks, or lines of hunks that do not fit on their own.
+    units: List[Tuple[int, int]] = []
+    for start, end in zip(hunk_bounds, hunk_bounds[1:]):
+        if token_index(end) - token_index(start) <= room:
+            units.append((start, end))
+            continue
+        line_start = start
+        while line_start < end:
+            line_end = text.find("\n", line_start, end)
+            line_end = end if line_end < 0 else line_end + 1
+            units.append((line_start, line_end))
+            line_start = line_end
+
+    pieces: List[Chunk] = []
+    group_start = group_end = units[0][0]
+    for start, end in units:
+        if token_index(end) - token_index(group_start) <= room:
+            group_end = end
+            continue
+        if group_end > group_start:
+            pieces.append(_piece(header, header_tokens, text, group_start, group_end, token_index))
+        if token_index(end) - token_index(start) <= room:
+            group_start, group_end = start, end
+            continue
+        # A single line larger than the budget: cut it on token boundaries.
+        first, last = token_index(start), token_index(end)
+        for offset in range(first, last, room):
+            part = encoding.decode(tokens[offset : min(offset + room, last)])
+            pieces.append(
+                Chunk(header + part, header_tokens + min(room, last - offset) + SPLIT_SLACK_TOKENS)
+            )
+        group_start = group_end = end
+    if group_end > group_start:
+        pieces.append(_piece(header, header_tokens, text, group_start, group_end, token_index))
+    return pieces
+
+
+def _piece(header: str, header_tokens: int, text: str, start: int, end: int, token_index) -> Chunk:
+    body_tokens = token_index(end) - token_index(start)
+    return Chunk(
+        header + text[start:end].rstrip("\n"),
+        header_tokens + body_tokens + SPLIT_SLACK_TOKENS,
+    )
 
 
 def _count_tokens(text: str, encoding) -> int:
     return len(encoding.encode(text))
 
 
-def _build_map_messages(mr: Dict[str, Any], chunk: str) -> List[Dict[str, str]]:
+def fit_description(
+    mr: Dict[str, Any],
+    encoding,
+    chunk_tokens: int,
+    description_chars: int = 0,
+    instructions: Sequence[str] = (REVIEW_INSTRUCTIONS,),
+    warn: bool = True,
+) -> Tuple[Dict[str, Any], int]:
+    # Returns the MR and description cap to build the prompts with. A long
+    # description would otherwise leave no room for the diff in a chunk: it
+    # is cut to its share of the room the fixed prompt leaves, or dropped
+    # when there is none.
+    description = (mr.get("description") or "").strip()
+    if description_chars > 0:
+        description = description[:description_chars]
+    if not description:
+        return mr, description_chars
+    bare = {**mr, "description": ""}
+    fixed = max(prompt_overhead_tokens(bare, encoding, 0, text) for text in instructions)
+    room = int((chunk_tokens - fixed) * DESCRIPTION_CHUNK_SHARE) - DESCRIPTION_CUT_TOKENS
+    tokens = encoding.encode(description)
+    if len(tokens) <= room:
+        return mr, description_chars
+    if room <= 0:
+        if warn:
+            print(
+                f"Warning: no room for the MR description in {chunk_tokens}-token chunks; "
+                "it is left out of the prompts",
+                file=sys.stderr,
+            )
+        return bare, 0
+    chars = max(1, len(encoding.decode(tokens[:room])))
+    if warn:
+        print(
+            f"Warning: MR description cut to {chars} characters to fit "
+            f"{chunk_tokens}-token chunks",
+            file=sys.stderr,
+        )
+    return mr, chars
+
+
+def prompt_overhead_tokens(
+    mr: Dict[str, Any],
+    encoding,
+    description_chars: int = 0,
+    instructions: str = REVIEW_INSTRUCTIONS,
+) -> int:
+    messages = _build_map_messages(mr, "", description_chars, instructions)
+    content_tokens = sum(_count_tokens(message["content"], encoding) for message in messages)
+    return content_tokens + MESSAGE_OVERHEAD_TOKENS * len(messages) + REPLY_OVERHEAD_TOKENS
+
+
+def _build_map_messages(
+    mr: Dict[str, Any],
+    chunk: str,
+    description_chars: int = 0,
+    instructions: str = REVIEW_INSTRUCTIONS,
+) -> List[Dict[str, str]]:
     title = mr.get("title", "(no title)")
     description = (mr.get("description") or "").strip()
+    if description_chars > 0 and len(description) > description_chars:
+        description = description[:description_chars].rstrip() + " [...]"
     return [
+        {"role": "system", "content": instructions},
         {
-            "role": "system",
+            "role": "user",
             "content": (
-                "You are a senior code reviewer for GitLab merge requests. "
-                "Return ONLY valid JSON. No markdown."
+                f"MR Title: {title}\n"
+                f"MR Description: {description}\n\n"
+                f"Annotated diff:\n{chunk}"
             ),
         },
+    ]
+
+
+def _build_repair_messages(fragment: str) -> List[Dict[str, str]]:
+    return [
+        {
+            "role": "system",
+            "content": "You repair malformed JSON. Return ONLY valid JSON. No markdown.",
+        },
         {
             "role": "user",
             "content": (
-                "Review the following annotated diff chunk. Focus on code quality, "
-                "naming, documentation, architecture, clean code, and design patterns. "
-                "Use the line numbers provided.\n\n"
-                f"MR Title: {title}\n"
-                f"MR Description: {description}\n\n"
-                "Return a JSON array of objects with keys: "
-                "path (string), line (int), severity (low|medium|high), message (markdown string), rule_id (string).\n"
-                "If there are no issues, return an empty array: [].\n\n"
-                f"Annotated diff:\n{chunk}"
+                "The following fragment is the malformed or truncated end of a JSON array "
+                "of code review findings with keys path, line, severity, message, rule_id. "
+                "Return it as a valid JSON array, keeping every finding whose path, line "
+                "and message are present and dropping incomplete ones.\n\n"
+                f"Fragment:\n{fragment}"
             ),
         },
     ]
 
 
 def parse_findings(content: str) -> List[Finding]:
+    return extract_findings(content).findings
+
+
+def extract_findings(content: str) -> Extraction:
     try:
         data = json.loads(content)
     except json.JSONDecodeError:
-        return []
+        return _salvage_findings(content)
 
     if isinstance(data, dict) and "findings" in data:
         data = data["findings"]
 
     if not isinstance(data, list):
-        return []
+        return Extraction(findings=[])
 
-    findings: List[Finding] = []
-    for item in data:
-        if not isinstance(item, dict):
-            continue
-        path = item.get("path")
-        line = item.get("line")
-        message = item.get("message")
-        if not path or message is None:
-            continue
-        try:
-            line_no = int(line)
-        except (TypeError, ValueError):
-            continue
-        severity = str(item.get("severity", "medium")).lower()
-        if severity not in {"low", "medium", "high"}:
-            severity = "medium"
-        rule_id = str(item.get("rule_id", "LLM"))
-        findings.append(
-            Finding(
-                path=path,
-                line=line_no,
-                message=str(message),
-                severity=severity,
-                rule_id=rule_id,
-            )
-        )
+    extraction = _findings_from_items(data)
+    extraction.parsed = len(extraction.findings)
+    extraction.complete = not extraction.dropped
+    return extraction
 
-    return findings
+
+def _salvage_findings(content: str) -> Extraction:
+    # Tolerant path for replies json.loads rejects: markdown fences, prose
+    # around the array, trailing commas, truncated output. Every well-formed
+    # item is kept; the unparseable tail is returned for a repair call.
+    parser = JSONArrayStreamParser()
+    items = parser.feed(content)
+    if not parser.started:
+        # Bare objects without an enclosing array.
+        parser = JSONArrayStreamParser()
+        items = parser.feed("[" + content + "]")
+    extraction = _findings_from_items(items)
+    while not extraction.findings and _bracketed_prose(parser, extraction.dropped):
+        # "Issues [see below]: [...]": the first bracket was prose, try the
+        # next top-level array.
+        rest = parser.remainder()
+        parser = JSONArrayStreamParser()
+        extraction = _findings_from_items(parser.feed(rest))
+    extraction.salvaged = len(extraction.findings)
+    extraction.dropped += parser.invalid
+    if not parser.finished:
+        extraction.tail = parser.pending()
+    extraction.complete = parser.finished and not extraction.dropped
+    return extraction
+
+
+def _findings_from_items(items: List[Any]) -> Extraction:
+    extraction = Extraction(findings=[])
+    for item in items:
+        finding = finding_from_item(item)
+        if finding is None:
+            extraction.dropped += 1
+        else:
+            extraction.findings.append(finding)
+    return extraction
+
+
+def _bracketed_prose(parser: JSONArrayStreamParser, dropped: int) -> bool:
+    # A closed array whose items were all unusable, with another "[" after it.
+    return parser.finished and bool(dropped or parser.invalid) and "[" in parser.remainder()
+
+
+def finding_from_item(item: Any) -> Optional[Finding]:
+    if not isinstance(item, dict):
+        return None
+    path = item.get("path")
+    line = item.get("line")
+    message = item.get("message")
+    if not path or message is None:
+        return None
+    try:
+        line_no = int(line)
+    except (TypeError, ValueError):
+        return None
+    severity = str(item.get("severity", "medium")).lower()
+    if severity not in {"low", "medium", "high"}:
+        severity = "medium"
+    rule_id = str(item.get("rule_id", "LLM"))
+    return Finding(
+        path=path,
+        line=line_no,
+        message=str(message),
+        severity=severity,
+        rule_id=rule_id,
+    )
 
 
 def dedupe_findings(findings: Iterable[Finding]) -> List[Finding]:
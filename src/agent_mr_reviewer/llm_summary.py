@@ -2,13 +2,14 @@ from __future__ import annotations
 
 from typing import Dict, Iterable
 
+from agent_mr_reviewer.publisher import CommentCounts
 from agent_mr_reviewer.review_rules import Finding
 
 
 def build_llm_summary(
     mr: Dict[str, str],
     findings: Iterable[Finding],
-    max_comments: int,
+    counts: CommentCounts,
     source_label: str = "LLM",
 ) -> str:
     findings_list = list(findings)
@@ -22,14 +23,15 @@ def build_llm_summary(
         f"MR Review Summary ({source_label})",
         f"- Title: {title}",
         f"- Findings: {total} (high: {by_sev.get('high', 0)}, medium: {by_sev.get('medium', 0)}, low: {by_sev.get('low', 0)})",
-        f"- Inline comments posted: {min(total, max_comments)}",
+        *counts.summary_lines(),
         "",
         "Top findings:",
     ]
 
     for finding in findings_list[:10]:
+        similar = f" (+{len(finding.lines)} similar)" if finding.lines else ""
         lines.append(
-            f"- {finding.path}:{finding.line} [{finding.severity}] {finding.message}"
+            f"- {finding.path}:{finding.line}{similar} [{finding.severity}] {finding.message}"
         )
 
     return "\n".join(lines)
@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Deque, Dict, Iterable, Iterator, List, TypeVar
+
+METRIC_PREFIX = "agent_mr_reviewer_"
+LATENCY_QUANTILES = (0.5, 0.9, 0.99)
+# Per-call samples kept for percentiles and the per-chunk listing; the
+# webhook service shares one RunMetrics for its whole lifetime.
+MAX_SAMPLES = 10000
+
+T = TypeVar("T")
+
+
+@dataclass
+class SpanStats:
+    # total: wall time inside the span; self_seconds: the same minus the
+    # nested spans of the same thread, so phases add up without double
+    # counting (parsing pulls diff pages, chunking pulls parsed files).
+    count: int = 0
+    total: float = 0.0
+    self_seconds: float = 0.0
+    max: float = 0.0
+
+
+@dataclass
+class ChunkSample:
+    prompt_tokens: int
+    completion_tokens: int
+    latency: float
+    cached: bool
+    tier: str = ""
+
+
+class RunMetrics:
+    # Thread-safe collector for one run: phase spans, HTTP call spans,
+    # retries and per-chunk LLM usage.
+
+    def __init__(self) -> None:
+        self.started = time.time()
+        self.spans: Dict[str, SpanStats] = {}
+        self.counters: Dict[str, int] = {}
+        self.chunks: Deque[ChunkSample] = deque(maxlen=MAX_SAMPLES)
+        self.latencies: Deque[float] = deque(maxlen=MAX_SAMPLES)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        stack: List[float] = self._stack()
+        stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            self._record(name, elapsed, elapsed - nested)
+
+    def timed_iter(self, name: str, items: Iterable[T]) -> Iterator[T]:
+        # Times each next() of a lazy pipeline stage as one span entry.
+        iterator = iter(items)
+        while True:
+            with self.span(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def incr(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record_chunk(
+        self,
+        prompt_tokens: int,
+        completion_tokens: int,
+        latency: float,
+        cached: bool = False,
+        tier: str = "",
+    ) -> None:
+        # tier: model tier of a cascade ("screen" or "review"), counted
+        # separately on top of the totals.
+        counts = [
+            ("llm_chunks", 1),
+            ("llm_prompt_tokens", prompt_tokens),
+            ("llm_completion_tokens", completion_tokens),
+            ("llm_cache_hits" if cached else "llm_cache_misses", 1),
+        ]
+        if tier:
+            counts += [
+                (f"llm_{tier}_calls", 1),
+                (f"llm_{tier}_prompt_tokens", prompt_tokens),
+                (f"llm_{tier}_completion_tokens", completion_tokens),
+                (f"llm_{tier}_latency_ms", round(latency * 1000)),
+            ]
+        with self._lock:
+            self.chunks.append(
+                ChunkSample(prompt_tokens, completion_tokens, latency, cached, tier)
+            )
+            if not cached:
+                self.latencies.append(latency)
+            for name, amount in counts:
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def latency_percentiles(self) -> Dict[str, float]:
+        with self._lock:
+            ordered = sorted(self.latencies)
+        if not ordered:
+            return {}
+        return {
+            f"p{int(quantile * 100)}": round(_quantile(ordered, quantile), 4)
+            for quantile in LATENCY_QUANTILES
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = {name: replace(stats) for name, stats in sorted(self.spans.items())}
+            chunks = list(self.chunks)
+            counters = dict(sorted(self.counters.items()))
+        return {
+            "started": self.started,
+            "wall_seconds": round(time.time() - self.started, 4),
+            "spans": {
+                name: {
+                    "count": stats.count,
+                    "total_seconds": round(stats.total, 4),
+                    "self_seconds": round(stats.self_seconds, 4),
+                    "max_seconds": round(stats.max, 4),
+                }
+                for name, stats in spans.items()
+            },
+            "counters": counters,
+            "llm_latency_seconds": self.latency_percentiles(),
+            "llm_chunks": [
+                {
+                    "prompt_tokens": chunk.prompt_tokens,
+                    "completion_tokens": chunk.completion_tokens,
+                    "latency_seconds": round(chunk.latency, 4),
+                    "cached": chunk.cached,
+                    **({"tier": chunk.tier} if chunk.tier else {}),
+                }
+                for chunk in chunks
+            ],
+        }
+
+    def prometheus(self) -> str:
+        with self._lock:
+            spans = [(name, replace(stats)) for name, stats in sorted(self.spans.items())]
+            counters = sorted(self.counters.items())
+        lines: List[str] = []
+        for name, stats in spans:
+            lines.append(f'{METRIC_PREFIX}span_seconds_total{{span="{name}"}} {stats.total:.6f}')
+            lines.append(
+                f'{METRIC_PREFIX}span_self_seconds_total{{span="{name}"}} {stats.self_seconds:.6f}'
+            )
+            lines.append(f'{METRIC_PREFIX}span_calls_total{{span="{name}"}} {stats.count}')
+        for name, value in counters:
+            lines.append(f"{METRIC_PREFIX}{name}_total {value}")
+        for label, value in self.latency_percentiles().items():
+            quantile = int(label[1:]) / 100
+            lines.append(f'{METRIC_PREFIX}llm_latency_seconds{{quantile="{quantile}"}} {value}')
+        return "".join(line + "\n" for line in lines)
+
+    def write_json(self, path: str) -> None:
+        _write_atomic(path, json.dumps(self.to_dict(), indent=2, sort_keys=True) + "\n")
+
+    def write_prometheus(self, path: str) -> None:
+        # node_exporter's textfile collector must never read a half-written file.
+        text = self.prometheus()
+        text += f"{METRIC_PREFIX}last_run_timestamp_seconds {self.started:.0f}\n"
+        text += f"{METRIC_PREFIX}run_seconds {time.time() - self.started:.3f}\n"
+        _write_atomic(path, text)
+
+    def _stack(self) -> List[float]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record(self, name: str, elapsed: float, self_seconds: float) -> None:
+        with self._lock:
+            stats = self.spans.get(name)
+            if stats is None:
+                stats = self.spans[name] = SpanStats()
+            stats.count += 1
+            stats.total += elapsed
+            stats.self_seconds += self_seconds
+            stats.max = max(stats.max, elapsed)
+
+
+def _quantile(ordered: List[float], quantile: float) -> float:
+    # Nearest-rank on an already sorted sample.
+    return ordered[max(0, math.ceil(quantile * len(ordered)) - 1)]
+
+
+def _write_atomic(path: str, text: str) -> None:
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as handle:
+            handle.write(text)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
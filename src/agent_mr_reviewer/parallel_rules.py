@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+import itertools
+import os
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional
+
+from agent_mr_reviewer.diff_parser import parse_changes
+from agent_mr_reviewer.positions import FilePositions
+from agent_mr_reviewer.review_rules import Finding, analyze_diff
+
+# Raw diff bytes per task: small files are grouped so one round of pickling
+# covers many of them; a file larger than this is a task on its own.
+BATCH_BYTES = 256 * 1024
+BATCH_FILES = 200
+# Tasks queued per worker; bounds how much of the MR is held in memory.
+TASKS_PER_WORKER = 2
+
+
+@dataclass
+class FileResult:
+    path: str
+    positions: Optional[FilePositions]
+    findings: List[Finding]
+
+
+def analyze_changes(
+    changes: Iterable[Dict[str, Any]],
+    workers: int = 0,
+    batch_bytes: int = BATCH_BYTES,
+    sources: Optional[Dict[str, str]] = None,
+) -> Iterator[FileResult]:
+    # Parses the GitLab changes and runs the rules on a process pool
+    # (workers=0: one per CPU). Results come back in the order of the
+    # changes, exactly as analyze_diff(parse_changes(changes), sources)
+    # would give them. MRs that fit in one batch are analysed in this
+    # process: the pool is only started for the second batch.
+    sources = sources or {}
+    batches = _batches(changes, batch_bytes)
+    first = next(batches, None)
+    if first is None:
+        return
+    second = next(batches, None)
+    if second is None:
+        yield from _analyze_batch(first, sources)
+        return
+
+    # Rules are registered at import time, so workers see the same engine.
+    max_workers = workers if workers > 0 else os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending: Deque[Future] = deque()
+        for batch in itertools.chain([first, second], batches):
+            # Each task only carries the post-images of its own files.
+            batch_sources = {
+                change["new_path"]: sources[change["new_path"]]
+                for change in batch
+                if change.get("new_path") in sources
+            }
+            pending.append(executor.submit(_analyze_batch, batch, batch_sources))
+            while len(pending) > max_workers * TASKS_PER_WORKER:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def _batches(
+    changes: Iterable[Dict[str, Any]], batch_bytes: int
+) -> Iterator[List[Dict[str, Any]]]:
+    batch: List[Dict[str, Any]] = []
+    size = 0
+    for change in changes:
+        batch.append(change)
+        size += len(change.get("diff") or "")
+        if size >= batch_bytes or len(batch) >= BATCH_FILES:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+
+def _analyze_batch(
+    changes: List[Dict[str, Any]], sources: Dict[str, str]
+) -> List[FileResult]:
+    results: List[FileResult] = []
+    for diff in parse_changes(changes):
+        positions = None if diff.is_binary else FilePositions(diff)
+        results.append(FileResult(diff.path, positions, analyze_diff([diff], sources)))
+    return results
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass, replace
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from agent_mr_reviewer.diff_parser import ADDED, CONTEXT, FileDiff
+from agent_mr_reviewer.review_rules import Finding
+
+# How far (in lines) a finding may be moved onto the closest added line.
+SNAP_DISTANCE = 3
+
+
+@dataclass
+class Placement:
+    finding: Finding
+    old_path: str
+    # Set for context lines, which GitLab anchors on both sides of the diff.
+    old_line: Optional[int] = None
+    snapped_from: Optional[int] = None
+
+
+class FilePositions:
+    __slots__ = ("old_path", "added", "context")
+
+    def __init__(self, diff: FileDiff) -> None:
+        self.old_path = diff.old_path or diff.path
+        added: List[int] = []
+        self.context: Dict[int, int] = {}
+        for hunk in diff.hunks:
+            for index in range(hunk.start, hunk.end):
+                kind = diff.kinds[index]
+                if kind == ADDED:
+                    added.append(diff.new_lines[index])
+                elif kind == CONTEXT:
+                    self.context[diff.new_lines[index]] = diff.old_lines[index]
+        self.added = array("l", sorted(added))
+
+    def is_added(self, line: int) -> bool:
+        position = bisect_left(self.added, line)
+        return position < len(self.added) and self.added[position] == line
+
+    def closest_added(self, line: int) -> Optional[int]:
+        position = bisect_left(self.added, line)
+        candidates = self.added[max(0, position - 1) : position + 1]
+        if not candidates:
+            return None
+        # Ties go to the line after the cited one.
+        return min(candidates, key=lambda candidate: (abs(candidate - line), candidate < line))
+
+
+class PositionIndex:
+    # Which new-side lines of the MR diff can carry an inline comment, built
+    # from the parsed files as they stream past (track()). Findings are
+    # checked locally instead of letting GitLab reject the discussion.
+
+    def __init__(self, snap_distance: int = SNAP_DISTANCE) -> None:
+        self.snap_distance = snap_distance
+        self.files: Dict[str, FilePositions] = {}
+
+    def track(self, files: Iterable[FileDiff]) -> Iterator[FileDiff]:
+        for diff in files:
+            if not diff.is_binary:
+                self.files[diff.path] = FilePositions(diff)
+            yield diff
+
+    def place(self, finding: Finding) -> Optional[Placement]:
+        positions = self.files.get(finding.path)
+        if positions is None:
+            return None
+        line = finding.line
+        if positions.is_added(line):
+            return Placement(finding, positions.old_path)
+        if line in positions.context:
+            return Placement(finding, positions.old_path, old_line=positions.context[line])
+        closest = positions.closest_added(line)
+        if closest is None or abs(closest - line) > self.snap_distance:
+            return None
+        lines = [other for other in finding.lines if other != closest]
+        return Placement(
+            replace(finding, line=closest, lines=lines),
+            positions.old_path,
+            snapped_from=line,
+        )
+
+    def place_all(
+        self, findings: Iterable[Finding]
+    ) -> Tuple[List[Placement], List[Finding]]:
+        placed: List[Placement] = []
+        unplaceable: List[Finding] = []
+        for finding in findings:
+            placement = self.place(finding)
+            if placement is None:
+                unplaceable.append(finding)
+            else:
+                placed.append(placement)
+        return placed, unplaceable
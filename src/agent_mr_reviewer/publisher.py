@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+import hashlib
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import requests
+
+from agent_mr_reviewer.dedupe import fingerprint
+from agent_mr_reviewer.gitlab_client import GitLabAPIError, GitLabClient
+from agent_mr_reviewer.rate_limit import backoff_delay
+from agent_mr_reviewer.review_rules import Finding
+
+FINDING_MARKER_PATTERN = re.compile(r"<!-- agent-mr-reviewer:finding=([0-9a-f]{16}) -->")
+
+
+@dataclass
+class InlineComment:
+    finding: Finding
+    body: str
+    position: Dict[str, Any]
+
+
+@dataclass
+class PublishResult:
+    comment: InlineComment
+    ok: bool
+    error: Optional[str] = None
+    discussion_id: Optional[str] = None
+
+
+@dataclass
+class CommentCounts:
+    # Inline comments of one run: posted now, failed, already on the MR from
+    # an earlier run, and bot discussions resolved as no longer reported.
+    posted: int = 0
+    failed: int = 0
+    kept: int = 0
+    resolved: int = 0
+
+    def summary_lines(self) -> List[str]:
+        lines = [f"- Inline comments posted: {self.posted}"]
+        if self.failed:
+            lines.append(f"- Inline comments failed: {self.failed}")
+        if self.kept:
+            lines.append(f"- Inline comments already on the MR (not posted again): {self.kept}")
+        if self.resolved:
+            lines.append(
+                f"- Discussions resolved (finding no longer reported): {self.resolved}"
+            )
+        return lines
+
+
+def comment_marker(finding: Finding) -> str:
+    material = f"{finding.path}\0{finding.line}\0{finding.rule_id}\0{finding.message}"
+    digest = hashlib.sha1(material.encode("utf-8")).hexdigest()[:16]
+    return f"<!-- agent-mr-reviewer:comment={digest} -->"
+
+
+def finding_marker(finding: Finding) -> str:
+    # Matched by the reconciliation on later runs; comment_marker is only
+    # used to recognise this very comment after an ambiguous failure.
+    return f"<!-- agent-mr-reviewer:finding={fingerprint(finding)} -->"
+
+
+class DiscussionPublisher:
+    # Posts discussions on a bounded pool as they are submitted, from any
+    # thread. results() waits for all of them and returns one result per
+    # comment, in submission order; a failed comment never stops the others.
+
+    def __init__(
+        self,
+        client: GitLabClient,
+        project_id: str,
+        mr_iid: str,
+        workers: int = 4,
+        max_attempts: int = 3,
+    ) -> None:
+        self.client = client
+        self.project_id = project_id
+        self.mr_iid = mr_iid
+        self.max_attempts = max_attempts
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        self._futures: List[Future] = []
+        self._lock = threading.Lock()
+
+    def submit(self, comment: InlineComment) -> None:
+        future = self._executor.submit(
+            _publish_one, self.client, self.project_id, self.mr_iid, comment, self.max_attempts
+        )
+        with self._lock:
+            self._futures.append(future)
+
+    def results(self) -> List[PublishResult]:
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            return [future.result() for future in self._futures]
+
+
+def publish_discussions(
+    client: GitLabClient,
+    project_id: str,
+    mr_iid: str,
+    comments: Sequence[InlineComment],
+    workers: int = 4,
+    max_attempts: int = 3,
+) -> List[PublishResult]:
+    publisher = DiscussionPublisher(
+        client,
+        project_id,
+        mr_iid,
+        workers=max(1, min(workers, len(comments))),
+        max_attempts=max_attempts,
+    )
+    for comment in comments:
+        publisher.submit(comment)
+    return publisher.results()
+
+
+def _publish_one(
+    client: GitLabClient,
+    project_id: str,
+    mr_iid: str,
+    comment: InlineComment,
+    max_attempts: int,
+) -> PublishResult:
+    marker = comment_marker(comment.finding)
+    body = f"{comment.body}\n\n{finding_marker(comment.finding)}\n{marker}"
+    error = ""
+    for attempt in range(max(1, max_attempts)):
+        # After an ambiguous failure the discussion may have been created
+        # anyway: look for our marker before posting it a second time.
+        if attempt:
+            time.sleep(backoff_delay(attempt - 1))
+            try:
+                existing = _find_discussion(client, project_id, mr_iid, marker)
+            except (RuntimeError, requests.RequestException) as exc:
+                existing, error = None, str(exc)
+            if existing:
+                return PublishResult(comment, True, discussion_id=existing)
+        try:
+            created = client.post_discussion(project_id, mr_iid, body, comment.position)
+        except GitLabAPIError as exc:
+            error = str(exc)
+            if exc.status_code < 500:
+                # Invalid position, permissions... retrying cannot help. 429s
+                # were already retried by the client.
+                break
+            continue
+        except requests.RequestException as exc:
+            # Connection drops, timeouts, truncated responses: the request
+            # may have gone through, so the retry looks for the marker first.
+            error = str(exc)
+            continue
+        return PublishResult(comment, True, discussion_id=created.get("id"))
+    return PublishResult(comment, False, error=error)
+
+
+def _find_discussion(
+    client: GitLabClient, project_id: str, mr_iid: str, marker: str
+) -> Optional[str]:
+    for discussion in client.list_discussions(project_id, mr_iid):
+        for note in discussion.get("notes") or []:
+            if marker in (note.get("body") or ""):
+                return discussion.get("id")
+    return None
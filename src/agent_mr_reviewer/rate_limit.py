@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+from collections import deque
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import random
+import threading
+import time
+from typing import Callable, Deque, Mapping, Optional, Tuple
+
+WINDOW_SECONDS = 60.0
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        requests_per_minute: int = 0,
+        tokens_per_minute: int = 0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.requests_per_minute = max(0, requests_per_minute)
+        self.tokens_per_minute = max(0, tokens_per_minute)
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._events: Deque[Tuple[float, int]] = deque()
+        self._window_tokens = 0
+        self._paused_until = 0.0
+
+    def acquire(self, tokens: int = 0) -> None:
+        if self.tokens_per_minute and tokens > self.tokens_per_minute:
+            tokens = self.tokens_per_minute
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._expire(now)
+                wait = self._paused_until - now
+                if wait <= 0:
+                    wait = self._budget_wait(now, tokens)
+                if wait <= 0:
+                    self._events.append((now, tokens))
+                    self._window_tokens += tokens
+                    return
+            self._sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, self._clock() + seconds)
+
+    def _expire(self, now: float) -> None:
+        while self._events and now - self._events[0][0] >= WINDOW_SECONDS:
+            _, tokens = self._events.popleft()
+            self._window_tokens -= tokens
+
+    def _budget_wait(self, now: float, tokens: int) -> float:
+        wait = 0.0
+        if self.requests_per_minute and len(self._events) >= self.requests_per_minute:
+            oldest = self._events[len(self._events) - self.requests_per_minute][0]
+            wait = max(wait, oldest + WINDOW_SECONDS - now)
+        if self.tokens_per_minute and self._window_tokens + tokens > self.tokens_per_minute:
+            excess = self._window_tokens + tokens - self.tokens_per_minute
+            for timestamp, event_tokens in self._events:
+                excess -= event_tokens
+                if excess <= 0:
+                    wait = max(wait, timestamp + WINDOW_SECONDS - now)
+                    break
+        return wait
+
+
+def retry_after_seconds(
+    headers: Mapping[str, str], now: Optional[datetime] = None
+) -> Optional[float]:
+    # Retry-After is either a number of seconds or an HTTP date.
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - (now or datetime.now(timezone.utc))).total_seconds())
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
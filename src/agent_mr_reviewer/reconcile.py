@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from agent_mr_reviewer.dedupe import fingerprint
+from agent_mr_reviewer.incremental import HEAD_MARKER_PATTERN
+from agent_mr_reviewer.publisher import FINDING_MARKER_PATTERN
+from agent_mr_reviewer.review_rules import Finding
+
+SUMMARY_MARKER = "<!-- agent-mr-reviewer:summary -->"
+
+
+@dataclass
+class BotDiscussion:
+    discussion_id: str
+    path: str
+    line: Optional[int]
+    fingerprint: str
+    resolved: bool
+
+
+def find_summary_note(notes: Iterable[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    # Newest first: the summary note this agent keeps updating. Notes from
+    # before the summary marker are recognised by their head marker.
+    for note in notes:
+        if note.get("system"):
+            continue
+        body = note.get("body") or ""
+        if SUMMARY_MARKER in body or HEAD_MARKER_PATTERN.search(body):
+            return note
+    return None
+
+
+def bot_discussions(discussions: Iterable[Dict[str, Any]]) -> List[BotDiscussion]:
+    # Discussions opened by this agent, recognised by the finding marker of
+    # their first note.
+    found: List[BotDiscussion] = []
+    for discussion in discussions:
+        notes = discussion.get("notes") or []
+        if not notes:
+            continue
+        first = notes[0]
+        match = FINDING_MARKER_PATTERN.search(first.get("body") or "")
+        if not match:
+            continue
+        position = first.get("position") or {}
+        found.append(
+            BotDiscussion(
+                discussion_id=str(discussion.get("id")),
+                path=position.get("new_path") or "",
+                line=position.get("new_line"),
+                fingerprint=match.group(1),
+                resolved=bool(first.get("resolved")),
+            )
+        )
+    return found
+
+
+class Reconciler:
+    # Matches the findings of this run against the discussions the agent
+    # already opened on the MR. Fingerprints ignore line numbers, so a
+    # finding that moved with its code keeps its discussion; several
+    # findings with one fingerprint match as many discussions.
+
+    def __init__(self, discussions: Iterable[Dict[str, Any]] = ()) -> None:
+        self._available: Dict[str, List[BotDiscussion]] = {}
+        self.existing = bot_discussions(discussions)
+        for discussion in self.existing:
+            self._available.setdefault(discussion.fingerprint, []).append(discussion)
+        self.kept: List[BotDiscussion] = []
+        self._lock = threading.Lock()
+
+    def claim(self, finding: Finding) -> bool:
+        # True when a discussion already carries this finding, so it is not
+        # posted again. Resolved ones count too: a finding a reviewer has
+        # resolved is not reopened.
+        key = fingerprint(finding)
+        with self._lock:
+            candidates = self._available.get(key)
+            if not candidates:
+                return False
+            self.kept.append(candidates.pop(0))
+            return True
+
+    def stale(
+        self, findings: Iterable[Finding], reviewed_paths: Set[str], diff_paths: Set[str]
+    ) -> List[BotDiscussion]:
+        # Open discussions whose finding went away: the file left the MR
+        # diff, or it was reviewed in full this run without that finding.
+        current = {fingerprint(finding) for finding in findings}
+        with self._lock:
+            unclaimed = [item for items in self._available.values() for item in items]
+        return [
+            discussion
+            for discussion in unclaimed
+            if not discussion.resolved
+            and (
+                discussion.path not in diff_paths
+                or (discussion.path in reviewed_paths and discussion.fingerprint not in current)
+            )
+        ]
@@ -1,10 +1,12 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+import ast
+from dataclasses import dataclass, field
 import re
-from typing import List
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+import warnings
 
-from unidiff import PatchSet
+from agent_mr_reviewer.diff_parser import ADDED, FileDiff
 
 
 @dataclass
@@ -14,117 +16,330 @@ class Finding:
     message: str
     severity: str
     rule_id: str
+    # Other lines of the same file where a near-duplicate was collapsed.
+    lines: List[int] = field(default_factory=list)
 
 
 SNAKE_CASE = re.compile(r"^[a-z_][a-z0-9_]*$")
 PASCAL_CASE = re.compile(r"^[A-Z][A-Za-z0-9]*$")
 TICKET_PATTERN = re.compile(r"TODO[:\s]*[A-Z]{2,}-\d+")
 
+# check(content, captures, diff, index) -> True when the rule fires.
+# captures holds the groups of the rule's trigger (empty for line rules);
+# index is the line's row in the FileDiff tables.
+RuleCheck = Callable[[str, Tuple[Optional[str], ...], FileDiff, int], bool]
+# check(node) -> True when the source rule fires on that node of the
+# post-image syntax tree.
+SourceCheck = Callable[[ast.AST], bool]
+PYTHON_SUFFIXES = (".py", ".pyi")
 
-def analyze_diff(patch: PatchSet) -> List[Finding]:
-    findings: List[Finding] = []
-    for patched_file in patch:
-        if patched_file.is_binary_file:
-            continue
-        for hunk in patched_file:
-            hunk_lines = list(hunk)
-            for index, line in enumerate(hunk_lines):
-                if not line.is_added or line.is_removed:
+
+@dataclass(frozen=True)
+class Trigger:
+    name: str
+    pattern: str
+    literals: Tuple[str, ...] = ()
+
+
+@dataclass(frozen=True)
+class Rule:
+    rule_id: str
+    severity: str
+    message: str
+    check: RuleCheck
+    trigger: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class SourceRule:
+    # Full-file version of the registered rule with the same rule_id
+    # (message and severity come from it). On Python files whose post-image
+    # is available it replaces that rule, which only sees the diff.
+    rule_id: str
+    node_types: Tuple[type, ...]
+    check: SourceCheck
+
+
+class RuleEngine:
+    # Line rules (no trigger) run first, in registration order, on every added
+    # line. Triggered rules run only when their trigger matches: all trigger
+    # patterns are combined into one alternation matched at the start of the
+    # line, guarded by a substring prefilter on the triggers' literals.
+    # Triggers are therefore expected to be mutually exclusive (statement
+    # keywords, call names...); the first matching one wins.
+
+    def __init__(
+        self,
+        rules: Sequence[Rule],
+        triggers: Sequence[Trigger],
+        source_rules: Sequence[SourceRule] = (),
+    ) -> None:
+        self.line_rules = [rule for rule in rules if rule.trigger is None]
+        rules_by_id = {rule.rule_id: rule for rule in rules}
+        self.source_rules = [
+            (rules_by_id[source_rule.rule_id], source_rule)
+            for source_rule in source_rules
+            if source_rule.rule_id in rules_by_id
+        ]
+        self.source_rule_ids = frozenset(rule.rule_id for rule, _ in self.source_rules)
+        self.literals: Optional[Tuple[str, ...]] = ()
+        self._dispatch: Dict[int, Tuple[int, int, List[Rule]]] = {}
+
+        parts: List[str] = []
+        group = 1
+        for trigger in triggers:
+            trigger_rules = [rule for rule in rules if rule.trigger == trigger.name]
+            if not trigger_rules:
+                continue
+            inner_groups = re.compile(trigger.pattern).groups
+            parts.append(f"({trigger.pattern})")
+            self._dispatch[group] = (group + 1, group + 1 + inner_groups, trigger_rules)
+            group += 1 + inner_groups
+            if self.literals is not None:
+                self.literals = self.literals + trigger.literals if trigger.literals else None
+        self.pattern = re.compile("|".join(parts)) if parts else None
+
+    def analyze_line(
+        self,
+        path: str,
+        line_no: int,
+        content: str,
+        diff: FileDiff,
+        index: int,
+        skip: FrozenSet[str] = frozenset(),
+    ) -> List[Finding]:
+        # skip: rule ids not to run (their source rules cover the file).
+        findings: List[Finding] = []
+        for rule in self.line_rules:
+            if skip and rule.rule_id in skip:
+                continue
+            if rule.check(content, (), diff, index):
+                findings.append(_finding(rule, path, line_no))
+
+        if self.pattern is None:
+            return findings
+        if self.literals is not None:
+            for literal in self.literals:
+                if literal in content:
+                    break
+            else:
+                return findings
+        match = self.pattern.match(content)
+        if match is None:
+            return findings
+        # lastindex is the outermost group that matched, i.e. the trigger wrapper.
+        first, end, trigger_rules = self._dispatch[match.lastindex]
+        captures = match.groups()[first - 1 : end - 1]
+        for rule in trigger_rules:
+            if skip and rule.rule_id in skip:
+                continue
+            if rule.check(content, captures, diff, index):
+                findings.append(_finding(rule, path, line_no))
+        return findings
+
+    def analyze_source(self, diff: FileDiff, source: str) -> Optional[List[Finding]]:
+        # Added lines get the diff rules, except those with a source rule;
+        # the source rules run on the syntax tree of the whole post-image and
+        # report the nodes that start on an added line. None when the file
+        # does not parse: the caller falls back to the diff rules.
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                tree = ast.parse(source, filename=diff.path)
+        except (SyntaxError, ValueError):
+            return None
+        path = diff.path
+        by_line: Dict[int, List[Finding]] = {}
+        for hunk in diff.hunks:
+            for index in range(hunk.start, hunk.end):
+                if diff.kinds[index] != ADDED:
                     continue
-                content = line.value.rstrip("\n")
-                path = patched_file.path
-                line_no = line.target_line_no
-                if line_no is None:
+                line_no = diff.new_lines[index]
+                by_line[line_no] = self.analyze_line(
+                    path, line_no, diff.content(index), diff, index, self.source_rule_ids
+                )
+        if by_line and self.source_rules:
+            for node in ast.walk(tree):
+                found = by_line.get(getattr(node, "lineno", 0))
+                if found is None:
                     continue
+                for rule, source_rule in self.source_rules:
+                    if not isinstance(node, source_rule.node_types):
+                        continue
+                    if any(finding.rule_id == rule.rule_id for finding in found):
+                        continue
+                    if source_rule.check(node):
+                        found.append(_finding(rule, path, node.lineno))
+        return [finding for line_no in sorted(by_line) for finding in by_line[line_no]]
+
+
+def _finding(rule: Rule, path: str, line_no: int) -> Finding:
+    return Finding(
+        path=path,
+        line=line_no,
+        message=rule.message,
+        severity=rule.severity,
+        rule_id=rule.rule_id,
+    )
+
 
-                if content.rstrip() != content:
-                    findings.append(
-                        Finding(
-                            path=path,
-                            line=line_no,
-                            message="Trailing whitespace detected.",
-                            severity="low",
-                            rule_id="TRAILING_WS",
-                        )
-                    )
-
-                if len(content) > 120:
-                    findings.append(
-                        Finding(
-                            path=path,
-                            line=line_no,
-                            message="Line exceeds 120 characters; consider wrapping.",
-                            severity="low",
-                            rule_id="LINE_LENGTH",
-                        )
-                    )
-
-                if "TODO" in content and not TICKET_PATTERN.search(content):
-                    findings.append(
-                        Finding(
-                            path=path,
-                            line=line_no,
-                            message="TODO without ticket reference; add an issue key.",
-                            severity="medium",
-                            rule_id="TODO_TICKET",
-                        )
-                    )
-
-                if re.match(r"\s*print\(", content):
-                    findings.append(
-                        Finding(
-                            path=path,
-                            line=line_no,
-                            message="Avoid print in production code; use logging.",
-                            severity="medium",
-                            rule_id="PRINT_LOGGING",
-                        )
-                    )
-
-                def_match = re.match(r"\s*def\s+([A-Za-z_][A-Za-z0-9_]*)\s*\(", content)
-                if def_match:
-                    func_name = def_match.group(1)
-                    if not SNAKE_CASE.match(func_name):
-                        findings.append(
-                            Finding(
-                                path=path,
-                                line=line_no,
-                                message="Function name should be snake_case.",
-                                severity="medium",
-                                rule_id="FUNC_NAMING",
-                            )
-                        )
-
-                    if not _has_docstring(hunk_lines, index):
-                        findings.append(
-                            Finding(
-                                path=path,
-                                line=line_no,
-                                message="Function missing docstring in this change.",
-                                severity="low",
-                                rule_id="FUNC_DOC",
-                            )
-                        )
-
-                class_match = re.match(r"\s*class\s+([A-Za-z_][A-Za-z0-9_]*)", content)
-                if class_match:
-                    class_name = class_match.group(1)
-                    if not PASCAL_CASE.match(class_name):
-                        findings.append(
-                            Finding(
-                                path=path,
-                                line=line_no,
-                                message="Class name should be PascalCase.",
-                                severity="medium",
-                                rule_id="CLASS_NAMING",
-                            )
-                        )
+TRIGGERS: List[Trigger] = []
+RULES: List[Rule] = []
+SOURCE_RULES: List[SourceRule] = []
+_engine: Optional[RuleEngine] = None
+
+
+def register_trigger(trigger: Trigger) -> None:
+    global _engine
+    TRIGGERS.append(trigger)
+    _engine = None
+
+
+def register_rule(rule: Rule) -> None:
+    global _engine
+    RULES.append(rule)
+    _engine = None
+
+
+def register_source_rule(rule: SourceRule) -> None:
+    global _engine
+    SOURCE_RULES.append(rule)
+    _engine = None
+
+
+def get_engine() -> RuleEngine:
+    global _engine
+    if _engine is None:
+        _engine = RuleEngine(RULES, TRIGGERS, SOURCE_RULES)
+    return _engine
+
+
+def is_python(path: str) -> bool:
+    return path.endswith(PYTHON_SUFFIXES)
+
+
+def analyze_diff(
+    files: Iterable[FileDiff], sources: Optional[Dict[str, str]] = None
+) -> List[Finding]:
+    # sources: post-image content by path. Python files found there are
+    # analysed as a whole; findings still only cite added lines.
+    engine = get_engine()
+    findings: List[Finding] = []
+    for diff in files:
+        if diff.is_binary:
+            continue
+        source = sources.get(diff.path) if sources else None
+        if source is not None and is_python(diff.path):
+            file_findings = engine.analyze_source(diff, source)
+            if file_findings is not None:
+                findings.extend(file_findings)
+                continue
+        path = diff.path
+        text, kinds, new_lines = diff.text, diff.kinds, diff.new_lines
+        starts, ends = diff.starts, diff.ends
+        # Hunk by hunk, so a view restricted with FileDiff.with_hunks only
+        # gets its own lines analysed.
+        for hunk in diff.hunks:
+            for index in range(hunk.start, hunk.end):
+                if kinds[index] != ADDED:
+                    continue
+                content = text[starts[index] : ends[index]]
+                findings.extend(engine.analyze_line(path, new_lines[index], content, diff, index))
 
     return findings
 
 
-def _has_docstring(hunk_lines, def_index: int) -> bool:
-    for line in hunk_lines[def_index + 1 : def_index + 4]:
-        if line.is_added and ("\"\"\"" in line.value or "'''" in line.value):
+def _has_docstring(diff: FileDiff, def_index: int) -> bool:
+    end = min(def_index + 4, diff.hunk_end(def_index))
+    for index in range(def_index + 1, end):
+        if diff.kinds[index] == ADDED and (
+            diff.contains(index, "\"\"\"") or diff.contains(index, "'''")
+        ):
             return True
     return False
+
+
+register_trigger(Trigger("print", r"\s*print\(", ("print(",)))
+register_trigger(Trigger("def", r"\s*def\s+([A-Za-z_][A-Za-z0-9_]*)\s*\(", ("def",)))
+register_trigger(Trigger("class", r"\s*class\s+([A-Za-z_][A-Za-z0-9_]*)", ("class",)))
+
+register_rule(
+    Rule(
+        "TRAILING_WS",
+        "low",
+        "Trailing whitespace detected.",
+        lambda content, captures, diff, index: content.rstrip() != content,
+    )
+)
+register_rule(
+    Rule(
+        "LINE_LENGTH",
+        "low",
+        "Line exceeds 120 characters; consider wrapping.",
+        lambda content, captures, diff, index: len(content) > 120,
+    )
+)
+register_rule(
+    Rule(
+        "TODO_TICKET",
+        "medium",
+        "TODO without ticket reference; add an issue key.",
+        lambda content, captures, diff, index: "TODO" in content
+        and not TICKET_PATTERN.search(content),
+    )
+)
+register_rule(
+    Rule(
+        "PRINT_LOGGING",
+        "medium",
+        "Avoid print in production code; use logging.",
+        lambda content, captures, diff, index: True,
+        trigger="print",
+    )
+)
+register_rule(
+    Rule(
+        "FUNC_NAMING",
+        "medium",
+        "Function name should be snake_case.",
+        lambda content, captures, diff, index: not SNAKE_CASE.match(captures[0]),
+        trigger="def",
+    )
+)
+register_rule(
+    Rule(
+        "FUNC_DOC",
+        "low",
+        "Function missing docstring in this change.",
+        lambda content, captures, diff, index: not _has_docstring(diff, index),
+        trigger="def",
+    )
+)
+register_rule(
+    Rule(
+        "CLASS_NAMING",
+        "medium",
+        "Class name should be PascalCase.",
+        lambda content, captures, diff, index: not PASCAL_CASE.match(captures[0]),
+        trigger="class",
+    )
+)
+
+FUNCTION_NODES = (ast.FunctionDef, ast.AsyncFunctionDef)
+
+register_source_rule(
+    SourceRule(
+        "PRINT_LOGGING",
+        (ast.Call,),
+        lambda node: isinstance(node.func, ast.Name) and node.func.id == "print",
+    )
+)
+register_source_rule(
+    SourceRule("FUNC_NAMING", FUNCTION_NODES, lambda node: not SNAKE_CASE.match(node.name))
+)
+register_source_rule(
+    SourceRule("FUNC_DOC", FUNCTION_NODES, lambda node: ast.get_docstring(node) is None)
+)
+register_source_rule(
+    SourceRule("CLASS_NAMING", (ast.ClassDef,), lambda node: not PASCAL_CASE.match(node.name))
+)
@@ -1,13 +1,50 @@
 from __future__ import annotations
 
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
 
-from agent_mr_reviewer.diff_parser import parse_diff
-from agent_mr_reviewer.gitlab_client import GitLabClient
-from agent_mr_reviewer.llm_review import map_reduce_review
+from agent_mr_reviewer.blobs import BlobCache, PostImageFetcher
+from agent_mr_reviewer.budget import DEFAULT_EXCLUDE_GLOBS, BudgetPlan, plan_budget
+from agent_mr_reviewer.cascade import Cascade, TierStats
+from agent_mr_reviewer.dedupe import NearDuplicateIndex, collapse_findings
+from agent_mr_reviewer.diff_parser import FileDiff, parse_changes
+from agent_mr_reviewer.fetch import fetch_snapshot
+from agent_mr_reviewer.gitlab_client import GitLabAPIError, GitLabClient
+from agent_mr_reviewer.incremental import (
+    added_lines_by_path,
+    delta_changes,
+    head_marker,
+    restrict_to_mr_lines,
+)
+from agent_mr_reviewer.llm_cache import LLMCache
+from agent_mr_reviewer.llm_review import (
+    REVIEW_INSTRUCTIONS,
+    SCREEN_INSTRUCTIONS,
+    Compression,
+    ParseStats,
+    PromptStats,
+    fit_description,
+    map_reduce_review,
+    prompt_overhead_tokens,
+)
 from agent_mr_reviewer.llm_summary import build_llm_summary
 from agent_mr_reviewer.llm_client import OpenAICompatibleClient
-from agent_mr_reviewer.review_rules import Finding, analyze_diff
+from agent_mr_reviewer.metrics import RunMetrics
+from agent_mr_reviewer.parallel_rules import analyze_changes
+from agent_mr_reviewer.positions import Placement, PositionIndex
+from agent_mr_reviewer.publisher import (
+    CommentCounts,
+    DiscussionPublisher,
+    InlineComment,
+    PublishResult,
+    publish_discussions,
+)
+from agent_mr_reviewer.reconcile import SUMMARY_MARKER, BotDiscussion, Reconciler
+from agent_mr_reviewer.review_rules import Finding, analyze_diff, is_python
+from agent_mr_reviewer.tokenizer import get_encoding
+from agent_mr_reviewer.triage import Triage
 
 
 def run_review(
@@ -20,85 +57,518 @@ def run_review(
     llm_client: OpenAICompatibleClient | None,
     llm_max_context: int,
     llm_chunk_tokens: int,
+    llm_concurrency: int = 1,
+    llm_cache: LLMCache | None = None,
+    incremental: bool = False,
+    gitlab_workers: int = 4,
+    llm_stream: bool = False,
+    llm_parse_stats: Optional[ParseStats] = None,
+    llm_repair: bool = True,
+    llm_exclude_globs: Sequence[str] = DEFAULT_EXCLUDE_GLOBS,
+    llm_compression: Optional[Compression] = None,
+    llm_prompt_stats: Optional[PromptStats] = None,
+    llm_triage: bool = True,
+    llm_cascade: Optional[Cascade] = None,
+    collapse_duplicates: bool = True,
+    snap_distance: int = 3,
+    metrics: Optional[RunMetrics] = None,
+    rule_workers: int = 1,
+    rules_full_file: bool = False,
+    blob_cache: Optional[BlobCache] = None,
 ) -> None:
-    mr = client.get_merge_request(project_id, mr_iid)
-    changes = client.get_changes(project_id, mr_iid)
-    commits = client.get_commits(project_id, mr_iid)
+    # Every phase runs in a span; lazy stages are timed per item, and each
+    # span's self time excludes the stages it pulls from.
+    metrics = metrics or client.metrics
+    # MR, first diff page, the agent's existing discussions and summary note
+    # and, for the rule summary only, the commit count, in one round.
+    with metrics.span("fetch"):
+        snapshot = fetch_snapshot(
+            client,
+            project_id,
+            mr_iid,
+            commits=llm_client is None,
+            discussions=not summary_only,
+            notes=True,
+        )
+    mr = snapshot.mr
+    # Reconciliation: findings that already have a discussion are not posted
+    # again, discussions whose finding went away are resolved, and the
+    # summary note is edited in place. A dry run prints that plan.
+    reconciler = Reconciler(snapshot.discussions or [])
+    reviewed_paths: Set[str] = set()
 
     diff_refs = mr.get("diff_refs") or {}
-    base_sha = diff_refs.get("base_sha")
-    start_sha = diff_refs.get("start_sha")
     head_sha = diff_refs.get("head_sha")
 
+    # Diff pages are parsed lazily as they arrive: each file is parsed once into
+    # a compact FileDiff that the rules or the LLM chunker consume right away.
+    # The position index records, for every file of the MR diff, which lines
+    # can carry an inline comment; it fills up as the files stream past.
+    positions = PositionIndex(snap_distance)
+    diffs = metrics.timed_iter("fetch_diffs", snapshot.diffs)
+    triage: Optional[Triage] = None
+    if llm_client and llm_triage:
+        # Trivial hunks never reach the LLM; the rule engine still sees them.
+        # Pure renames have no diff to parse and are counted on the way in.
+        triage = Triage()
+        diffs = triage.count_renames(diffs)
+    review_files: Iterable[FileDiff] = positions.track(
+        metrics.timed_iter("parse", parse_changes(diffs))
+    )
+    reviewed_since = None
+    delta_file_count = 0
+    commentable: Dict[str, Set[int]] = {}
+    if incremental and head_sha:
+        last_sha = snapshot.last_reviewed_sha
+        if last_sha == head_sha:
+            print(f"Head {head_sha[:8]} already reviewed; nothing to do.")
+            return
+        with metrics.span("fetch_delta"):
+            delta = delta_changes(client, project_id, last_sha, head_sha) if last_sha else None
+        if delta is not None:
+            commentable = added_lines_by_path(review_files)
+            delta = [change for change in delta if change.get("new_path") in commentable]
+            review_files = parse_changes(delta)
+            reviewed_since = last_sha
+            delta_file_count = len(delta)
+
+    # In streaming mode inline comments are published while later chunks are
+    # still being generated; the summary is still built from the full result.
+    stream_publisher: Optional[DiscussionPublisher] = None
+    on_finding = None
+    dry_run_comments: List[InlineComment] = []
+    if llm_client and llm_stream and not summary_only:
+        if not dry_run:
+            stream_publisher = DiscussionPublisher(
+                client, project_id, mr_iid, workers=gitlab_workers
+            )
+        on_finding = _early_publisher(
+            stream_publisher,
+            diff_refs,
+            positions,
+            max_comments,
+            commentable if reviewed_since else None,
+            collapse_duplicates,
+            reconciler,
+            dry_run_comments,
+        )
+
     all_findings: List[Finding]
+    budget: Optional[BudgetPlan] = None
+    tier_stats: Optional[TierStats] = None
     if llm_client:
-        all_findings = map_reduce_review(
-            client=llm_client,
-            mr=mr,
-            changes=changes.get("changes", []),
-            max_context_tokens=llm_max_context,
-            chunk_tokens=llm_chunk_tokens,
-        )
+        if triage:
+            review_files = metrics.timed_iter("triage", triage.filter(review_files))
+        if llm_max_context > 0:
+            # Prioritisation needs every file, so the budgeted path gives up
+            # streaming the diff pages into the chunker.
+            with metrics.span("budget"):
+                budget = plan_budget(
+                    review_files,
+                    llm_max_context,
+                    llm_exclude_globs,
+                    _prompt_overhead(mr, llm_compression, llm_cascade, llm_chunk_tokens),
+                    llm_chunk_tokens,
+                )
+            review_files = budget.files
+        review_files = _record_paths(review_files, reviewed_paths)
+        if llm_cascade:
+            tier_stats = TierStats()
+        with metrics.span("llm_review"):
+            all_findings = map_reduce_review(
+                client=llm_client,
+                mr=mr,
+                files=review_files,
+                chunk_tokens=llm_chunk_tokens,
+                concurrency=llm_concurrency,
+                cache=llm_cache,
+                stream=llm_stream,
+                on_finding=on_finding,
+                parse_stats=llm_parse_stats,
+                repair=llm_repair,
+                compression=llm_compression,
+                prompt_stats=llm_prompt_stats,
+                metrics=metrics,
+                cascade=llm_cascade,
+                tier_stats=tier_stats,
+            )
+        if triage and triage.trivial:
+            with metrics.span("rules"):
+                all_findings.extend(analyze_diff(triage.trivial))
     else:
-        all_findings = []
-        for change in changes.get("changes", []):
-            patch_text = change.get("diff")
-            if not patch_text:
-                continue
-            patch = parse_diff(patch_text)
-            all_findings.extend(analyze_diff(patch))
+        with metrics.span("rules"):
+            # Full-file mode gives up streaming: the post-images of every
+            # changed Python file are fetched in one parallel round first.
+            full_file = rules_full_file and bool(head_sha)
+            sources: Optional[Dict[str, str]] = None
+            if rule_workers != 1 and not reviewed_since:
+                # Parsing and rules both run in the pool, from the raw pages.
+                changes: Iterable[Dict[str, Any]] = diffs
+                if full_file:
+                    changes = list(diffs)
+                    paths = [
+                        change["new_path"]
+                        for change in changes
+                        if not change.get("deleted_file") and is_python(change["new_path"])
+                    ]
+                    sources = _fetch_sources(
+                        client, project_id, head_sha, paths, blob_cache, gitlab_workers, metrics
+                    )
+                all_findings = _analyze_in_pool(
+                    changes, rule_workers, positions, reviewed_paths, sources
+                )
+            else:
+                files: Iterable[FileDiff] = _record_paths(review_files, reviewed_paths)
+                if full_file:
+                    files = list(files)
+                    paths = [
+                        diff.path
+                        for diff in files
+                        if not diff.is_binary and not diff.deleted_file and is_python(diff.path)
+                    ]
+                    sources = _fetch_sources(
+                        client, project_id, head_sha, paths, blob_cache, gitlab_workers, metrics
+                    )
+                all_findings = analyze_diff(files, sources)
+
+    with metrics.span("reduce"):
+        if reviewed_since:
+            all_findings = restrict_to_mr_lines(all_findings, commentable)
+        if collapse_duplicates:
+            # Reduce step: near-duplicate complaints about one file and rule
+            # become a single comment listing every affected line.
+            all_findings = collapse_findings(all_findings)
 
-    limited_findings = all_findings[:max_comments]
+        # Findings citing lines outside the diff are snapped to a close added
+        # line or reported in the summary; GitLab would reject them inline.
+        placements, unplaceable = positions.place_all(all_findings)
+        limited_placements = placements[:max_comments]
 
+    failed_comments = 0
+    results: List[PublishResult] = []
+    with metrics.span("publish_inline"):
+        if stream_publisher:
+            results = stream_publisher.results()
+        elif not summary_only and on_finding is None:
+            comments: List[InlineComment] = []
+            for placement in limited_placements:
+                if reconciler.claim(placement.finding):
+                    continue
+                comment = _inline_comment(placement, diff_refs)
+                if dry_run:
+                    print(f"INLINE {comment.finding.path}:{comment.finding.line} {comment.body}")
+                    dry_run_comments.append(comment)
+                else:
+                    comments.append(comment)
+            results = publish_discussions(
+                client, project_id, mr_iid, comments, workers=gitlab_workers
+            )
+    for result in results:
+        if not result.ok:
+            failed_comments += 1
+            finding = result.comment.finding
+            print(
+                f"FAILED {finding.path}:{finding.line} {result.error}",
+                file=sys.stderr,
+            )
+
+    stale: List[BotDiscussion] = []
     if not summary_only:
-        for finding in limited_findings:
-            body = f"[{finding.severity}] {finding.message} (rule: {finding.rule_id})"
-            position = {
-                "position_type": "text",
-                "base_sha": base_sha,
-                "start_sha": start_sha,
-                "head_sha": head_sha,
-                "new_path": finding.path,
-                "new_line": finding.line,
-            }
-            if dry_run:
-                print(f"INLINE {finding.path}:{finding.line} {body}")
-            else:
-                client.post_discussion(project_id, mr_iid, body, position)
+        if reviewed_since:
+            # Only the changed hunks were reviewed: absent findings elsewhere
+            # in those files say nothing.
+            reviewed_paths.clear()
+        if budget is not None:
+            # Lower-risk hunks of these files were not sent to the LLM.
+            reviewed_paths.difference_update(budget.partial)
+        stale = reconciler.stale(all_findings, reviewed_paths, set(positions.files))
+    if dry_run:
+        for discussion in reconciler.kept:
+            print(f"KEEP {_describe(discussion)}")
+        for discussion in stale:
+            print(f"RESOLVE {_describe(discussion)}")
+    elif stale:
+        with metrics.span("resolve_stale"):
+            failed = _resolve_discussions(client, project_id, mr_iid, stale, gitlab_workers)
+        stale = [discussion for discussion in stale if discussion not in failed]
 
+    # What this run actually did on the MR; on a rerun most findings are
+    # kept rather than posted again.
+    counts = CommentCounts(
+        posted=len(dry_run_comments) + sum(1 for result in results if result.ok),
+        failed=failed_comments,
+        kept=len(reconciler.kept),
+        resolved=len(stale),
+    )
     if llm_client:
-        summary = build_llm_summary(mr, all_findings, max_comments, source_label="LLM")
+        summary = build_llm_summary(mr, all_findings, counts, source_label="LLM")
     else:
-        summary = _build_summary(mr, commits, all_findings, max_comments)
+        summary = _build_summary(mr, snapshot.commit_count, all_findings, counts)
+    if unplaceable:
+        summary += _unplaceable_section(unplaceable)
+    if triage is not None and triage.summary_line():
+        summary += f"\n{triage.summary_line()}"
+    if budget is not None:
+        summary += _budget_section(budget, llm_max_context)
+    if tier_stats is not None:
+        summary += tier_stats.summary_section()
+    if reviewed_since:
+        summary += (
+            f"\n\nIncremental review: only changes since {reviewed_since[:8]} "
+            f"({delta_file_count} file(s)) were analysed."
+        )
+    summary += f"\n\n{SUMMARY_MARKER}"
+    if head_sha:
+        summary += f"\n{head_marker(head_sha)}"
+    summary_note = snapshot.summary_note
     if dry_run:
-        print("SUMMARY")
+        target = f"update note {summary_note['id']}" if summary_note else "new note"
+        print(f"SUMMARY ({target})")
         print(summary)
     else:
-        client.post_note(project_id, mr_iid, summary)
+        with metrics.span("publish_summary"):
+            _publish_summary(client, project_id, mr_iid, summary, summary_note)
+
+
+def _publish_summary(
+    client: GitLabClient,
+    project_id: str,
+    mr_iid: str,
+    summary: str,
+    summary_note: Optional[Dict[str, Any]],
+) -> None:
+    if summary_note:
+        try:
+            client.update_note(project_id, mr_iid, summary_note["id"], summary)
+            return
+        except GitLabAPIError as exc:
+            # Deleted since it was listed: post a new one.
+            if exc.status_code != 404:
+                raise
+    client.post_note(project_id, mr_iid, summary)
+
+
+def _resolve_discussions(
+    client: GitLabClient,
+    project_id: str,
+    mr_iid: str,
+    discussions: List[BotDiscussion],
+    workers: int,
+) -> List[BotDiscussion]:
+    # Returns the discussions that could not be resolved.
+    def resolve(discussion: BotDiscussion) -> bool:
+        try:
+            client.resolve_discussion(project_id, mr_iid, discussion.discussion_id)
+        except RuntimeError as exc:
+            print(f"FAILED resolve {discussion.discussion_id} {exc}", file=sys.stderr)
+            return False
+        return True
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(discussions)))) as executor:
+        resolved = list(executor.map(resolve, discussions))
+    return [discussion for discussion, ok in zip(discussions, resolved) if not ok]
+
+
+def _describe(discussion: BotDiscussion) -> str:
+    return f"{discussion.path}:{discussion.line} (discussion {discussion.discussion_id})"
+
+
+def _analyze_in_pool(
+    changes: Iterable[Dict[str, Any]],
+    workers: int,
+    positions: PositionIndex,
+    reviewed_paths: Set[str],
+    sources: Optional[Dict[str, str]] = None,
+) -> List[Finding]:
+    findings: List[Finding] = []
+    for result in analyze_changes(changes, workers, sources=sources):
+        if result.positions is not None:
+            positions.files[result.path] = result.positions
+        reviewed_paths.add(result.path)
+        findings.extend(result.findings)
+    return findings
+
+
+def _fetch_sources(
+    client: GitLabClient,
+    project_id: str,
+    ref: str,
+    paths: List[str],
+    cache: Optional[BlobCache],
+    workers: int,
+    metrics: RunMetrics,
+) -> Dict[str, str]:
+    fetcher = PostImageFetcher(client, project_id, cache, workers)
+    with metrics.span("fetch_sources"):
+        sources = fetcher.fetch(ref, paths)
+    if fetcher.failed:
+        print(
+            f"Warning: {fetcher.failed} file(s) could not be fetched; "
+            "their rules only see the diff.",
+            file=sys.stderr,
+        )
+    return sources
+
+
+def _record_paths(files: Iterable[FileDiff], paths: Set[str]) -> Iterator[FileDiff]:
+    for diff in files:
+        paths.add(diff.path)
+        yield diff
+
+
+def _inline_comment(placement: Placement, diff_refs: Dict[str, Any]) -> InlineComment:
+    finding = placement.finding
+    body = f"[{finding.severity}] {finding.message} (rule: {finding.rule_id})"
+    if finding.lines:
+        body += f"\n\nAlso on lines: {', '.join(str(line) for line in finding.lines)}"
+    position = {
+        "position_type": "text",
+        "base_sha": diff_refs.get("base_sha"),
+        "start_sha": diff_refs.get("start_sha"),
+        "head_sha": diff_refs.get("head_sha"),
+        "old_path": placement.old_path,
+        "new_path": finding.path,
+        "new_line": finding.line,
+    }
+    if placement.old_line is not None:
+        position["old_line"] = placement.old_line
+    return InlineComment(finding, body, position)
+
+
+def _unplaceable_section(findings: List[Finding], limit: int = 20) -> str:
+    lines = ["", "", "Not posted inline (line not in the diff):"]
+    for finding in findings[:limit]:
+        lines.append(
+            f"- {finding.path}:{finding.line} [{finding.severity}] {finding.message}"
+        )
+    if len(findings) > limit:
+        lines.append(f"- ... and {len(findings) - limit} more")
+    return "\n".join(lines)
 
 
-def _build_summary(mr, commits, findings: List[Finding], max_comments: int) -> str:
+def _prompt_overhead(
+    mr: Dict[str, Any],
+    compression: Optional[Compression],
+    cascade: Optional[Cascade],
+    chunk_tokens: int,
+) -> int:
+    # Same per-chunk overhead as map_reduce_review reserves when chunking;
+    # it warns about a cut description itself.
+    encoding = get_encoding()
+    instructions = (REVIEW_INSTRUCTIONS, SCREEN_INSTRUCTIONS) if cascade else (REVIEW_INSTRUCTIONS,)
+    mr, description_chars = fit_description(
+        mr,
+        encoding,
+        chunk_tokens,
+        compression.description_chars if compression else 0,
+        instructions,
+        warn=False,
+    )
+    overhead = prompt_overhead_tokens(mr, encoding, description_chars)
+    if cascade:
+        overhead = max(
+            overhead,
+            prompt_overhead_tokens(mr, encoding, description_chars, SCREEN_INSTRUCTIONS),
+        )
+    return overhead
+
+
+def _budget_section(plan: BudgetPlan, max_tokens: int, limit: int = 20) -> str:
+    if not plan.skipped and not plan.partial:
+        return ""
+    lines = ["", ""]
+    if plan.skipped:
+        lines.append(f"Not reviewed by the LLM (budget {max_tokens} tokens):")
+        for path, reason in plan.skipped[:limit]:
+            lines.append(f"- {path} ({reason})")
+        if len(plan.skipped) > limit:
+            lines.append(f"- ... and {len(plan.skipped) - limit} more")
+    if plan.partial:
+        if plan.skipped:
+            lines.append("")
+        lines.append("Partially reviewed by the LLM (lower-risk hunks skipped):")
+        for path in plan.partial[:limit]:
+            lines.append(f"- {path}")
+        if len(plan.partial) > limit:
+            lines.append(f"- ... and {len(plan.partial) - limit} more")
+    return "\n".join(lines)
+
+
+def _more_lines(finding: Finding) -> str:
+    return f" (+{len(finding.lines)} similar)" if finding.lines else ""
+
+
+def _early_publisher(
+    publisher: Optional[DiscussionPublisher],
+    diff_refs: Dict[str, Any],
+    positions: PositionIndex,
+    max_comments: int,
+    commentable: Optional[Dict[str, Set[int]]],
+    collapse_duplicates: bool = True,
+    reconciler: Optional[Reconciler] = None,
+    dry_run_comments: Optional[List[InlineComment]] = None,
+):
+    # Called from the LLM worker threads for every finding as soon as it is
+    # parsed. Applies the same duplicate, changed-line and max_comments
+    # filters as the non-streaming path; None publisher means dry-run. A
+    # comment is already out when its near-duplicates arrive, so they are
+    # dropped instead of being listed in it.
+    lock = threading.Lock()
+    seen: Set[Tuple[str, int, str]] = set()
+    similar = NearDuplicateIndex()
+
+    def on_finding(finding: Finding) -> None:
+        if commentable is not None and finding.line not in commentable.get(finding.path, ()):
+            return
+        placement = positions.place(finding)
+        if placement is None:
+            # Listed in the summary once the review is complete.
+            return
+        finding = placement.finding
+        key = (finding.path, finding.line, finding.message)
+        with lock:
+            if key in seen or len(seen) >= max_comments:
+                return
+            if collapse_duplicates and not similar.add(finding)[1]:
+                return
+            seen.add(key)
+        if reconciler is not None and reconciler.claim(finding):
+            return
+        comment = _inline_comment(placement, diff_refs)
+        if publisher is None:
+            print(f"INLINE {finding.path}:{finding.line} {comment.body}")
+            if dry_run_comments is not None:
+                with lock:
+                    dry_run_comments.append(comment)
+        else:
+            publisher.submit(comment)
+
+    return on_finding
+
+
+def _build_summary(
+    mr, commit_count: Optional[int], findings: List[Finding], counts: CommentCounts
+) -> str:
     total = len(findings)
     by_sev = {"high": 0, "medium": 0, "low": 0}
     for finding in findings:
         by_sev[finding.severity] = by_sev.get(finding.severity, 0) + 1
 
     title = mr.get("title", "(no title)")
-    commit_count = len(commits) if isinstance(commits, list) else 0
 
     lines = [
         "MR Review Summary",
         f"- Title: {title}",
-        f"- Commits: {commit_count}",
+        f"- Commits: {commit_count or 0}",
         f"- Findings: {total} (high: {by_sev.get('high', 0)}, medium: {by_sev.get('medium', 0)}, low: {by_sev.get('low', 0)})",
-        f"- Inline comments posted: {min(total, max_comments)}",
+        *counts.summary_lines(),
         "",
         "Top findings:",
     ]
 
     for finding in findings[:10]:
         lines.append(
-            f"- {finding.path}:{finding.line} [{finding.severity}] {finding.message}"
+            f"- {finding.path}:{finding.line}{_more_lines(finding)} [{finding.severity}] {finding.message}"
         )
 
     return "\n".join(lines)
@@ -0,0 +1,389 @@
+from __future__ import annotations
+
+import argparse
+from collections import OrderedDict
+from dataclasses import dataclass, field
+import hmac
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from agent_mr_reviewer.cli import ReviewSetup, add_review_args, build_setup, review
+from agent_mr_reviewer.tokenizer import get_encoding
+
+WEBHOOK_EVENT = "Merge Request Hook"
+# "update" hooks are also sent for title/label edits; only those carrying
+# "oldrev" (new commits) trigger a review.
+REVIEW_ACTIONS = {"open", "reopen", "update"}
+MAX_BODY_BYTES = 5 * 1024 * 1024
+# Heads remembered to drop redelivered webhooks; the oldest MRs are
+# forgotten first.
+MAX_TRACKED_HEADS = 1000
+# The caches are pruned after a job at most this often: pruning walks the
+# whole cache directory.
+PRUNE_INTERVAL_SECONDS = 300.0
+
+JobKey = Tuple[str, str]
+
+
+@dataclass
+class ReviewJob:
+    project_id: str
+    mr_iid: str
+    head_sha: str
+    due: float
+    received: float
+
+    @property
+    def key(self) -> JobKey:
+        return (self.project_id, self.mr_iid)
+
+
+@dataclass
+class ServiceStats:
+    received: int = 0
+    ignored: int = 0
+    coalesced: int = 0
+    duplicates: int = 0
+    rejected: int = 0
+    completed: int = 0
+    failed: int = 0
+    review_seconds: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def incr(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+
+class ReviewQueue:
+    # Pending reviews keyed by MR. A new push to an MR that is still waiting
+    # replaces its head and pushes its start back by coalesce_seconds, so a
+    # burst of pushes yields one review of the last head. A push to an MR
+    # under review is kept aside and queued once that review ends; an MR is
+    # never reviewed by two workers at once.
+
+    def __init__(
+        self,
+        coalesce_seconds: float = 10.0,
+        max_pending: int = 100,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.coalesce_seconds = coalesce_seconds
+        self.max_pending = max_pending
+        self._clock = clock
+        self._pending: Dict[JobKey, ReviewJob] = {}
+        self._running: Set[JobKey] = set()
+        self._rerun: Dict[JobKey, ReviewJob] = {}
+        self._last_head: "OrderedDict[JobKey, str]" = OrderedDict()
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def submit(self, project_id: str, mr_iid: str, head_sha: str) -> str:
+        now = self._clock()
+        key = (project_id, mr_iid)
+        with self._condition:
+            if head_sha and self._last_head.get(key) == head_sha:
+                return "duplicate"
+            job = ReviewJob(project_id, mr_iid, head_sha, now + self.coalesce_seconds, now)
+            if key in self._running:
+                status = "coalesced" if key in self._rerun else "queued"
+                self._rerun[key] = job
+            elif key in self._pending:
+                job.received = self._pending[key].received
+                self._pending[key] = job
+                status = "coalesced"
+            elif len(self._pending) >= self.max_pending:
+                return "rejected"
+            else:
+                self._pending[key] = job
+                status = "queued"
+            if head_sha:
+                self._last_head[key] = head_sha
+                self._last_head.move_to_end(key)
+                while len(self._last_head) > MAX_TRACKED_HEADS:
+                    self._last_head.popitem(last=False)
+            self._condition.notify_all()
+            return status
+
+    def take(self) -> Optional[ReviewJob]:
+        # Blocks until a job is due; None once the queue is closed.
+        with self._condition:
+            while not self._closed:
+                now = self._clock()
+                due = [
+                    job
+                    for key, job in self._pending.items()
+                    if key not in self._running
+                ]
+                ready = [job for job in due if job.due <= now]
+                if ready:
+                    job = min(ready, key=lambda item: item.due)
+                    del self._pending[job.key]
+                    self._running.add(job.key)
+                    return job
+                timeout = min((job.due for job in due), default=now + 60) - now
+                self._condition.wait(timeout=max(0.01, timeout))
+            return None
+
+    def done(self, job: ReviewJob, ok: bool = True) -> None:
+        with self._condition:
+            self._running.discard(job.key)
+            if not ok and self._last_head.get(job.key) == job.head_sha:
+                # Let a redelivery of the same push retry the review.
+                del self._last_head[job.key]
+            rerun = self._rerun.pop(job.key, None)
+            if rerun is not None:
+                self._pending[job.key] = rerun
+            self._condition.notify_all()
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._condition:
+            return {
+                "pending": len(self._pending) + len(self._rerun),
+                "running": len(self._running),
+            }
+
+
+class ReviewService:
+    def __init__(
+        self,
+        setup: ReviewSetup,
+        workers: int = 2,
+        coalesce_seconds: float = 10.0,
+        max_pending: int = 100,
+        secret: Optional[str] = None,
+        prune_interval: float = PRUNE_INTERVAL_SECONDS,
+    ) -> None:
+        self.setup = setup
+        self.prune_interval = prune_interval
+        self._last_prune = time.monotonic()
+        self._prune_lock = threading.Lock()
+        self.secret = secret
+        self.queue = ReviewQueue(coalesce_seconds, max_pending)
+        self.stats = ServiceStats()
+        self.started = time.time()
+        self._threads: List[threading.Thread] = [
+            threading.Thread(target=self._work, name=f"review-worker-{index}", daemon=True)
+            for index in range(max(1, workers))
+        ]
+
+    def start(self) -> None:
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        self.queue.close()
+        for thread in self._threads:
+            thread.join()
+
+    def handle_webhook(self, headers, body: bytes) -> Tuple[int, Dict[str, Any]]:
+        if self.secret and not hmac.compare_digest(
+            headers.get("X-Gitlab-Token") or "", self.secret
+        ):
+            return 401, {"error": "invalid token"}
+        if headers.get("X-Gitlab-Event") != WEBHOOK_EVENT:
+            self.stats.incr("ignored")
+            return 202, {"status": "ignored"}
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            return 400, {"error": "invalid JSON"}
+        self.stats.incr("received")
+
+        attributes = payload.get("object_attributes") or {}
+        action = attributes.get("action")
+        if action not in REVIEW_ACTIONS or (action == "update" and "oldrev" not in attributes):
+            self.stats.incr("ignored")
+            return 202, {"status": "ignored"}
+        project = payload.get("project") or {}
+        project_id = str(project.get("id") or attributes.get("target_project_id") or "")
+        mr_iid = str(attributes.get("iid") or "")
+        if not project_id or not mr_iid:
+            return 400, {"error": "missing project or merge request"}
+        head_sha = (attributes.get("last_commit") or {}).get("id") or ""
+
+        status = self.queue.submit(project_id, mr_iid, head_sha)
+        if status == "coalesced":
+            self.stats.incr("coalesced")
+        elif status == "duplicate":
+            self.stats.incr("duplicates")
+        elif status == "rejected":
+            self.stats.incr("rejected")
+            return 503, {"status": status}
+        return 202, {"status": status}
+
+    def health(self) -> Dict[str, Any]:
+        alive = sum(1 for thread in self._threads if thread.is_alive())
+        return {
+            "status": "ok" if alive else "degraded",
+            "workers": alive,
+            "uptime_seconds": round(time.time() - self.started, 1),
+            **self.queue.snapshot(),
+        }
+
+    def metrics(self) -> str:
+        stats = self.stats
+        queue = self.queue.snapshot()
+        values = [
+            ("webhooks_received_total", stats.received),
+            ("webhooks_ignored_total", stats.ignored),
+            ("webhooks_coalesced_total", stats.coalesced),
+            ("webhooks_duplicate_total", stats.duplicates),
+            ("webhooks_rejected_total", stats.rejected),
+            ("reviews_completed_total", stats.completed),
+            ("reviews_failed_total", stats.failed),
+            ("review_seconds_total", round(stats.review_seconds, 3)),
+            ("reviews_pending", queue["pending"]),
+            ("reviews_running", queue["running"]),
+        ]
+        text = "".join(f"agent_mr_reviewer_{name} {value}\n" for name, value in values)
+        # Spans, retries, LLM tokens, cache hits and latency quantiles,
+        # accumulated over every review since startup.
+        return text + self.setup.metrics.prometheus()
+
+    def _work(self) -> None:
+        while True:
+            job = self.queue.take()
+            if job is None:
+                return
+            started = time.monotonic()
+            ok = False
+            try:
+                print(f"Reviewing {job.project_id}!{job.mr_iid} at {job.head_sha[:8] or 'HEAD'}")
+                review(self.setup, job.project_id, job.mr_iid)
+                self.stats.incr("completed")
+                ok = True
+            except Exception:
+                # One failed review must not take the worker down.
+                self.stats.incr("failed")
+                traceback.print_exc(file=sys.stderr)
+            finally:
+                self.stats.incr("review_seconds", time.monotonic() - started)
+                self.queue.done(job, ok)
+            self._prune_caches()
+
+    def _prune_caches(self) -> None:
+        # Applies the cache size and age limits while the service runs; one
+        # worker prunes while the others keep reviewing.
+        now = time.monotonic()
+        if now - self._last_prune < self.prune_interval:
+            return
+        if not self._prune_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_prune = now
+            self.setup.prune_caches()
+        except OSError:
+            traceback.print_exc(file=sys.stderr)
+        finally:
+            self._prune_lock.release()
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    service: ReviewService
+
+    def do_POST(self) -> None:
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0 or length > MAX_BODY_BYTES:
+            # The body is left unread: drop the connection after replying.
+            self.close_connection = True
+            if length < 0:
+                self._reply(400, {"error": "invalid Content-Length"})
+            else:
+                self._reply(413, {"error": "payload too large"})
+            return
+        status, body = self.service.handle_webhook(self.headers, self.rfile.read(length))
+        self._reply(status, body)
+
+    def do_GET(self) -> None:
+        if self.path == "/health":
+            self._reply(200, self.service.health())
+        elif self.path == "/metrics":
+            self._send(200, self.service.metrics().encode("utf-8"), "text/plain; version=0.0.4")
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def log_message(self, format: str, *args: Any) -> None:
+        print(f"{self.address_string()} {format % args}", file=sys.stderr)
+
+    def _reply(self, status: int, body: Dict[str, Any]) -> None:
+        self._send(status, json.dumps(body).encode("utf-8"), "application/json")
+
+    def _send(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="GitLab MR reviewer webhook service")
+    parser.add_argument("--gitlab-url", default=os.getenv("GITLAB_URL"))
+    parser.add_argument("--token-env", default="GITLAB_TOKEN")
+    parser.add_argument("--host", default=os.getenv("REVIEWER_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("REVIEWER_PORT", "8080")))
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--coalesce-seconds", type=float, default=10.0)
+    parser.add_argument("--max-pending", type=int, default=100)
+    parser.add_argument("--webhook-secret-env", default="GITLAB_WEBHOOK_SECRET")
+    add_review_args(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    try:
+        setup = build_setup(args, parallel_reviews=args.workers)
+    except ValueError as exc:
+        print(exc, file=sys.stderr)
+        return 2
+    secret = os.getenv(args.webhook_secret_env)
+    if not secret:
+        print(
+            f"Warning: {args.webhook_secret_env} is not set; webhooks are not authenticated.",
+            file=sys.stderr,
+        )
+
+    if setup.llm_client:
+        # Load the tokenizer once, before the first job needs it.
+        get_encoding()
+
+    service = ReviewService(
+        setup,
+        workers=args.workers,
+        coalesce_seconds=args.coalesce_seconds,
+        max_pending=args.max_pending,
+        secret=secret,
+    )
+    handler = type("BoundWebhookHandler", (WebhookHandler,), {"service": service})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    service.start()
+    print(f"Listening on {args.host}:{args.port} with {args.workers} worker(s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+        setup.prune_caches()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
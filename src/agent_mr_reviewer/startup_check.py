@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List, Optional, Tuple
+
+# Modules that the rule-only path must not import.
+FORBIDDEN_MODULES = ("tiktoken", "tiktoken_ext", "regex")
+ENTRY_MODULE = "agent_mr_reviewer.cli"
+
+
+def measure_imports(module: str = ENTRY_MODULE) -> Dict[str, Tuple[int, int]]:
+    # {module: (self us, cumulative us)} from a fresh interpreter's -X importtime.
+    # The package is importable there even from a source checkout.
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    path = os.environ.get("PYTHONPATH")
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, (package_root, path)))}
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{completed.stderr}")
+    timings: Dict[str, Tuple[int, int]] = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|", 2)
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+    return timings
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Check the CLI import time")
+    parser.add_argument("--max-ms", type=float, default=400)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    # Best of several runs: the first one may pay for a cold disk cache.
+    best: Optional[Dict[str, Tuple[int, int]]] = None
+    for _ in range(max(1, args.runs)):
+        timings = measure_imports()
+        if best is None or timings[ENTRY_MODULE][1] < best[ENTRY_MODULE][1]:
+            best = timings
+
+    total_ms = best[ENTRY_MODULE][1] / 1000
+    print(f"import {ENTRY_MODULE}: {total_ms:.1f} ms (budget {args.max_ms:.0f} ms)")
+    for name, (self_us, _) in sorted(best.items(), key=lambda item: -item[1][0])[: args.top]:
+        print(f"  {self_us / 1000:8.1f} ms  {name}")
+
+    failures: List[str] = []
+    forbidden = [
+        name for name in best if name.split(".", 1)[0] in FORBIDDEN_MODULES
+    ]
+    if forbidden:
+        failures.append(f"heavy modules imported at startup: {', '.join(sorted(forbidden))}")
+    if total_ms > args.max_ms:
+        failures.append(f"import time {total_ms:.1f} ms exceeds {args.max_ms:.0f} ms")
+    for failure in failures:
+        print(f"FAILED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
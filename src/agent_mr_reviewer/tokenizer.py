@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import os
+import threading
+from typing import Optional
+
+# tiktoken is only imported by get_encoding(), so rule-only runs never pay
+# for it (nor for the BPE download it may trigger).
+ENCODING_NAME = "cl100k_base"
+CL100K_SHA256 = "223921b76ee99bde995b7ff738513eef100fb51d18c93597a113bcffe865b2a7"
+CL100K_PATTERN = (
+    r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}+|\p{N}{1,3}| ?[^\s\p{L}\p{N}]++[\r\n]*"""
+    r"""|\s*[\r\n]|\s+(?!\S)|\s+"""
+)
+CL100K_SPECIAL_TOKENS = {
+    "<|endoftext|>": 100257,
+    "<|fim_prefix|>": 100258,
+    "<|fim_middle|>": 100259,
+    "<|fim_suffix|>": 100260,
+    "<|endofprompt|>": 100276,
+}
+
+_lock = threading.Lock()
+_encoding = None
+_file: Optional[str] = os.getenv("LLM_TOKENIZER_FILE") or None
+_cache_dir: Optional[str] = None
+
+
+def configure(file: Optional[str] = None, cache_dir: Optional[str] = None) -> None:
+    # file: local copy of cl100k_base.tiktoken (air-gapped agents);
+    # cache_dir: tiktoken's own download cache (TIKTOKEN_CACHE_DIR).
+    global _file, _cache_dir, _encoding
+    with _lock:
+        # A loaded encoding is kept unless the settings change: every
+        # build_setup calls this, and loading takes about a second.
+        if (file or _file, cache_dir or _cache_dir) != (_file, _cache_dir):
+            _file = file or _file
+            _cache_dir = cache_dir or _cache_dir
+            _encoding = None
+
+
+def get_encoding():
+    global _encoding
+    if _encoding is not None:
+        return _encoding
+    with _lock:
+        if _encoding is None:
+            _encoding = _load()
+    return _encoding
+
+
+def _load():
+    if _cache_dir:
+        os.environ["TIKTOKEN_CACHE_DIR"] = _cache_dir
+    import tiktoken
+
+    if not _file:
+        try:
+            return tiktoken.get_encoding(ENCODING_NAME)
+        except (OSError, ValueError) as exc:
+            # requests' connection errors are OSErrors too.
+            raise RuntimeError(
+                f"Cannot load the {ENCODING_NAME} tokenizer ({exc}); offline agents need "
+                "--llm-tokenizer-file or a pre-filled --llm-tokenizer-cache-dir"
+            ) from exc
+    try:
+        with open(_file, "rb") as handle:
+            contents = handle.read()
+    except OSError as exc:
+        raise RuntimeError(f"Cannot read tokenizer file {_file}: {exc}") from exc
+    if hashlib.sha256(contents).hexdigest() != CL100K_SHA256:
+        raise RuntimeError(f"Tokenizer file {_file} is not {ENCODING_NAME}.tiktoken")
+    ranks = {
+        base64.b64decode(token): int(rank)
+        for token, rank in (line.split() for line in contents.splitlines() if line)
+    }
+    return tiktoken.Encoding(
+        name=ENCODING_NAME,
+        pat_str=CL100K_PATTERN,
+        mergeable_ranks=ranks,
+        special_tokens=CL100K_SPECIAL_TOKENS,
+    )
@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+import os
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from agent_mr_reviewer.budget import generated_reason
+from agent_mr_reviewer.diff_parser import ADDED, CONTEXT, REMOVED, FileDiff, Hunk
+
+HASH_COMMENT_EXTENSIONS = {
+    ".py", ".sh", ".bash", ".rb", ".pl", ".r", ".yml", ".yaml", ".toml", ".cfg", ".ini",
+}
+SLASH_COMMENT_EXTENSIONS = {
+    ".js", ".jsx", ".ts", ".tsx", ".java", ".kt", ".go", ".rs", ".c", ".h", ".cpp",
+    ".hpp", ".cs", ".scala", ".swift", ".php",
+}
+HASH_COMMENT_PREFIXES = ("#",)
+# A line starting with "*" is only a comment inside a /* ... */ block: in
+# C or Go it can be a dereference.
+SLASH_COMMENT_PREFIXES = ("//", "/*", "*/")
+SQL_COMMENT_PREFIXES = ("--",)
+# Re-indenting changes the meaning of these files.
+INDENT_SENSITIVE_EXTENSIONS = {".py", ".pyi", ".yaml", ".yml", ".mk"}
+INDENT_SENSITIVE_NAMES = {"Makefile", "makefile", "GNUmakefile"}
+# Lines a reorder may move: imports and includes. Moving any other line can
+# change what the code does.
+IMPORT_LINE = re.compile(
+    r"^(?:import\b|from\s+\S+\s+import\b|#\s*(?:include|import)\b|using\s+[\w.]+\s*;"
+    r"|use\s+\S.*;$|require(?:_relative)?\b|@import\b|(?:const|let|var)\s+.+=\s*require\()"
+)
+GO_IMPORT_LINE = re.compile(r'^(?:[\w.]+\s+)?"[^"]+"$')
+# Whitespace inside a string literal is content: literals, and the rest of a
+# line after an unterminated quote, are compared as they are.
+STRING_LITERAL = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|`(?:\\.|[^`\\])*`')
+QUOTE = re.compile(r"[\"'`]")
+WHITESPACE_RUN = re.compile(r"\s+")
+
+# Order in which classes are reported in the summary.
+TRIAGE_CLASSES = ("generated", "deletion", "whitespace", "reorder", "comment")
+
+
+@dataclass
+class Triage:
+    # Splits the diff before the LLM: trivial hunks are counted per class
+    # and kept aside (for the rule engine), substantive ones are passed on.
+    # filter() is a generator, so diff pages are still streamed.
+    hunks: Dict[str, int] = field(default_factory=dict)
+    files: Dict[str, int] = field(default_factory=dict)
+    trivial: List[FileDiff] = field(default_factory=list)
+
+    def count_renames(self, changes: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        # GitLab sends a pure rename without a diff, and the parser drops it:
+        # it is counted here, on the raw changes.
+        for change in changes:
+            if change.get("renamed_file") and not change.get("diff"):
+                self._count_file("rename-only")
+            yield change
+
+    def filter(self, files: Iterable[FileDiff]) -> Iterator[FileDiff]:
+        for diff in files:
+            if diff.is_binary:
+                continue
+            if not diff.hunks:
+                continue
+            reason = generated_reason(diff)
+            if reason:
+                self._count_file("generated")
+                self.hunks["generated"] = self.hunks.get("generated", 0) + len(diff.hunks)
+                self.trivial.append(diff)
+                continue
+            substantive: List[Hunk] = []
+            skipped: List[Hunk] = []
+            for hunk in diff.hunks:
+                label = classify_hunk(diff, hunk)
+                if label is None:
+                    substantive.append(hunk)
+                else:
+                    self.hunks[label] = self.hunks.get(label, 0) + 1
+                    skipped.append(hunk)
+            if skipped:
+                self.trivial.append(diff.with_hunks(skipped))
+            if not substantive:
+                self._count_file("trivial")
+                continue
+            yield diff if not skipped else diff.with_hunks(substantive)
+
+    def summary_line(self) -> str:
+        parts = [
+            f"{label}: {self.hunks[label]}"
+            for label in TRIAGE_CLASSES
+            if self.hunks.get(label)
+        ]
+        skipped_files = self.files.get("generated", 0) + self.files.get("trivial", 0)
+        if skipped_files:
+            parts.append(f"files skipped entirely: {skipped_files}")
+        if self.files.get("rename-only"):
+            parts.append(f"rename-only files: {self.files['rename-only']}")
+        if not parts:
+            return ""
+        return f"- Triaged out before the LLM (hunks): {', '.join(parts)}"
+
+    def _count_file(self, label: str) -> None:
+        self.files[label] = self.files.get(label, 0) + 1
+
+
+def classify_hunk(diff: FileDiff, hunk: Hunk) -> Optional[str]:
+    added: List[str] = []
+    removed: List[str] = []
+    for index in range(hunk.start, hunk.end):
+        kind = diff.kinds[index]
+        if kind == ADDED:
+            added.append(diff.content(index))
+        elif kind == REMOVED:
+            removed.append(diff.content(index))
+    if not added:
+        return "deletion"
+    if not removed and not any(line.strip() for line in added):
+        return "whitespace"
+    if removed:
+        # Re-indentation and changes to runs of spaces between tokens.
+        if not _indent_sensitive(diff.path) and _normalize(added) == _normalize(removed):
+            return "whitespace"
+        # Reordered imports.
+        moved = sorted(line.strip() for line in added)
+        if moved == sorted(line.strip() for line in removed) and all(
+            not line or _is_import(line, diff.path) for line in moved
+        ):
+            return "reorder"
+    prefixes = _comment_prefixes(diff.path)
+    if prefixes and _only_comments(diff, hunk, prefixes):
+        return "comment"
+    return None
+
+
+def _normalize(lines: List[str]) -> List[str]:
+    # Non-blank lines with each run of whitespace outside string literals
+    # collapsed to one space: token boundaries are kept, so "return x" and
+    # "returnx" differ.
+    normalized: List[str] = []
+    for line in lines:
+        parts: List[str] = []
+        position = 0
+        for match in STRING_LITERAL.finditer(line):
+            parts.append(WHITESPACE_RUN.sub(" ", line[position : match.start()]))
+            parts.append(match.group())
+            position = match.end()
+        rest = line[position:]
+        quote = QUOTE.search(rest)
+        if quote:
+            parts.append(WHITESPACE_RUN.sub(" ", rest[: quote.start()]))
+            parts.append(rest[quote.start() :])
+        else:
+            parts.append(WHITESPACE_RUN.sub(" ", rest))
+        text = "".join(parts).strip()
+        if text:
+            normalized.append(text)
+    return normalized
+
+
+def _comment_prefixes(path: str) -> Tuple[str, ...]:
+    extension = os.path.splitext(path)[1].lower()
+    if extension in HASH_COMMENT_EXTENSIONS:
+        return HASH_COMMENT_PREFIXES
+    if extension in SLASH_COMMENT_EXTENSIONS:
+        return SLASH_COMMENT_PREFIXES
+    if extension == ".sql":
+        return SQL_COMMENT_PREFIXES
+    return ()
+
+
+def _indent_sensitive(path: str) -> bool:
+    name = os.path.basename(path)
+    return name in INDENT_SENSITIVE_NAMES or os.path.splitext(name)[1].lower() in (
+        INDENT_SENSITIVE_EXTENSIONS
+    )
+
+
+def _is_import(line: str, path: str) -> bool:
+    if IMPORT_LINE.match(line):
+        return True
+    return path.endswith(".go") and bool(GO_IMPORT_LINE.match(line))
+
+
+def _only_comments(diff: FileDiff, hunk: Hunk, prefixes: Tuple[str, ...]) -> bool:
+    # Every changed line is blank or a comment. Block comments are followed
+    # on the old and the new side separately, from the start of the hunk.
+    in_block = {REMOVED: False, ADDED: False}
+    blocks = prefixes is SLASH_COMMENT_PREFIXES
+    for index in range(hunk.start, hunk.end):
+        kind = diff.kinds[index]
+        stripped = diff.content(index).strip()
+        for side in (REMOVED, ADDED) if kind == CONTEXT else (kind,):
+            comment = in_block[side] or not stripped or stripped.startswith(prefixes)
+            if kind != CONTEXT and not comment:
+                return False
+            if blocks:
+                in_block[side] = _in_block_after(stripped, in_block[side])
+    return True
+
+
+def _in_block_after(stripped: str, in_block: bool) -> bool:
+    # Whether a /* ... */ block is still open after this line. Only lines
+    # that are comments from their start can open one.
+    if not in_block and not stripped.startswith("/*"):
+        return False
+    position = 0
+    while True:
+        if in_block:
+            end = stripped.find("*/", position)
+            if end < 0:
+                return True
+            position, in_block = end + 2, False
+        else:
+            start = stripped.find("/*", position)
+            if start < 0:
+                return False
+            position, in_block = start + 2, True
@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+import requests
+
+from agent_mr_reviewer.blobs import BlobCache, PostImageFetcher
+from agent_mr_reviewer.metrics import RunMetrics
+
+BLOB_ID = "a" * 40
+
+
+class FakeClient:
+    def __init__(self, error: Exception = None) -> None:
+        self.metrics = RunMetrics()
+        self.error = error
+        self.downloads = 0
+
+    def get_file_blob_id(self, project_id: str, file_path: str, ref: str) -> str:
+        if self.error and file_path == "broken.py":
+            raise self.error
+        return BLOB_ID
+
+    def get_blob(self, project_id: str, blob_id: str) -> bytes:
+        self.downloads += 1
+        return b"x = 1\n"
+
+
+def test_network_error_falls_back_to_the_diff():
+    client = FakeClient(requests.ConnectionError("connection reset"))
+    fetcher = PostImageFetcher(client, "1")
+    sources = fetcher.fetch("f" * 40, ["ok.py", "broken.py"])
+    assert sources == {"ok.py": "x = 1\n"}
+    assert fetcher.failed == 1
+
+
+def test_cached_blobs_are_not_downloaded_again(tmp_path):
+    cache = BlobCache(str(tmp_path))
+    client = FakeClient()
+    PostImageFetcher(client, "1", cache).fetch("f" * 40, ["a.py"])
+    sources = PostImageFetcher(client, "1", cache).fetch("e" * 40, ["a.py"])
+    assert sources == {"a.py": "x = 1\n"}
+    assert client.downloads == 1
+    assert cache.prune() == 0
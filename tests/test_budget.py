@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+from agent_mr_reviewer.budget import plan_budget, planned_tokens
+from agent_mr_reviewer.diff_parser import parse_change
+
+
+def _files(count: int) -> list:
+    body = "".join(f"+value_{line} = compute({line})\n" for line in range(10))
+    diff = f"@@ -0,0 +1,10 @@\n{body}"
+    return [
+        parse_change({"diff": diff, "old_path": None, "new_path": f"m{number}.py"})
+        for number in range(count)
+    ]
+
+
+def test_planned_tokens_add_one_overhead_per_chunk():
+    assert planned_tokens(0, 500, 1000) == 0
+    assert planned_tokens(400, 500, 0) == 900
+    assert planned_tokens(1200, 500, 1000) == 1200 + 3 * 500
+
+
+def test_prompt_overhead_counts_against_the_budget():
+    files = _files(20)
+    without = plan_budget(files, 2000)
+    assert not without.skipped
+    plan = plan_budget(files, 2000, overhead_tokens=400, chunk_tokens=1000)
+    assert plan.used_tokens <= 2000
+    assert plan.skipped and len(plan.files) < len(files)
@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+from agent_mr_reviewer.dedupe import collapse_findings, fingerprint, normalize_message
+from agent_mr_reviewer.review_rules import Finding
+
+
+def _finding(line: int, message: str, rule_id: str = "LLM", severity: str = "low") -> Finding:
+    return Finding("app.py", line, message, severity, rule_id)
+
+
+def test_similar_messages_collapse_into_the_first():
+    findings = [
+        _finding(3, "Variable `total` is never used; remove it or use it."),
+        _finding(9, "Variable `count` is never used; remove it or use it.", severity="high"),
+        _finding(14, "Variable `items` is never used; remove it or use it."),
+    ]
+    (collapsed,) = collapse_findings(findings)
+    assert (collapsed.line, collapsed.lines, collapsed.severity) == (3, [9, 14], "high")
+
+
+def test_different_rules_or_messages_do_not_collapse():
+    message = "Variable `total` is never used; remove it or use it."
+    findings = [
+        _finding(3, message, rule_id="UNUSED"),
+        _finding(9, message, rule_id="NAMING"),
+        _finding(12, "SQL built by string concatenation; use parameters.", rule_id="UNUSED"),
+    ]
+    assert [finding.line for finding in collapse_findings(findings)] == [3, 9, 12]
+
+
+def test_non_ascii_messages_keep_their_words():
+    first = _finding(3, "Переменная не используется.")
+    second = _finding(9, "Возможна утечка памяти при ошибке.")
+    third = _finding(12, "未使用の変数があります。")
+    assert normalize_message(first.message) == ["переменная", "не", "используется"]
+    assert len(collapse_findings([first, second, third])) == 3
+    assert len({fingerprint(first), fingerprint(second), fingerprint(third)}) == 3
+
+
+def test_messages_made_only_of_code_spans_differ():
+    first = _finding(3, "`eval(input())`")
+    second = _finding(9, "`os.system(cmd)`")
+    assert len(collapse_findings([first, second])) == 2
+    assert fingerprint(first) != fingerprint(second)
+    # Around prose, code spans still stand for any identifier.
+    assert fingerprint(_finding(3, "Rename `a`.")) == fingerprint(_finding(3, "Rename `b`."))
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import random
+
+import pytest
+
+from agent_mr_reviewer.diff_parser import ADDED, CONTEXT, REMOVED, parse_diff
+
+# The reference: unidiff was the parser before diff_parser replaced it.
+unidiff = pytest.importorskip("unidiff")
+
+KINDS = {" ": CONTEXT, "+": ADDED, "-": REMOVED}
+CONTENT = [
+    "def foo(x):",
+    "    return x",
+    "",
+    "x = 1  ",
+    "# TODO fix",
+    "++x",
+    "--y",
+    "@@ not a header",
+    "\\ not a marker either",
+    "a\r",
+    "\tclass  X:",
+    "y" * 130,
+]
+
+
+def _hunk(rng: random.Random, old_start: int, new_start: int) -> list:
+    body = []
+    old_count = new_count = 0
+    for _ in range(rng.randint(1, 12)):
+        marker = rng.choice("++--  ")
+        # Files with Windows line endings keep a "\r" before each "\n".
+        end = "\r" if rng.random() < 0.2 else ""
+        body.append(marker + rng.choice(CONTENT) + end)
+        old_count += marker != "+"
+        new_count += marker != "-"
+    if rng.random() < 0.3:
+        body.insert(rng.randint(1, len(body)), "\\ No newline at end of file")
+    old = f"{old_start}" if old_count == 1 and rng.random() < 0.5 else f"{old_start},{old_count}"
+    new = f"{new_start}" if new_count == 1 and rng.random() < 0.5 else f"{new_start},{new_count}"
+    return [f"@@ -{old} +{new} @@ section"] + body
+
+
+def _diff(rng: random.Random) -> str:
+    lines = []
+    for number in range(rng.randint(1, 3)):
+        path = f"src/f{number}.py"
+        lines += [f"diff --git a/{path} b/{path}", "index 123..456 100644"]
+        lines += [f"--- a/{path}", f"+++ b/{path}"]
+        old_start = new_start = 1
+        for _ in range(rng.randint(1, 3)):
+            lines += _hunk(rng, old_start, new_start)
+            old_start += 40
+            new_start += 50
+    return "\n".join(lines) + "\n"
+
+
+def _assert_same(text: str) -> None:
+    expected = unidiff.PatchSet(text)
+    parsed = parse_diff(text)
+    assert len(parsed) == len(expected)
+    for diff, patched_file in zip(parsed, expected):
+        assert diff.path == patched_file.path
+        assert len(diff.hunks) == len(patched_file)
+        for hunk, reference in zip(diff.hunks, patched_file):
+            bounds = (hunk.source_start, hunk.source_length, hunk.target_start, hunk.target_length)
+            assert bounds == (
+                reference.source_start,
+                reference.source_length,
+                reference.target_start,
+                reference.target_length,
+            )
+            lines = [line for line in reference if line.line_type in KINDS]
+            assert hunk.end - hunk.start == len(lines)
+            for index, line in zip(range(hunk.start, hunk.end), lines):
+                assert diff.kinds[index] == KINDS[line.line_type]
+                assert diff.content(index) == line.value.rstrip("\n")
+                if line.source_line_no is not None:
+                    assert diff.old_lines[index] == line.source_line_no
+                if line.target_line_no is not None:
+                    assert diff.new_lines[index] == line.target_line_no
+
+
+def test_matches_unidiff_on_generated_diffs():
+    rng = random.Random(6)
+    for _ in range(300):
+        _assert_same(_diff(rng))
+
+
+def test_no_newline_marker_and_countless_headers():
+    text = (
+        "--- a/x.py\n+++ b/x.py\n"
+        "@@ -1 +1 @@\n-a\n\\ No newline at end of file\n+b\n\\ No newline at end of file\n"
+    )
+    _assert_same(text)
+    (diff,) = parse_diff(text)
+    assert list(diff.kinds) == [REMOVED, ADDED]
+    assert (diff.old_lines[0], diff.new_lines[1]) == (1, 1)
+
+
+def test_crlf_lines_keep_their_carriage_return():
+    text = "--- a/x.py\n+++ b/x.py\n@@ -1,2 +1,2 @@\n keep\r\n-old\r\n+new\r\n"
+    _assert_same(text)
+    (diff,) = parse_diff(text)
+    assert diff.content(2) == "new\r"
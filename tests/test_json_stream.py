@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+from typing import List
+
+from agent_mr_reviewer.json_stream import JSONArrayStreamParser
+
+
+def _feed(deltas: List[str]) -> tuple:
+    parser = JSONArrayStreamParser()
+    per_delta = [parser.feed(delta) for delta in deltas]
+    return parser, per_delta
+
+
+def test_objects_split_across_deltas_are_emitted_once_complete():
+    parser, per_delta = _feed(['[{"path": "a.py", "li', 'ne": 1}', ', {"path"', ': "b.py"}]'])
+    assert per_delta == [[], [], [{"path": "a.py", "line": 1}], [{"path": "b.py"}]]
+    assert parser.finished and parser.pending() == ""
+
+
+def test_every_character_as_its_own_delta():
+    text = '[{"message": "x"}, {"message": "y"}]'
+    parser, per_delta = _feed(list(text))
+    assert [item for items in per_delta for item in items] == [{"message": "x"}, {"message": "y"}]
+    assert parser.finished
+
+
+def test_brackets_and_braces_inside_strings():
+    text = '[{"message": "use a[0] and {k} or ]"}, {"message": "}{]["}]'
+    parser, per_delta = _feed([text[:14], text[14:30], text[30:]])
+    items = [item for items in per_delta for item in items]
+    assert items == [{"message": "use a[0] and {k} or ]"}, {"message": "}{]["}]
+    assert parser.finished
+
+
+def test_escaped_quotes_and_backslashes():
+    text = r'[{"message": "say \"hi\" ]"}, {"message": "path C:\\dir\\"}]'
+    # Split right after a backslash: the escape spans two deltas.
+    split = text.index("\\") + 1
+    parser, per_delta = _feed([text[:split], text[split:]])
+    items = [item for items in per_delta for item in items]
+    assert items == [{"message": 'say "hi" ]'}, {"message": "path C:\\dir\\"}]
+
+
+def test_markdown_fences_and_prose_are_skipped():
+    parser, per_delta = _feed(["Here you go:\n```json\n", '[{"line": 3}]', "\n```\nDone."])
+    assert per_delta[1] == [{"line": 3}]
+    assert parser.finished
+    assert parser.remainder() == "\n```\nDone."
+
+
+def test_trailing_commas_are_repaired_and_invalid_items_dropped():
+    parser, per_delta = _feed(['[{"line": 1,}, {oops}, {"line": 2}]'])
+    assert per_delta == [[{"line": 1}, {"line": 2}]]
+    assert (parser.repaired, parser.invalid) == (1, 1)
+
+
+def test_truncated_final_element_is_left_pending():
+    parser, per_delta = _feed(['[{"line": 1}, {"line": 2, "message": "cut sho'])
+    assert per_delta == [[{"line": 1}]]
+    assert not parser.finished
+    assert parser.pending() == '{"line": 2, "message": "cut sho'
@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, Tuple
+
+from agent_mr_reviewer.llm_client import OpenAICompatibleClient
+from agent_mr_reviewer.llm_review import FINDINGS_SCHEMA
+from benchmarks.fake_servers import FakeLLM
+
+
+class StrictLLM(FakeLLM):
+    # Rejects the response_format types it does not know with a generic 400
+    # that never names the field, like most self-hosted endpoints.
+
+    def __init__(self, accepted: Tuple[str, ...]) -> None:
+        super().__init__()
+        self.accepted = accepted
+        self.formats: List[str] = []
+
+    def route(
+        self, method: str, path: str, query: Dict[str, str], body: Any
+    ) -> Tuple[int, Dict[str, str], Any]:
+        sent = (body.get("response_format") or {}).get("type", "none")
+        self.formats.append(sent)
+        if sent != "none" and sent not in self.accepted:
+            return 400, {}, {"error": {"message": "invalid request"}}
+        return super().route(method, path, query, body)
+
+
+def _chat(server: StrictLLM, json_mode: str) -> OpenAICompatibleClient:
+    client = OpenAICompatibleClient(server.url, "key", "model", json_mode=json_mode)
+    messages = [{"role": "user", "content": "review"}]
+    for _ in range(2):
+        client.chat(messages, json_schema=FINDINGS_SCHEMA)
+    return client
+
+
+def test_schema_falls_back_to_object_on_a_generic_400():
+    with StrictLLM(accepted=("json_object",)) as server:
+        client = _chat(server, "schema")
+    assert client.json_mode == "object"
+    assert server.formats == ["json_schema", "json_object", "json_object"]
+    assert client.metrics.counters["llm_json_mode_downgrades"] == 1
+
+
+def test_schema_falls_back_to_off_when_no_format_is_accepted():
+    with StrictLLM(accepted=()) as server:
+        client = _chat(server, "schema")
+    assert client.json_mode == "off"
+    assert server.formats == ["json_schema", "json_object", "none", "none"]
+
+
+def test_accepted_schema_is_kept():
+    with StrictLLM(accepted=("json_schema",)) as server:
+        client = _chat(server, "schema")
+    assert client.json_mode == "schema"
+    assert server.formats == ["json_schema", "json_schema"]
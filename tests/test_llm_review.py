@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+from typing import List
+
+import pytest
+
+from agent_mr_reviewer import llm_review
+from agent_mr_reviewer.diff_parser import parse_diff
+from agent_mr_reviewer.llm_cache import LLMCache
+from agent_mr_reviewer.metrics import RunMetrics
+
+DIFF = "--- a/app.py\n+++ b/app.py\n@@ -1,1 +1,2 @@\n x = 1\n+print(x)\n"
+FINDING = '{"path": "app.py", "line": 2, "severity": "low", "message": "Use logging."}'
+
+
+class ByteEncoding:
+    # Stand-in for cl100k_base, which needs a download: one token per byte.
+    def encode(self, text: str) -> List[int]:
+        return list(text.encode())
+
+    def decode(self, tokens: List[int]) -> str:
+        return bytes(tokens).decode(errors="ignore")
+
+
+class FakeClient:
+    model = "model"
+    base_url = "http://llm"
+
+    def __init__(self, replies: List[str], json_mode: str = "off") -> None:
+        self.replies = list(replies)
+        self.json_mode = json_mode
+        self.calls = 0
+        self.metrics = RunMetrics()
+
+    def chat(self, messages, **kwargs) -> str:
+        self.calls += 1
+        return self.replies.pop(0)
+
+    def chat_stream(self, messages, **kwargs):
+        reply = self.chat(messages)
+        for start in range(0, len(reply), 7):
+            yield reply[start : start + 7]
+
+
+@pytest.fixture(autouse=True)
+def byte_encoding(monkeypatch):
+    monkeypatch.setattr(llm_review, "get_encoding", ByteEncoding)
+
+
+def _review(client: FakeClient, cache: LLMCache) -> list:
+    return llm_review.map_reduce_review(
+        client, {"title": "T"}, parse_diff(DIFF), cache=cache, repair=False
+    )
+
+
+def test_cache_key_depends_on_json_mode(tmp_path):
+    cache = LLMCache(str(tmp_path))
+    assert len(_review(FakeClient([f"[{FINDING}]"], json_mode="off"), cache)) == 1
+    schema_client = FakeClient([f"[{FINDING}]"], json_mode="schema")
+    assert len(_review(schema_client, cache)) == 1
+    assert schema_client.calls == 1
+    off_client = FakeClient([])
+    assert len(_review(off_client, cache)) == 1
+    assert off_client.calls == 0
+
+
+def test_replies_that_do_not_parse_are_not_cached(tmp_path):
+    cache = LLMCache(str(tmp_path))
+    assert _review(FakeClient(["Sorry, I cannot review this."]), cache) == []
+    assert _review(FakeClient([f"[{FINDING}, {{\"path\": "]), cache) != []
+    assert cache.writes == 0
+    client = FakeClient([f"[{FINDING}]"])
+    assert len(_review(client, cache)) == 1
+    assert client.calls == 1
+    assert cache.writes == 1
+
+
+def test_salvage_skips_a_bracket_in_prose_before_the_array():
+    reply = f"Issues [see below]: [{FINDING}]"
+    extraction = llm_review.extract_findings(reply)
+    assert [finding.line for finding in extraction.findings] == [2]
+    assert extraction.dropped == 0
+    # A valid but empty first array is the answer; later brackets are prose.
+    assert llm_review.extract_findings("[] (nothing to report [yet])").findings == []
+
+
+def test_streamed_reply_with_a_bracket_in_prose_keeps_its_findings():
+    client = FakeClient([f"Issues [see below]: [{FINDING}]"])
+    findings = llm_review.map_reduce_review(
+        client, {"title": "T"}, parse_diff(DIFF), stream=True, repair=False
+    )
+    assert [finding.line for finding in findings] == [2]
+
+
+def test_description_longer_than_a_chunk_is_cut_to_fit(capsys):
+    mr = {"title": "T", "description": "Background. " * 1000}
+    client = FakeClient([f"[{FINDING}]"])
+    findings = llm_review.map_reduce_review(
+        client, mr, parse_diff(DIFF), chunk_tokens=4000, repair=False
+    )
+    assert [finding.line for finding in findings] == [2]
+    assert "description cut" in capsys.readouterr().err
+
+
+def test_description_is_dropped_when_the_fixed_prompt_fills_the_chunk():
+    encoding = llm_review.get_encoding()
+    mr = {"title": "T", "description": "Background. " * 1000}
+    fixed = llm_review.prompt_overhead_tokens({"title": "T"}, encoding)
+    fitted, chars = llm_review.fit_description(mr, encoding, fixed + 10, warn=False)
+    assert fitted["description"] == "" and chars == 0
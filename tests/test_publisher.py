@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+import requests
+
+from agent_mr_reviewer import publisher
+from agent_mr_reviewer.publisher import InlineComment, publish_discussions
+from agent_mr_reviewer.review_rules import Finding
+
+
+class FlakyClient:
+    def __init__(self) -> None:
+        self.posts = 0
+
+    def post_discussion(self, project_id, mr_iid, body, position):
+        self.posts += 1
+        if self.posts == 1:
+            raise requests.exceptions.ChunkedEncodingError("connection broken")
+        return {"id": f"d{self.posts}"}
+
+    def list_discussions(self, project_id, mr_iid):
+        return []
+
+
+def test_any_request_error_is_retried_and_never_stops_the_others(monkeypatch):
+    monkeypatch.setattr(publisher, "backoff_delay", lambda attempt: 0)
+    comments = [
+        InlineComment(Finding("app.py", line, "Use logging.", "low", "PRINT_LOGGING"), "body", {})
+        for line in (1, 2)
+    ]
+    results = publish_discussions(FlakyClient(), "1", "1", comments, workers=1)
+    assert [result.ok for result in results] == [True, True]
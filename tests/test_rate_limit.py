@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+
+import requests
+
+from agent_mr_reviewer import gitlab_client
+from agent_mr_reviewer.gitlab_client import GitLabClient
+from agent_mr_reviewer.rate_limit import RateLimiter, retry_after_seconds
+
+
+class FakeClock:
+    # sleep() moves the clock forward, so waits are exact and instant.
+    def __init__(self) -> None:
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def _limiter(rpm: int = 0, tpm: int = 0):
+    clock = FakeClock()
+    return RateLimiter(rpm, tpm, clock=clock, sleep=clock.sleep), clock
+
+
+def test_requests_per_minute():
+    limiter, clock = _limiter(rpm=2)
+    limiter.acquire()
+    clock.now += 10
+    limiter.acquire()
+    assert clock.sleeps == []
+    # The third request waits for the first one to leave the window.
+    limiter.acquire()
+    assert clock.sleeps == [50.0]
+
+
+def test_tokens_per_minute():
+    limiter, clock = _limiter(tpm=1000)
+    limiter.acquire(600)
+    clock.now += 20
+    limiter.acquire(300)
+    assert clock.sleeps == []
+    limiter.acquire(300)
+    assert clock.sleeps == [40.0]
+
+
+def test_a_request_larger_than_the_token_limit_still_goes_through():
+    limiter, clock = _limiter(tpm=1000)
+    limiter.acquire(5000)
+    assert clock.sleeps == []
+    limiter.acquire(1)
+    assert clock.sleeps == [60.0]
+
+
+def test_pause_delays_every_caller():
+    limiter, clock = _limiter()
+    limiter.pause(7)
+    limiter.pause(3)
+    limiter.acquire()
+    assert clock.sleeps == [7.0]
+
+
+def test_retry_after_values():
+    now = datetime(2024, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+    assert retry_after_seconds({"Retry-After": "12"}) == 12.0
+    assert retry_after_seconds({"Retry-After": "-3"}) == 0.0
+    assert retry_after_seconds({"Retry-After": "Mon, 01 Jan 2024 12:00:30 GMT"}, now) == 30.0
+    assert retry_after_seconds({"Retry-After": "Mon, 01 Jan 2024 11:00:00 GMT"}, now) == 0.0
+    assert retry_after_seconds({"Retry-After": "soon"}) is None
+    assert retry_after_seconds({}) is None
+
+
+class FakeSession:
+    def __init__(self, responses) -> None:
+        self.responses = list(responses)
+        self.headers = {}
+
+    def mount(self, prefix, adapter) -> None:
+        pass
+
+    def request(self, method, url, **kwargs):
+        return self.responses.pop(0)
+
+
+def _response(status: int, headers=None) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    response._content = b"{}"
+    return response
+
+
+def test_gitlab_429_waits_for_retry_after_and_pauses_the_limiter(monkeypatch):
+    limiter, clock = _limiter()
+    monkeypatch.setattr(gitlab_client.time, "sleep", clock.sleep)
+    client = GitLabClient("http://gitlab", "token", rate_limiter=limiter)
+    client.session = FakeSession([_response(429, {"Retry-After": "7"}), _response(200)])
+    assert client._request("GET", "/projects/1") == {}
+    # The client sleeps 7 s itself; the limiter pause has expired by then.
+    assert clock.sleeps == [7.0]
+    assert limiter._paused_until == 1007.0
+    assert client.metrics.counters["gitlab_throttled"] == 1
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+from agent_mr_reviewer.incremental import head_marker
+from agent_mr_reviewer.metrics import RunMetrics
+from agent_mr_reviewer.publisher import finding_marker
+from agent_mr_reviewer.reconcile import Reconciler
+from agent_mr_reviewer.review_rules import Finding
+from agent_mr_reviewer.reviewer import run_review
+
+HEAD = "b" * 40
+DIFF = "@@ -1,1 +1,4 @@\n x = 1\n+print(x)\n+# TODO fix\n+value = 1  \n"
+PRINT_MESSAGE = "Avoid print in production code; use logging."
+PRINT = Finding("app.py", 2, PRINT_MESSAGE, "medium", "PRINT_LOGGING")
+TODO = Finding(
+    "app.py", 3, "TODO without ticket reference; add an issue key.", "medium", "TODO_TICKET"
+)
+CLASS = Finding("app.py", 9, "Class name should be PascalCase.", "medium", "CLASS_NAMING")
+GONE = Finding("gone.py", 4, PRINT_MESSAGE, "medium", "PRINT_LOGGING")
+
+
+def _discussion(discussion_id: str, finding: Finding, line: int, resolved: bool = False) -> dict:
+    note = {
+        "body": f"[{finding.severity}] {finding.message}\n\n{finding_marker(finding)}",
+        "position": {"new_path": finding.path, "new_line": line},
+        "resolved": resolved,
+    }
+    return {"id": discussion_id, "notes": [note]}
+
+
+DISCUSSIONS = [
+    # Same finding, moved from line 7 to line 2 by a later push.
+    _discussion("d1", PRINT, 7),
+    _discussion("d2", GONE, 4),
+    # Resolved by a reviewer: neither reopened nor posted again.
+    _discussion("d3", TODO, 3, resolved=True),
+    _discussion("d4", CLASS, 9),
+    {"id": "d5", "notes": [{"body": "Please rename this.", "position": {}}]},
+]
+
+
+class FakeClient:
+    def __init__(self, notes=(), delta=None) -> None:
+        self.metrics = RunMetrics()
+        self.notes = list(notes)
+        self.delta = delta
+        self.posted = []
+        self.resolved = []
+        self.summaries = []
+
+    def get_merge_request(self, project_id, mr_iid):
+        return {"title": "T", "diff_refs": {"base_sha": "a" * 40, "head_sha": HEAD}}
+
+    def iter_diffs(self, project_id, mr_iid):
+        return iter([{"diff": DIFF, "old_path": "app.py", "new_path": "app.py"}])
+
+    def list_discussions(self, project_id, mr_iid):
+        return DISCUSSIONS
+
+    def count_commits(self, project_id, mr_iid):
+        return 1
+
+    def iter_notes(self, project_id, mr_iid):
+        return iter(self.notes)
+
+    def compare(self, project_id, from_sha, to_sha):
+        return {"diffs": self.delta}
+
+    def post_discussion(self, project_id, mr_iid, body, position):
+        self.posted.append((position["new_path"], position["new_line"]))
+        return {"id": f"new{len(self.posted)}"}
+
+    def resolve_discussion(self, project_id, mr_iid, discussion_id, resolved=True):
+        self.resolved.append(discussion_id)
+        return {}
+
+    def post_note(self, project_id, mr_iid, body):
+        self.summaries.append(body)
+        return {"id": 1}
+
+    def update_note(self, project_id, mr_iid, note_id, body):
+        self.summaries.append(body)
+        return {"id": note_id}
+
+
+def _run(client: FakeClient, dry_run: bool = False, incremental: bool = False) -> None:
+    run_review(
+        client,
+        "1",
+        "1",
+        max_comments=10,
+        summary_only=False,
+        dry_run=dry_run,
+        llm_client=None,
+        llm_max_context=0,
+        llm_chunk_tokens=12000,
+        incremental=incremental,
+        gitlab_workers=1,
+    )
+
+
+def test_only_bot_discussions_are_tracked():
+    reconciler = Reconciler(DISCUSSIONS)
+    assert [item.discussion_id for item in reconciler.existing] == ["d1", "d2", "d3", "d4"]
+
+
+def test_a_moved_finding_keeps_its_discussion():
+    reconciler = Reconciler(DISCUSSIONS)
+    assert reconciler.claim(PRINT)
+    assert [item.discussion_id for item in reconciler.kept] == ["d1"]
+    # One discussion per finding: a second identical finding is posted.
+    assert not reconciler.claim(PRINT)
+
+
+def test_stale_discussions():
+    reconciler = Reconciler(DISCUSSIONS)
+    reconciler.claim(PRINT)
+    # app.py reviewed in full without the class finding; gone.py left the diff.
+    stale = reconciler.stale([PRINT], {"app.py"}, {"app.py"})
+    assert sorted(item.discussion_id for item in stale) == ["d2", "d4"]
+    # Incremental review: no file was reviewed in full.
+    stale = reconciler.stale([PRINT], set(), {"app.py"})
+    assert [item.discussion_id for item in stale] == ["d2"]
+
+
+def test_resolved_discussions_are_not_reopened_or_reposted():
+    reconciler = Reconciler(DISCUSSIONS)
+    assert reconciler.claim(TODO)
+    assert all(item.discussion_id != "d3" for item in reconciler.stale([], {"app.py"}, set()))
+
+
+def test_review_keeps_posts_and_resolves():
+    client = FakeClient()
+    _run(client)
+    # Only the trailing whitespace finding is new.
+    assert client.posted == [("app.py", 4)]
+    assert sorted(client.resolved) == ["d2", "d4"]
+    summary = client.summaries[-1]
+    assert "- Inline comments posted: 1" in summary
+    assert "(not posted again): 2" in summary
+    assert "(finding no longer reported): 2" in summary
+
+
+def test_dry_run_prints_keep_inline_and_resolve(capsys):
+    client = FakeClient()
+    _run(client, dry_run=True)
+    out = capsys.readouterr().out
+    assert "KEEP app.py:7 (discussion d1)" in out
+    assert "KEEP app.py:3 (discussion d3)" in out
+    assert "INLINE app.py:4 " in out
+    assert "RESOLVE gone.py:4 (discussion d2)" in out
+    assert client.posted == [] and client.resolved == []
+
+
+def test_incremental_review_only_resolves_files_that_left_the_diff():
+    notes = [{"id": 5, "body": head_marker("c" * 40)}]
+    change = {"diff": "@@ -3,0 +4,1 @@\n+value = 1  \n", "old_path": "app.py", "new_path": "app.py"}
+    delta = [change]
+    client = FakeClient(notes, delta)
+    _run(client, incremental=True)
+    assert client.posted == [("app.py", 4)]
+    # The class finding may still be there: only the delta was reviewed.
+    assert client.resolved == ["d2"]
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import random
+import re
+
+import pytest
+
+from agent_mr_reviewer.diff_parser import parse_diff
+from agent_mr_reviewer.review_rules import PASCAL_CASE, SNAKE_CASE, TICKET_PATTERN, analyze_diff
+
+unidiff = pytest.importorskip("unidiff")
+
+CONTENT = [
+    "def foo(x):",
+    "def FooBar():",
+    "async def Fetch():",
+    '    """Docstring."""',
+    "    '''Docstring.'''",
+    "class foo_bar:",
+    "class Good(Base):",
+    "\tclass  lower:",
+    "classic = 1",
+    "defer = 2",
+    "print('x')",
+    "  print(1)",
+    "log.print(1)",
+    "x = print",
+    "x = 1  ",
+    "# TODO fix",
+    "# TODO: ABC-12 done",
+    "return value",
+    "",
+    "y" * 130,
+]
+
+
+def _per_rule_loop(patch) -> list:
+    # The rule cascade before the compiled engine: every rule is checked
+    # on every added line, in order.
+    findings = []
+    for patched_file in patch:
+        for hunk in patched_file:
+            hunk_lines = list(hunk)
+            for index, line in enumerate(hunk_lines):
+                if not line.is_added:
+                    continue
+                content = line.value.rstrip("\n")
+                found = []
+                if content.rstrip() != content:
+                    found.append("TRAILING_WS")
+                if len(content) > 120:
+                    found.append("LINE_LENGTH")
+                if "TODO" in content and not TICKET_PATTERN.search(content):
+                    found.append("TODO_TICKET")
+                if re.match(r"\s*print\(", content):
+                    found.append("PRINT_LOGGING")
+                def_match = re.match(r"\s*def\s+([A-Za-z_][A-Za-z0-9_]*)\s*\(", content)
+                if def_match:
+                    if not SNAKE_CASE.match(def_match.group(1)):
+                        found.append("FUNC_NAMING")
+                    following = hunk_lines[index + 1 : index + 4]
+                    if not any(
+                        other.is_added and ('"""' in other.value or "'''" in other.value)
+                        for other in following
+                    ):
+                        found.append("FUNC_DOC")
+                class_match = re.match(r"\s*class\s+([A-Za-z_][A-Za-z0-9_]*)", content)
+                if class_match and not PASCAL_CASE.match(class_match.group(1)):
+                    found.append("CLASS_NAMING")
+                findings += [(patched_file.path, line.target_line_no, rule) for rule in found]
+    return findings
+
+
+def _diff(rng: random.Random) -> str:
+    lines = []
+    for number in range(rng.randint(1, 3)):
+        path = f"src/f{number}.py"
+        lines += [f"--- a/{path}", f"+++ b/{path}"]
+        for start in range(1, 40 * rng.randint(1, 3), 40):
+            body = [rng.choice("+++- ") + rng.choice(CONTENT) for _ in range(rng.randint(1, 15))]
+            old_count = sum(1 for line in body if line[0] != "+")
+            new_count = sum(1 for line in body if line[0] != "-")
+            lines += [f"@@ -{start},{old_count} +{start},{new_count} @@"] + body
+    return "\n".join(lines) + "\n"
+
+
+def test_engine_matches_the_per_rule_loop():
+    rng = random.Random(4)
+    for _ in range(300):
+        text = _diff(rng)
+        findings = analyze_diff(parse_diff(text))
+        found = [(finding.path, finding.line, finding.rule_id) for finding in findings]
+        assert found == _per_rule_loop(unidiff.PatchSet(text)), text
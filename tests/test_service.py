@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+from http.client import HTTPConnection
+from http.server import ThreadingHTTPServer
+import threading
+import time
+
+import pytest
+
+from agent_mr_reviewer import service
+from agent_mr_reviewer.service import ReviewQueue, ReviewService, WebhookHandler
+
+
+class FakeSetup:
+    def __init__(self) -> None:
+        self.prunes = 0
+
+    def prune_caches(self) -> None:
+        self.prunes += 1
+
+
+def test_tracked_heads_are_capped(monkeypatch):
+    monkeypatch.setattr(service, "MAX_TRACKED_HEADS", 3)
+    queue = ReviewQueue(coalesce_seconds=0, max_pending=100)
+    for iid in range(5):
+        queue.submit("1", str(iid), f"sha{iid}")
+    assert list(queue._last_head) == [("1", "2"), ("1", "3"), ("1", "4")]
+    # The newest heads still drop redelivered webhooks.
+    assert queue.submit("1", "4", "sha4") == "duplicate"
+
+
+def test_caches_are_pruned_between_jobs(monkeypatch):
+    monkeypatch.setattr(service, "review", lambda setup, project_id, mr_iid: None)
+    setup = FakeSetup()
+    reviewer = ReviewService(setup, workers=1, coalesce_seconds=0, prune_interval=0)
+    reviewer.queue.submit("1", "7", "abc")
+    reviewer.queue.submit("1", "8", "def")
+    reviewer.start()
+    for _ in range(200):
+        if reviewer.stats.completed == 2:
+            break
+        time.sleep(0.01)
+    reviewer.stop()
+    assert reviewer.stats.completed == 2
+    assert setup.prunes == 2
+
+
+@pytest.mark.parametrize(
+    "length, status",
+    [("abc", 400), ("-5", 400), (str(service.MAX_BODY_BYTES + 1), 413)],
+)
+def test_bad_content_length_is_rejected(length, status):
+    reviewer = ReviewService(FakeSetup(), workers=1)
+    handler = type("BoundWebhookHandler", (WebhookHandler,), {"service": reviewer})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        connection = HTTPConnection(*server.server_address[:2], timeout=5)
+        connection.putrequest("POST", "/")
+        connection.putheader("Content-Length", length)
+        connection.endheaders()
+        assert connection.getresponse().status == status
+        connection.close()
+    finally:
+        server.shutdown()
+        server.server_close()
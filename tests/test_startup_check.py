@@ -0,0 +1,16 @@
+from __future__ import annotations
+
+from agent_mr_reviewer import startup_check
+
+
+def test_cli_import_does_not_load_the_tokenizer():
+    timings = startup_check.measure_imports()
+    assert startup_check.ENTRY_MODULE in timings
+    loaded = {name.split(".", 1)[0] for name in timings}
+    assert not loaded & set(startup_check.FORBIDDEN_MODULES)
+
+
+def test_check_passes_with_a_loose_time_limit(capsys):
+    # The limit only guards against gross regressions on a loaded CI runner.
+    assert startup_check.main(["--max-ms", "5000", "--runs", "1"]) == 0
+    assert "FAILED" not in capsys.readouterr().err
@@ -0,0 +1,23 @@
+from __future__ import annotations
+
+from agent_mr_reviewer.llm_summary import build_llm_summary
+from agent_mr_reviewer.publisher import CommentCounts
+from agent_mr_reviewer.review_rules import Finding
+from agent_mr_reviewer.reviewer import _build_summary
+
+FINDINGS = [Finding("app.py", line, "Avoid print.", "medium", "PRINT_LOGGING") for line in range(8)]
+
+
+def test_rerun_reports_kept_comments_not_posted_ones():
+    counts = CommentCounts(posted=0, kept=8, resolved=2)
+    summary = _build_summary({"title": "T"}, 1, FINDINGS, counts)
+    assert "- Inline comments posted: 0" in summary
+    assert "- Inline comments already on the MR (not posted again): 8" in summary
+    assert "- Discussions resolved (finding no longer reported): 2" in summary
+    assert "failed" not in summary
+
+
+def test_llm_summary_reports_publisher_counts():
+    summary = build_llm_summary({"title": "T"}, FINDINGS, CommentCounts(posted=5, failed=3))
+    assert "- Inline comments posted: 5" in summary
+    assert "- Inline comments failed: 3" in summary
@@ -0,0 +1,17 @@
+from __future__ import annotations
+
+from agent_mr_reviewer import tokenizer
+
+
+def test_configure_keeps_the_loaded_encoding_unless_settings_change(monkeypatch):
+    monkeypatch.setattr(tokenizer, "_file", None)
+    monkeypatch.setattr(tokenizer, "_cache_dir", None)
+    loaded = object()
+    monkeypatch.setattr(tokenizer, "_encoding", loaded)
+    tokenizer.configure()
+    assert tokenizer.get_encoding() is loaded
+    tokenizer.configure(cache_dir="/tmp/tiktoken")
+    assert tokenizer._encoding is None
+    monkeypatch.setattr(tokenizer, "_encoding", loaded)
+    tokenizer.configure(cache_dir="/tmp/tiktoken")
+    assert tokenizer.get_encoding() is loaded
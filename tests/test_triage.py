@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+from agent_mr_reviewer.diff_parser import FileDiff, parse_change, parse_changes
+from agent_mr_reviewer.triage import Triage, classify_hunk
+
+
+def _diff(path: str, lines: list) -> FileDiff:
+    old_count = sum(1 for line in lines if line[:1] in (" ", "-"))
+    new_count = sum(1 for line in lines if line[:1] in (" ", "+"))
+    text = f"@@ -1,{old_count} +1,{new_count} @@\n" + "\n".join(lines) + "\n"
+    diff = parse_change({"diff": text, "old_path": path, "new_path": path})
+    assert diff is not None
+    return diff
+
+
+def _classify(path: str, lines: list):
+    diff = _diff(path, lines)
+    return classify_hunk(diff, diff.hunks[0])
+
+
+def test_swapped_statements_are_not_a_reorder():
+    lines = ["-    validate(order)", "-    save(order)", "+    save(order)", "+    validate(order)"]
+    assert _classify("shop/orders.py", lines) is None
+
+
+def test_swapped_imports_are_a_reorder():
+    lines = ["-import sys", "-import os", "+import os", "+import sys"]
+    assert _classify("shop/orders.py", lines) == "reorder"
+    lines = ['-\t"os"', '-\t"fmt"', '+\t"fmt"', '+\t"os"']
+    assert _classify("main.go", lines) == "reorder"
+    lines = [
+        "-#include <stdio.h>",
+        "-#include <assert.h>",
+        "+#include <assert.h>",
+        "+#include <stdio.h>",
+    ]
+    assert _classify("main.c", lines) == "reorder"
+
+
+def test_python_dedent_is_not_whitespace():
+    lines = [" if ready:", "-        return value", "+    return value"]
+    assert _classify("app.py", lines) is None
+
+
+def test_yaml_and_makefile_reindent_are_not_whitespace():
+    assert _classify("ci.yml", [" jobs:", "-  build:", "+build:"]) is None
+    assert _classify("Makefile", [" all:", "-\tcc main.c", "+cc main.c"]) is None
+
+
+def test_reindent_of_brace_language_is_whitespace():
+    lines = [" if (ready) {", "-  run();", "+    run();"]
+    assert _classify("app.js", lines) == "whitespace"
+
+
+def test_pointer_dereference_is_not_a_comment():
+    lines = ["-*out = 0;", "+*out = len;"]
+    assert _classify("copy.c", lines) is None
+
+
+def test_block_comment_lines_are_comments():
+    lines = [" /*", "- * Old wording.", "+ * New wording.", " */"]
+    assert _classify("copy.c", lines) == "comment"
+    lines = ["+/**", "+ * Returns the length.", "+ */"]
+    assert _classify("copy.c", lines) == "comment"
+
+
+def test_code_after_a_removed_block_opener_is_not_a_comment():
+    lines = ["-/*", "+run();", " */"]
+    assert _classify("app.js", lines) is None
+
+
+def test_token_boundaries_are_not_whitespace():
+    assert _classify("app.js", ["-return x;", "+returnx;"]) is None
+    assert _classify("app.js", ["-y = a - -b;", "+y = a --b;"]) is None
+    assert _classify("app.js", ["-  y = a  +  b;", "+y = a + b;"]) == "whitespace"
+
+
+def test_whitespace_inside_a_string_is_not_whitespace():
+    lines = ['-const label = "Total: " + n;', '+const label = "Total:" + n;']
+    assert _classify("app.js", lines) is None
+    lines = ['-const label = `a  ${b}`;', '+const label = `a ${b}`;']
+    assert _classify("app.js", lines) is None
+
+
+def test_pure_renames_are_counted_before_parsing():
+    # GitLab sends no diff for a pure rename: the parser drops the change,
+    # so triage counts it on the raw changes.
+    changes = [
+        {"diff": "", "old_path": "a.py", "new_path": "b.py", "renamed_file": True},
+        {"diff": "@@ -1 +1 @@\n-x = 1\n+x = 2\n", "old_path": "c.py", "new_path": "c.py"},
+    ]
+    triage = Triage()
+    files = list(triage.filter(parse_changes(triage.count_renames(changes))))
+    assert [diff.path for diff in files] == ["c.py"]
+    assert triage.summary_line() == "- Triaged out before the LLM (hunks): rename-only files: 1"